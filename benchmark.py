@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2012-2014 Johannes 'josch' Schauer <j.schauer at email.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the throughput of img2pdf
+
+Synthetic input images are generated from a fixed seed, so that every run
+works on the same data. Each corpus is converted end to end with convert()
+and stage by stage (reading the input, adding the pages and writing the
+PDF), once with pdfrw and once with the internal PDF writer. The results
+are printed as JSON. Passing the JSON output of an earlier run with
+--compare reports the change of each measurement and fails if the
+throughput went down by more than the given threshold.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import io
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "src"))
+
+import img2pdf  # noqa: E402
+from PIL import Image  # noqa: E402
+
+timer = getattr(time, "perf_counter", time.time)
+
+# name, file extension and whether all pages are frames of a single file
+FORMATS = [
+    ("jpeg", "jpg", False),
+    ("png", "png", False),
+    ("tiff-1bit", "tif", False),
+    ("tiff-cmyk", "tif", False),
+    ("gif-multi", "gif", True),
+    ("tiff-multi", "tif", True),
+    ("jpeg2000", "jp2", False),
+]
+
+
+def make_image(mode, width, height, seed):
+    """Return a deterministic image of the given mode and size
+
+    Random pixels at an eighth of the resolution are scaled up, which gives
+    smooth content that compresses somewhat like a scan or a photo.
+    """
+    rnd = random.Random(seed)
+    w, h = width // 8 + 1, height // 8 + 1
+    bands = 4 if mode == "CMYK" else 3
+    data = bytearray(rnd.getrandbits(8) for _ in range(w * h * bands))
+    im = Image.frombytes("CMYK" if bands == 4 else "RGB", (w, h),
+                         bytes(data))
+    im = im.resize((width, height), Image.BILINEAR)
+    if mode == "1":
+        im = im.convert("L").point(lambda x: 255 if x > 127 else 0)
+        return im.convert("1")
+    if mode != im.mode:
+        im = im.convert(mode)
+    return im
+
+
+def write_corpus(fmt, width, height, pages, directory):
+    """Write the input images of a corpus and return their paths"""
+    ext, multi = [(e, m) for f, e, m in FORMATS if f == fmt][0]
+    if fmt == "jpeg":
+        mode, kwargs = "RGB", dict(format="JPEG", quality=90)
+    elif fmt == "png":
+        mode, kwargs = "RGB", dict(format="PNG")
+    elif fmt == "tiff-1bit":
+        mode, kwargs = "1", dict(format="TIFF", compression="group4")
+    elif fmt == "tiff-cmyk":
+        mode, kwargs = "CMYK", dict(format="TIFF")
+    elif fmt == "gif-multi":
+        mode, kwargs = "P", dict(format="GIF")
+    elif fmt == "tiff-multi":
+        mode, kwargs = "RGB", dict(format="TIFF", compression="tiff_lzw")
+    elif fmt == "jpeg2000":
+        mode, kwargs = "RGB", dict(format="JPEG2000")
+    else:
+        raise ValueError("unknown format: %s" % fmt)
+    # without a resolution, some writers store one dot per inch which would
+    # make the pages too large
+    kwargs["dpi"] = (300, 300)
+    images = [make_image(mode, width, height, seed) for seed in range(pages)]
+    if multi:
+        path = os.path.join(directory, "%s-%dx%d-%d.%s"
+                            % (fmt, width, height, pages, ext))
+        images[0].save(path, save_all=True, append_images=images[1:],
+                       **kwargs)
+        return [path]
+    paths = []
+    for i, im in enumerate(images):
+        path = os.path.join(directory, "%s-%dx%d-%d.%s"
+                            % (fmt, width, height, i, ext))
+        im.save(path, **kwargs)
+        paths.append(path)
+    return paths
+
+
+def time_convert(paths, with_pdfrw):
+    """Convert the inputs end to end and return the time and output size
+
+    Without an output stream, convert() keeps the PDF in memory until all
+    pages are added like time_stages() does, so that the total and the
+    stages measure the same code path.
+    """
+    start = timer()
+    output = img2pdf.convert(paths, with_pdfrw=with_pdfrw, nodate=True)
+    return timer() - start, len(output)
+
+
+def time_stages(paths, with_pdfrw):
+    """Convert the inputs like convert() does and time each stage
+
+    The PDF is kept in memory until all pages are added, so that writing it
+    is timed separately.
+    """
+    times = {}
+    start = timer()
+    frames = []
+    for path in paths:
+        frames.extend(img2pdf.read_input_images(path, None))
+    times["read"] = timer() - start
+
+    start = timer()
+    pdf = img2pdf.pdfdoc("1.3", nodate=True, with_pdfrw=with_pdfrw)
+    for color, ndpi, imgformat, imgdata, imgwidthpx, imgheightpx, depth, \
+            decodeparms, inverted, layoutsize in frames:
+        pagewidth, pageheight, imgwidthpdf, imgheightpdf = \
+            img2pdf.default_layout_fun(layoutsize[0], layoutsize[1], ndpi)
+        pdf.add_imagepage(color, imgwidthpx, imgheightpx, imgformat, imgdata,
+                          imgwidthpdf, imgheightpdf,
+                          (pagewidth - imgwidthpdf) / 2.0,
+                          (pageheight - imgheightpdf) / 2.0, pagewidth,
+                          pageheight, depth, decodeparms, inverted)
+    times["pages"] = timer() - start
+
+    start = timer()
+    output = io.BytesIO()
+    pdf.tostream(output)
+    times["write"] = timer() - start
+    return times, len(frames)
+
+
+def run_corpus(fmt, width, height, pages, backends, repeat, directory):
+    paths = write_corpus(fmt, width, height, pages, directory)
+    inputbytes = sum(os.path.getsize(p) for p in paths)
+    results = []
+    for backend in backends:
+        with_pdfrw = backend == "pdfrw"
+        # the fastest of all repetitions is the least disturbed one
+        best = None
+        for _ in range(repeat):
+            seconds, outputbytes = time_convert(paths, with_pdfrw)
+            if best is None or seconds < best:
+                best = seconds
+        stages = {}
+        for _ in range(repeat):
+            times, frames = time_stages(paths, with_pdfrw)
+            for stage, seconds in times.items():
+                if stage not in stages or seconds < stages[stage]:
+                    stages[stage] = seconds
+        for stage, seconds in [("total", best)] + sorted(stages.items()):
+            result = {
+                "format": fmt,
+                "width": width,
+                "height": height,
+                "pages": frames,
+                "backend": backend,
+                "stage": stage,
+                "seconds": seconds,
+                "pages_per_s": frames / seconds if seconds else None,
+                "mb_per_s": inputbytes / seconds / 1e6 if seconds else None,
+                "input_bytes": inputbytes,
+            }
+            if stage == "total":
+                result["output_bytes"] = outputbytes
+            results.append(result)
+    return results
+
+
+def result_key(result):
+    return (result["format"], result["width"], result["height"],
+            result["pages"], result["backend"], result["stage"])
+
+
+def compare(baseline, results, threshold):
+    """Print the change of each result and return the regressed ones
+
+    A result regressed if its pages per second went down by more than the
+    threshold, given as a fraction of the baseline value.
+    """
+    old = dict((result_key(r), r) for r in baseline["results"])
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if key not in old or not old[key]["pages_per_s"] or \
+                not result["pages_per_s"]:
+            continue
+        change = result["pages_per_s"] / old[key]["pages_per_s"] - 1
+        line = "%-10s %5dx%-5d %4d pages %-8s %-6s %+7.1f%%" % (
+            key + (change * 100,))
+        if change < -threshold:
+            line += "  REGRESSION"
+            regressions.append(result)
+        print(line, file=sys.stderr)
+    return regressions
+
+
+def parse_size(string):
+    width, height = string.split("x")
+    return int(width), int(height)
+
+
+def parse_repeat(string):
+    try:
+        repeat = int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError("not an integer: %s" % string)
+    if repeat < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: %s" % string)
+    return repeat
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--formats", default=",".join(f for f, _, _ in FORMATS),
+        help="comma separated list of input formats out of %s (default: all)"
+        % ", ".join(f for f, _, _ in FORMATS))
+    parser.add_argument(
+        "--sizes", default="256x256,1240x1754",
+        help="comma separated list of image sizes in pixels "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--pages", default="1,20",
+        help="comma separated list of page counts (default: %(default)s)")
+    parser.add_argument(
+        "--backends", default="pdfrw,internal",
+        help="comma separated list of PDF writers out of pdfrw and internal "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "--repeat", type=parse_repeat, default=3,
+        help="number of runs of which the fastest is reported "
+        "(default: %(default)s)")
+    parser.add_argument(
+        "-o", "--output", metavar="FILE",
+        help="write the JSON results to FILE instead of standard output")
+    parser.add_argument(
+        "--compare", metavar="FILE",
+        help="compare the results with the JSON results of an earlier run")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="fraction by which pages per second may go down before "
+        "--compare reports a regression (default: %(default)s)")
+    args = parser.parse_args(argv[1:])
+
+    formats = args.formats.split(",")
+    for fmt in formats:
+        if fmt not in [f for f, _, _ in FORMATS]:
+            parser.error("unknown format: %s" % fmt)
+    backends = args.backends.split(",")
+    for backend in backends:
+        if backend not in ["pdfrw", "internal"]:
+            parser.error("unknown backend: %s" % backend)
+    if "pdfrw" in backends:
+        try:
+            import pdfrw  # noqa: F401
+        except ImportError:
+            print("pdfrw is not installed, skipping it", file=sys.stderr)
+            backends.remove("pdfrw")
+
+    results = []
+    skipped = []
+    directory = tempfile.mkdtemp(prefix="img2pdf-benchmark-")
+    try:
+        for fmt in formats:
+            for width, height in [parse_size(s)
+                                  for s in args.sizes.split(",")]:
+                for pages in [int(p) for p in args.pages.split(",")]:
+                    print("%s %dx%d %d pages" % (fmt, width, height, pages),
+                          file=sys.stderr)
+                    try:
+                        results.extend(run_corpus(
+                            fmt, width, height, pages, backends, args.repeat,
+                            directory))
+                    except (IOError, OSError, KeyError) as e:
+                        # for example, PIL without JPEG 2000 support
+                        print("skipping %s: %s" % (fmt, e), file=sys.stderr)
+                        skipped.append({"format": fmt, "reason": str(e)})
+    finally:
+        shutil.rmtree(directory)
+
+    report = {
+        "meta": {
+            "img2pdf": img2pdf.__version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "pil": getattr(Image, "__version__",
+                           getattr(Image, "PILLOW_VERSION", None)),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+        "skipped": skipped,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,8 +13,14 @@ TESTS_REQUIRE = (
     'pdfrw',
 )
 
+PY_MODULES = ['img2pdf', 'jp2', 'jpeg']
+
 if not PY3:
-    INSTALL_REQUIRES += ('enum34',)
+    # concurrent.futures for the workers of convert()
+    INSTALL_REQUIRES += ('enum34', 'futures')
+else:
+    # convert_async() needs Python 3.5
+    PY_MODULES += ['img2pdf_async']
 
 
 setup(
@@ -46,7 +52,7 @@ setup(
     download_url='https://gitlab.mister-muffin.de/josch/img2pdf/repository/'
         'archive.tar.gz?ref=' + VERSION,
     package_dir={"": "src"},
-    py_modules=['img2pdf', 'jp2'],
+    py_modules=PY_MODULES,
     include_package_data=True,
     test_suite='tests.test_suite',
     zip_safe=True,
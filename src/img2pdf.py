@@ -21,10 +21,13 @@
 import sys
 import os
 import zlib
-import argparse
-from PIL import Image
+import struct
+import mmap
+import time
+import hashlib
 from datetime import datetime
 from jp2 import parsejp2
+from jpeg import parsejpeg
 from enum import Enum
 from io import BytesIO
 import logging
@@ -61,7 +64,8 @@ PageOrientation = Enum('PageOrientation', 'portrait landscape')
 
 Colorspace = Enum('Colorspace', 'RGB L 1 CMYK CMYK;I RGBA P other')
 
-ImageFormat = Enum('ImageFormat', 'JPEG JPEG2000 CCITTGroup4 other')
+ImageFormat = Enum('ImageFormat',
+                   'JPEG JPEG2000 CCITTGroup4 LZW PackBits PNG TIFF other')
 
 PageMode = Enum('PageMode', 'none outlines thumbs')
 
@@ -76,6 +80,8 @@ Unit = Enum('Unit', 'pt cm mm inch')
 
 ImgUnit = Enum('ImgUnit', 'pt cm mm inch perc dpi')
 
+FlateStrategy = Enum('FlateStrategy', 'default filtered rle huffman')
+
 
 class NegativeDimensionError(Exception):
     pass
@@ -102,38 +108,98 @@ def my_convert_load(string):
     return string
 
 
-def parse(cont, indent=1):
-    if type(cont) is dict:
-        return b"<<\n"+b"\n".join(
-            [4 * indent * b" " + k + b" " + parse(v, indent+1)
-             for k, v in sorted(cont.items())])+b"\n"+4*(indent-1)*b" "+b">>"
-    elif type(cont) is int:
-        return str(cont).encode()
-    elif type(cont) is float:
-        if int(cont) == cont:
-            return parse(int(cont))
-        else:
-            return ("%0.4f" % cont).rstrip("0").encode()
-    elif isinstance(cont, MyPdfDict):
-        # if cont got an identifier, then addobj() has been called with it
-        # and a link to it will be added, otherwise add it inline
-        if hasattr(cont, "identifier"):
-            return ("%d 0 R" % cont.identifier).encode()
-        else:
-            return parse(cont.content, indent)
-    elif type(cont) is str or isinstance(cont, bytes):
-        if type(cont) is str and type(cont) is not bytes:
+def serialize(cont, out, indent=1):
+    """Append the PDF representation of cont to the bytearray out
+
+    Nested dictionaries and arrays are handled with an explicit stack of the
+    containers that are currently open instead of recursion, and all output
+    goes straight into out.
+    """
+    # The iterator over the entries of the innermost open dictionary or
+    # array, whether it is a dictionary and its indentation level. The same
+    # for all outer open containers are kept on the stack.
+    entries, isdict, level = None, False, indent
+    stack = []
+    end = object()
+    while True:
+        t = type(cont)
+        if t is bytes or t is MyPdfObject:
+            out += cont
+        elif t is int:
+            out += str(cont).encode()
+        elif t is MyPdfDict or t is MyPdfPage:
+            # if cont got an identifier, then addobj() has been called with it
+            # and a link to it will be added, otherwise add it inline
+            if hasattr(cont, "identifier"):
+                out += ("%d 0 R" % cont.identifier).encode()
+                t = None
+            else:
+                cont = cont.content
+                t = dict
+        elif t is float:
+            if int(cont) == cont:
+                out += str(int(cont)).encode()
+            else:
+                out += ("%0.4f" % cont).rstrip("0").encode()
+        elif t is str:
             raise TypeError(
                 "parse must be passed a bytes object in py3. Got: %s" % cont)
-        return cont
-    elif isinstance(cont, list):
-        return b"[ "+b" ".join([parse(c, indent) for c in cont])+b" ]"
-    else:
-        raise TypeError("cannot handle type %s with content %s" % (type(cont),
-                                                                   cont))
+        elif isinstance(cont, bytes):
+            out += cont
+        elif isinstance(cont, list):
+            t = list
+        elif t is not dict:
+            raise TypeError("cannot handle type %s with content %s"
+                            % (type(cont), cont))
+        if t is dict:
+            if cont:
+                out += b"<<"
+                stack.append((entries, isdict, level))
+                entries, isdict, level = iter(sorted(cont.items())), True, \
+                    indent
+            else:
+                out += b"<<\n\n" + 4 * (indent - 1) * b" " + b">>"
+        elif t is list:
+            if cont:
+                out += b"["
+                stack.append((entries, isdict, level))
+                entries, isdict, level = iter(cont), False, indent
+            else:
+                out += b"[  ]"
+        # continue with the next entry of the innermost open container and
+        # close the containers that have no entries left
+        while entries is not None:
+            entry = next(entries, end)
+            if entry is end:
+                if isdict:
+                    out += b"\n" + 4 * (level - 1) * b" " + b">>"
+                else:
+                    out += b" ]"
+                entries, isdict, level = stack.pop()
+            elif isdict:
+                out += b"\n" + 4 * level * b" " + entry[0] + b" "
+                cont = entry[1]
+                indent = level + 1
+                break
+            else:
+                out += b" "
+                cont = entry
+                indent = level
+                break
+        else:
+            return
+
+
+def parse(cont, indent=1):
+    out = bytearray()
+    serialize(cont, out, indent)
+    return bytes(out)
 
 
 class MyPdfDict(object):
+    # there is one instance per pdf object, so do without a __dict__
+    __slots__ = ("content", "stream", "identifier")
+
     def __init__(self, *args, **kw):
         self.content = dict()
         if args:
@@ -150,15 +216,26 @@ class MyPdfDict(object):
             else:
                 self.content[getattr(MyPdfName, key)] = value
 
+    def serialize(self, out):
+        """Append the object up to its stream data to the bytearray out
+
+        Returns the bytes that have to follow the stream data, if any.
+        """
+        out += ("%d 0 obj\n" % self.identifier).encode()
+        serialize(self.content, out)
+        if self.stream is not None:
+            out += b"\nstream\n"
+            return b"\nendstream\nendobj\n"
+        out += b"\nendobj\n"
+        return b""
+
     def tostring(self):
+        out = bytearray()
+        trailer = self.serialize(out)
         if self.stream is not None:
-            return (
-                ("%d 0 obj\n" % self.identifier).encode() +
-                parse(self.content) +
-                b"\nstream\n" + self.stream + b"\nendstream\nendobj\n")
-        else:
-            return ("%d 0 obj\n" % self.identifier).encode() + \
-                   parse(self.content) + b"\nendobj\n"
+            out += self.stream
+        out += trailer
+        return bytes(out)
 
     def __setitem__(self, key, value):
         self.content[key] = value
@@ -167,9 +244,57 @@ class MyPdfDict(object):
         return self.content[key]
 
 
+class MyPdfPage(MyPdfDict):
+    """A page object which only stores the values of its entries
+
+    The dictionary of the page is put together when it is serialized or
+    accessed. Entries other than the ones img2pdf sets are kept in an extra
+    dictionary.
+    """
+    __slots__ = ("mediabox", "resources", "contents", "parent", "other")
+
+    keys = {b"/MediaBox": "mediabox", b"/Resources": "resources",
+            b"/Contents": "contents", b"/Parent": "parent"}
+
+    def __init__(self, indirect=True):
+        self.stream = None
+        self.mediabox = None
+        self.resources = None
+        self.contents = None
+        self.parent = None
+        self.other = None
+
+    @property
+    def content(self):
+        content = {b"/Type": b"/Page"}
+        for key, attr in self.keys.items():
+            value = getattr(self, attr)
+            if value is not None:
+                content[key] = value
+        if self.other is not None:
+            content.update(self.other)
+        return content
+
+    def __setitem__(self, key, value):
+        attr = self.keys.get(key)
+        if attr is not None:
+            setattr(self, attr, value)
+        elif key != b"/Type" or value != b"/Page":
+            if self.other is None:
+                self.other = {}
+            self.other[key] = value
+
+    def __getitem__(self, key):
+        return self.content[key]
+
+
 class MyPdfName():
     def __getattr__(self, name):
-        return b'/' + name.encode('ascii')
+        # cache the name so that the same bytes object is returned for all
+        # further accesses without going through __getattr__ again
+        value = b'/' + name.encode('ascii')
+        setattr(self, name, value)
+        return value
 
 
 MyPdfName = MyPdfName()
@@ -185,23 +310,54 @@ class MyPdfArray(list):
 
 
 class MyPdfWriter():
-    def __init__(self, version="1.3"):
+    # the maximum number of objects in a single object stream
+    objstm_size = 100
+
+    def __init__(self, version="1.3", stream=None, object_streams=False):
         self.objects = []
         # create an incomplete pages object so that a /Parent entry can be
         # added to each page
         self.pages = MyPdfDict(Type=MyPdfName.Pages, Kids=[], Count=0)
         self.catalog = MyPdfDict(Pages=self.pages, Type=MyPdfName.Catalog)
+        # object and cross-reference streams need pdf 1.5
+        if object_streams and version < "1.5":
+            version = "1.5"
         self.version = version  # default pdf version 1.3
         self.pagearray = []
-
-    def addobj(self, obj):
+        # If an output stream is given, the writer works in streaming mode:
+        # the header is written with the objects of the first page and every
+        # object is written as soon as flush() is called. Only the deferred
+        # objects (info, catalog and pages), the cross-reference table and
+        # the trailer are left to be written by tostream(). The deferred
+        # objects thus come last in the file instead of first.
+        self.stream = stream
+        self.pending = []
+        self.deferred = []
+        self.offsets = {}
+        self.pos = 0
+        # reused for serializing each object
+        self.buffer = bytearray()
+        # If object streams are enabled, objects without a stream are not
+        # written directly but collected and written as part of an object
+        # stream, and the cross-reference table becomes a cross-reference
+        # stream. For each object in an object stream, the identifier of the
+        # object stream and the index of the object in it are recorded.
+        self.object_streams = object_streams
+        self.objstm = []
+        self.compressed = {}
+        # the version in the header of a streaming writer, once written
+        self.headerversion = None
+
+    def addobj(self, obj, deferred=False):
         newid = len(self.objects)+1
         obj.identifier = newid
         self.objects.append(obj)
+        if deferred:
+            self.deferred.append(obj)
+        else:
+            self.pending.append(obj)
 
-    def tostream(self, info, stream):
-        xreftable = list()
-
+    def writeheader(self, stream):
         # justification of the random binary garbage in the header from
         # adobe:
         #
@@ -219,6 +375,127 @@ class MyPdfWriter():
         pdfheader = ('%%PDF-%s\n' % self.version).encode('ascii')
         pdfheader += b'%\xe2\xe3\xcf\xd3\n'
         stream.write(pdfheader)
+        self.pos = len(pdfheader)
+
+    def writeobj(self, obj, stream):
+        if self.object_streams and obj.stream is None:
+            self.objstm.append(obj)
+            if len(self.objstm) >= self.objstm_size:
+                self.writeobjstm(stream)
+            return
+        self.offsets[obj.identifier] = self.pos
+        # The object is serialized into a buffer that is reused for all
+        # objects, and the stream data, which might be large, is written as
+        # it is without copying it into the buffer.
+        buf = self.buffer
+        del buf[:]
+        trailer = obj.serialize(buf)
+        stream.write(buf)
+        self.pos += len(buf)
+        if obj.stream is not None:
+            stream.write(obj.stream)
+            stream.write(trailer)
+            self.pos += len(obj.stream) + len(trailer)
+
+    def writeobjstm(self, stream):
+        """Write the collected objects as a compressed object stream"""
+        if not self.objstm:
+            return
+        objstm = MyPdfDict()
+        objstm.identifier = len(self.objects) + 1
+        self.objects.append(objstm)
+        offsets = []
+        bodies = bytearray()
+        for i, o in enumerate(self.objstm):
+            self.compressed[o.identifier] = (objstm.identifier, i)
+            offsets.append(("%d %d" % (o.identifier, len(bodies))).encode())
+            serialize(o.content, bodies)
+            bodies += b"\n"
+        header = b" ".join(offsets) + b"\n"
+        compressor = zlib.compressobj()
+        objstm.stream = compressor.compress(header) + \
+            compressor.compress(bodies) + compressor.flush()
+        objstm[MyPdfName.Type] = MyPdfName.ObjStm
+        objstm[MyPdfName.N] = len(self.objstm)
+        objstm[MyPdfName.First] = len(header)
+        objstm[MyPdfName.Filter] = [MyPdfName.FlateDecode]
+        objstm[MyPdfName.Length] = len(objstm.stream)
+        self.objstm = []
+        self.writeobj(objstm, stream)
+
+    def writexrefstream(self, info, stream):
+        # From section 3.4.7 of the PDF Reference (version 1.7), each entry
+        # of a cross-reference stream consists of a type (1 for objects at a
+        # byte offset, 2 for objects in an object stream) and two fields
+        # whose meaning depends on the type. The field widths are given in
+        # /W and chosen so that the largest byte offset fits.
+        xref = MyPdfDict()
+        xref.identifier = len(self.objects) + 1
+        self.objects.append(xref)
+        self.offsets[xref.identifier] = self.pos
+        width = 1
+        while self.pos >> (8 * width):
+            width += 1
+
+        def entry(kind, field2, field3):
+            return struct.pack(">B", kind) + \
+                struct.pack(">Q", field2)[8 - width:] + \
+                struct.pack(">H", field3)
+
+        entries = [entry(0, 0, 65535)]
+        for o in self.objects:
+            if o.identifier in self.compressed:
+                entries.append(entry(2, *self.compressed[o.identifier]))
+            else:
+                entries.append(entry(1, self.offsets[o.identifier], 0))
+        xref.stream = zlib.compress(b"".join(entries))
+        xref[MyPdfName.Type] = MyPdfName.XRef
+        xref[MyPdfName.Size] = len(self.objects) + 1
+        xref[MyPdfName.W] = [1, width, 2]
+        xref[MyPdfName.Root] = self.catalog
+        xref[MyPdfName.Info] = info
+        xref[MyPdfName.Filter] = [MyPdfName.FlateDecode]
+        xref[MyPdfName.Length] = len(xref.stream)
+        self.writeobj(xref, stream)
+        stream.write(b"startxref\n")
+        stream.write(("%d\n" % self.offsets[xref.identifier]).encode())
+        stream.write(b"%%EOF\n")
+
+    def flush(self):
+        """Write all objects added since the last call in streaming mode"""
+        if self.stream is None:
+            return
+        if self.headerversion is None:
+            # the first page might have raised the version already
+            self.headerversion = self.version
+            self.writeheader(self.stream)
+        for o in self.pending:
+            self.writeobj(o, self.stream)
+        self.pending = []
+
+    def tostream(self, info, stream):
+        if self.stream is None:
+            self.offsets = {}
+            self.writeheader(stream)
+            # writing objects might append object streams to self.objects
+            for o in list(self.objects):
+                self.writeobj(o, stream)
+        else:
+            if stream is not self.stream:
+                raise ValueError("a streaming writer can only write to the "
+                                 "stream it was created with")
+            self.flush()
+            # The header has already been written. Since PDF 1.4, a /Version
+            # entry in the catalog overrides the version from the header.
+            if self.version != self.headerversion:
+                self.catalog[b"/Version"] = b"/" + self.version.encode("ascii")
+            for o in self.deferred:
+                self.writeobj(o, stream)
+
+        if self.object_streams:
+            self.writeobjstm(stream)
+            self.writexrefstream(info, stream)
+            return
 
         # From section 3.4.3 of the PDF Reference (version 1.7):
         #
@@ -242,22 +519,20 @@ class MyPdfWriter():
         #
         # Since we chose to use a single character eol marker, we precede it by
         # a space
-        pos = len(pdfheader)
-        xreftable.append(b"0000000000 65535 f \n")
-        for o in self.objects:
-            xreftable.append(("%010d 00000 n \n" % pos).encode())
-            content = o.tostring()
-            stream.write(content)
-            pos += len(content)
-
-        xrefoffset = pos
+        xrefoffset = self.pos
         stream.write(b"xref\n")
-        stream.write(("0 %d\n" % len(xreftable)).encode())
-        for x in xreftable:
-            stream.write(x)
+        stream.write(("0 %d\n" % (len(self.objects) + 1)).encode())
+        stream.write(b"0000000000 65535 f \n")
+        for o in self.objects:
+            stream.write(("%010d 00000 n \n" %
+                          self.offsets[o.identifier]).encode())
         stream.write(b"trailer\n")
-        stream.write(parse({b"/Size": len(xreftable), b"/Info": info,
-                            b"/Root": self.catalog})+b"\n")
+        buf = self.buffer
+        del buf[:]
+        serialize({b"/Size": len(self.objects) + 1, b"/Info": info,
+                   b"/Root": self.catalog}, buf)
+        buf += b"\n"
+        stream.write(buf)
         stream.write(b"startxref\n")
         stream.write(("%d\n" % xrefoffset).encode())
         stream.write(b"%%EOF\n")
@@ -299,23 +574,32 @@ class pdfdoc(object):
                  producer=None, creationdate=None, moddate=None, subject=None,
                  keywords=None, nodate=False, panes=None, initial_page=None,
                  magnification=None, page_layout=None, fit_window=False,
-                 center_window=False, fullscreen=False, with_pdfrw=True):
-        if with_pdfrw:
+                 center_window=False, fullscreen=False, with_pdfrw=True,
+                 outputstream=None, object_streams=False):
+        # pdfrw cannot write object streams
+        self.with_pdfrw = False
+        if with_pdfrw and not object_streams:
             try:
-                from pdfrw import PdfWriter, PdfDict, PdfName, PdfString
+                from pdfrw import PdfWriter, PdfDict, PdfName, PdfString, \
+                    PdfObject, PdfArray
+                from pdfrw.py23_diffs import convert_load
+                PdfPage = PdfDict
                 self.with_pdfrw = True
             except ImportError:
-                PdfWriter = MyPdfWriter
-                PdfDict = MyPdfDict
-                PdfName = MyPdfName
-                PdfString = MyPdfString
-                self.with_pdfrw = False
-        else:
+                pass
+        if not self.with_pdfrw:
             PdfWriter = MyPdfWriter
             PdfDict = MyPdfDict
+            PdfPage = MyPdfPage
             PdfName = MyPdfName
             PdfString = MyPdfString
-            self.with_pdfrw = False
+            PdfObject = MyPdfObject
+            PdfArray = MyPdfArray
+            convert_load = my_convert_load
+        # the classes of the chosen backend are looked up once and not for
+        # every page
+        self.pdfclasses = (PdfDict, PdfPage, PdfName, PdfObject, PdfArray,
+                           convert_load)
 
         now = datetime.now()
         self.info = PdfDict(indirect=True)
@@ -348,14 +632,19 @@ class pdfdoc(object):
         if keywords is not None:
             self.info[PdfName.Keywords] = PdfString.encode(",".join(keywords))
 
-        self.writer = PdfWriter()
-        self.writer.version = version
+        # without pdfrw, the PDF is written incrementally to the output
+        # stream if it is known in advance
+        if self.with_pdfrw:
+            self.writer = PdfWriter()
+            self.writer.version = version
+        else:
+            self.writer = PdfWriter(version, outputstream, object_streams)
         # this is done because pdfrw adds info, catalog and pages as the first
         # three objects in this order
         if not self.with_pdfrw:
-            self.writer.addobj(self.info)
-            self.writer.addobj(self.writer.catalog)
-            self.writer.addobj(self.writer.pages)
+            self.writer.addobj(self.info, deferred=True)
+            self.writer.addobj(self.writer.catalog, deferred=True)
+            self.writer.addobj(self.writer.pages, deferred=True)
 
         self.panes = panes
         self.initial_page = initial_page
@@ -365,17 +654,60 @@ class pdfdoc(object):
         self.center_window = center_window
         self.fullscreen = fullscreen
 
+        # image XObjects by the hash of their content and parameters so that
+        # pages showing the same image can share a single XObject
+        self.images = {}
+
     def add_imagepage(self, color, imgwidthpx, imgheightpx, imgformat, imgdata,
                       imgwidthpdf, imgheightpdf, imgxpdf, imgypdf, pagewidth,
-                      pageheight):
-        if self.with_pdfrw:
-            from pdfrw import PdfDict, PdfName, PdfObject
-            from pdfrw.py23_diffs import convert_load
+                      pageheight, depth=8, decodeparms=None, inverted=False):
+        PdfDict, PdfPage, PdfName, _, _, convert_load = self.pdfclasses
+
+        # identical images with identical parameters are only stored once
+        imagekey = (hashlib.sha256(imgdata).digest(), len(imgdata), color,
+                    imgformat, imgwidthpx, imgheightpx, depth, inverted,
+                    tuple(sorted(decodeparms.items()))
+                    if decodeparms is not None else None)
+        # the resources only refer to the image, so pages showing the same
+        # image share them as well
+        if imagekey in self.images:
+            logging.debug("reusing identical image")
+            image, resources = self.images[imagekey]
+            newimage = False
         else:
-            PdfDict = MyPdfDict
-            PdfName = MyPdfName
-            PdfObject = MyPdfObject
-            convert_load = my_convert_load
+            image = self.create_image(
+                color, imgwidthpx, imgheightpx, imgformat, imgdata, depth,
+                decodeparms, inverted)
+            resources = PdfDict(XObject=PdfDict(Im0=image))
+            self.images[imagekey] = (image, resources)
+            newimage = True
+
+        text = ("q\n%0.4f 0 0 %0.4f %0.4f %0.4f cm\n/Im0 Do\nQ" %
+                (imgwidthpdf, imgheightpdf, imgxpdf, imgypdf)).encode("ascii")
+
+        content = PdfDict(stream=convert_load(text))
+
+        page = PdfPage(indirect=True)
+        page[PdfName.Type] = PdfName.Page
+        page[PdfName.MediaBox] = [0, 0, pagewidth, pageheight]
+        page[PdfName.Resources] = resources
+        page[PdfName.Contents] = content
+
+        self.writer.addpage(page)
+
+        if not self.with_pdfrw:
+            self.writer.addobj(content)
+            if newimage:
+                self.writer.addobj(image)
+            if self.writer.stream is not None:
+                self.writer.flush()
+                # the image data has been written out already, so there is
+                # no need to keep it in memory
+                image.stream = None
+
+    def create_image(self, color, imgwidthpx, imgheightpx, imgformat, imgdata,
+                     depth, decodeparms, inverted):
+        PdfDict, _, PdfName, PdfObject, _, convert_load = self.pdfclasses
 
         if color == Colorspace['1'] or color == Colorspace.L:
             colorspace = PdfName.DeviceGray
@@ -396,9 +728,20 @@ class pdfdoc(object):
             self.writer.version = "1.5"  # jpeg2000 needs pdf 1.5
         elif imgformat is ImageFormat.CCITTGroup4:
             ofilter = [PdfName.CCITTFaxDecode]
+        elif imgformat is ImageFormat.LZW:
+            ofilter = [PdfName.LZWDecode]
+        elif imgformat is ImageFormat.PackBits:
+            ofilter = [PdfName.RunLengthDecode]
         else:
             ofilter = [PdfName.FlateDecode]
 
+        # A memory view into a memory mapped input file can only be passed on
+        # if the writer writes it out right away. Otherwise, all input files
+        # would have to stay mapped until the end.
+        if isinstance(imgdata, memoryview) and \
+                (self.with_pdfrw or self.writer.stream is None):
+            imgdata = imgdata.tobytes()
+
         image = PdfDict(stream=convert_load(imgdata))
 
         image[PdfName.Type] = PdfName.XObject
@@ -407,41 +750,42 @@ class pdfdoc(object):
         image[PdfName.Width] = imgwidthpx
         image[PdfName.Height] = imgheightpx
         image[PdfName.ColorSpace] = colorspace
-        # hardcoded as PIL doesn't provide bits for non-jpeg formats
+        # PIL doesn't provide bits for non-jpeg formats, so unless the caller
+        # read them from the raw image data, 8 bits are assumed
         if imgformat is ImageFormat.CCITTGroup4:
             image[PdfName.BitsPerComponent] = 1
         else:
-            image[PdfName.BitsPerComponent] = 8
+            image[PdfName.BitsPerComponent] = depth
 
         if color == Colorspace['CMYK;I']:
             # Inverts all four channels
             image[PdfName.Decode] = [1.0, 0.0, 1.0, 0.0, 1.0, 0.0, 1.0, 0.0]
+        elif inverted and imgformat is not ImageFormat.CCITTGroup4:
+            # 0 means white in the raw gray samples
+            image[PdfName.Decode] = [1.0, 0.0]
 
         if imgformat is ImageFormat.CCITTGroup4:
             decodeparms = PdfDict()
             decodeparms[PdfName.K] = -1
-            decodeparms[PdfName.BlackIs1] = PdfObject('true')
+            # CCITT data encodes runs of 0 bits as white runs. Unless the
+            # image data came from a TIFF with 0 meaning white, 1 bits are
+            # white and the decoded black runs have to become 1 bits.
+            if inverted:
+                decodeparms[PdfName.BlackIs1] = PdfObject('false')
+            else:
+                decodeparms[PdfName.BlackIs1] = PdfObject('true')
             decodeparms[PdfName.Columns] = imgwidthpx
             decodeparms[PdfName.Rows] = imgheightpx
             image[PdfName.DecodeParms] = [decodeparms]
+        elif decodeparms is not None:
+            # decode parameters determined while reading the image, for
+            # example the predictor of PNG image data
+            parms = PdfDict()
+            for key, value in sorted(decodeparms.items()):
+                parms[getattr(PdfName, key)] = value
+            image[PdfName.DecodeParms] = [parms]
 
-        text = ("q\n%0.4f 0 0 %0.4f %0.4f %0.4f cm\n/Im0 Do\nQ" %
-                (imgwidthpdf, imgheightpdf, imgxpdf, imgypdf)).encode("ascii")
-
-        content = PdfDict(stream=convert_load(text))
-        resources = PdfDict(XObject=PdfDict(Im0=image))
-
-        page = PdfDict(indirect=True)
-        page[PdfName.Type] = PdfName.Page
-        page[PdfName.MediaBox] = [0, 0, pagewidth, pageheight]
-        page[PdfName.Resources] = resources
-        page[PdfName.Contents] = content
-
-        self.writer.addpage(page)
-
-        if not self.with_pdfrw:
-            self.writer.addobj(content)
-            self.writer.addobj(image)
+        return image
 
     def tostring(self):
         stream = BytesIO()
@@ -449,13 +793,7 @@ class pdfdoc(object):
         return stream.getvalue()
 
     def tostream(self, outputstream):
-        if self.with_pdfrw:
-            from pdfrw import PdfDict, PdfName, PdfArray, PdfObject
-        else:
-            PdfDict = MyPdfDict
-            PdfName = MyPdfName
-            PdfObject = MyPdfObject
-            PdfArray = MyPdfArray
+        PdfDict, _, PdfName, PdfObject, PdfArray, _ = self.pdfclasses
         NullObject = PdfObject('null')
         TrueObject = PdfObject('true')
 
@@ -574,15 +912,27 @@ class pdfdoc(object):
 def get_imgmetadata(imgdata, imgformat, default_dpi, colorspace, rawdata=None):
     if imgformat == ImageFormat.JPEG2000 \
             and rawdata is not None and imgdata is None:
-        # this codepath gets called if the PIL installation is not able to
-        # handle JPEG2000 files
+        # JPEG2000 images are embedded as-is, so PIL does not have to open
+        # them, which might not even be able to handle JPEG2000 files
         imgwidthpx, imgheightpx, ics, hdpi, vdpi = parsejp2(rawdata)
 
         if hdpi is None:
             hdpi = default_dpi
         if vdpi is None:
             vdpi = default_dpi
-        ndpi = (hdpi, vdpi)
+        # the resolution is stored in dots per metre, so like PIL, round
+        ndpi = (int(round(hdpi)), int(round(vdpi)))
+        adobe = False
+    elif imgformat == ImageFormat.JPEG \
+            and rawdata is not None and imgdata is None:
+        # JPEG images are embedded as-is, so PIL does not have to open them
+        imgwidthpx, imgheightpx, ics, hdpi, vdpi, adobe = parsejpeg(rawdata)
+
+        if hdpi is None:
+            hdpi = default_dpi
+        if vdpi is None:
+            vdpi = default_dpi
+        ndpi = (int(round(hdpi)), int(round(vdpi)))
     else:
         imgwidthpx, imgheightpx = imgdata.size
 
@@ -594,6 +944,7 @@ def get_imgmetadata(imgdata, imgformat, default_dpi, colorspace, rawdata=None):
         # Search online for the 72.009 dpi problem for more info.
         ndpi = (int(round(ndpi[0])), int(round(ndpi[1])))
         ics = imgdata.mode
+        adobe = "adobe" in imgdata.info
 
     logging.debug("input dpi = %d x %d", *ndpi)
 
@@ -615,7 +966,7 @@ def get_imgmetadata(imgdata, imgformat, default_dpi, colorspace, rawdata=None):
             # have enough experience with these to know which is
             # better for images currently in the wild, so I'm going
             # with the first approach for now.
-            if "adobe" in imgdata.info:
+            if adobe:
                 color = Colorspace['CMYK;I']
         logging.debug("input colorspace = %s", color.name)
 
@@ -625,16 +976,24 @@ def get_imgmetadata(imgdata, imgformat, default_dpi, colorspace, rawdata=None):
 
 
 def transcode_monochrome(imgdata):
-    """Convert the open PIL.Image imgdata to compressed CCITT Group4 data"""
+    """Convert the open PIL.Image imgdata to compressed CCITT Group4 data
 
-    from PIL import TiffImagePlugin
+    This is used for all bilevel images that cannot be copied verbatim, for
+    example Group3 compressed TIFFs or Group4 compressed TIFFs with more
+    than one strip, whose strips cannot simply be joined.
+    """
+
+    from PIL import Image, TiffImagePlugin
 
     logging.debug("Converting monochrome to CCITT Group4")
 
     # Convert the image to Group 4 in memory. If libtiff is not installed and
     # Pillow is not compiled against it, .save() will raise an exception.
+    # Newer versions of Pillow split the image into strips of 64 KiB unless
+    # the number of rows per strip is set explicitly.
     newimgio = BytesIO()
-    imgdata.save(newimgio, format='TIFF', compression='group4')
+    imgdata.save(newimgio, format='TIFF', compression='group4',
+                 tiffinfo={TiffImagePlugin.ROWSPERSTRIP: imgdata.size[1]})
 
     # Open new image in memory
     newimgio.seek(0)
@@ -650,10 +1009,10 @@ def transcode_monochrome(imgdata):
     strip_bytes = newimg.tag_v2[TiffImagePlugin.STRIPBYTECOUNTS]
     rows_per_strip = newimg.tag_v2[TiffImagePlugin.ROWSPERSTRIP]
 
-    # PIL always seems to create a single strip even for very large TIFFs when
-    # it saves images, so assume we only have to read a single strip.
-    # A test ~10 GPixel image was still encoded as a single strip. Just to be
-    # safe check throw an error if there is more than one offset.
+    # With the number of rows per strip set to the image height, PIL creates a
+    # single strip even for very large TIFFs. A test ~10 GPixel image was
+    # still encoded as a single strip. Just to be safe throw an error if there
+    # is more than one offset.
     if len(strip_offsets) > 1:
         raise NotImplementedError("Transcoding multiple strips not supported")
 
@@ -663,42 +1022,858 @@ def transcode_monochrome(imgdata):
     return ccittdata
 
 
-def read_images(rawdata, colorspace, first_frame_only=False):
-    im = BytesIO(rawdata)
-    im.seek(0)
-    imgdata = None
+def parse_png_chunks(rawdata):
+    """Return the IHDR fields of a PNG and the position of its IDAT payload
+
+    Only the chunk headers are read. The IDAT payload is returned as a list
+    of (offset, length) tuples, one per chunk.
+    """
+
+    if rawdata[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("not a png image")
+
+    ihdr = None
+    idatranges = []
+    pos = 8
+    while pos + 8 <= len(rawdata):
+        length, chunktype = struct.unpack(">I4s", rawdata[pos:pos+8])
+        if pos + 12 + length > len(rawdata):
+            raise ValueError("invalid png: chunk at %d exceeds file size"
+                             % pos)
+        if chunktype == b"IHDR":
+            ihdr = struct.unpack(">IIBBBBB", rawdata[pos+8:pos+8+length])
+        elif chunktype == b"IDAT":
+            idatranges.append((pos + 8, length))
+        elif chunktype == b"IEND":
+            break
+        # skip length, chunk type, chunk data and crc
+        pos += 12 + length
+
+    if ihdr is None:
+        raise ValueError("invalid png: no IHDR chunk")
+
+    width, height, depth, colortype, _, _, interlace = ihdr
+    return width, height, depth, colortype, interlace, idatranges
+
+
+def get_mmap_view(rawdata):
+    """Return a memoryview of a memory mapped file
+
+    Python 2 cannot make a memoryview of a memory map, so there the content
+    of the file is returned instead.
+    """
+
     try:
-        imgdata = Image.open(im)
-    except IOError as e:
-        # test if it is a jpeg2000 image
-        if rawdata[:12] != "\x00\x00\x00\x0C\x6A\x50\x20\x20\x0D\x0A\x87\x0A":
-            raise ImageOpenError("cannot read input image (not jpeg2000). "
-                                 "PIL: error reading image: %s" % e)
-        # image is jpeg2000
-        imgformat = ImageFormat.JPEG2000
+        return memoryview(rawdata)
+    except TypeError:
+        return rawdata[:]
+
+
+def get_tiff_strip_ranges(imgdata, rawdata):
+    """Return the offset and length of each strip of a TIFF frame
+
+    Only the tags are read. None is returned if the frame is not organized
+    in strips or if the strips are not within rawdata.
+    """
+
+    from PIL import TiffImagePlugin
+
+    strip_offsets = imgdata.tag_v2.get(TiffImagePlugin.STRIPOFFSETS)
+    strip_bytes = imgdata.tag_v2.get(TiffImagePlugin.STRIPBYTECOUNTS)
+    if strip_offsets is None or strip_bytes is None or \
+            len(strip_offsets) != len(strip_bytes):
+        return None
+    ranges = list(zip(strip_offsets, strip_bytes))
+    if any(offset + length > len(rawdata) for offset, length in ranges):
+        return None
+    return ranges
+
+
+def get_tiff_strips(imgdata, rawdata):
+    """Return the raw strips of the current frame of a TIFF image
+
+    If rawdata is memory mapped, the strips are views into the mapping.
+    None is returned like for get_tiff_strip_ranges().
+    """
+
+    ranges = get_tiff_strip_ranges(imgdata, rawdata)
+    if ranges is None:
+        return None
+    if isinstance(rawdata, mmap.mmap):
+        rawdata = get_mmap_view(rawdata)
+    return [rawdata[offset:offset+length] for offset, length in ranges]
+
+
+def check_ccitt_passthrough(imgdata, rawdata):
+    """Check whether a CCITT Group4 compressed TIFF frame can be embedded
+
+    This works for frames stored in a single strip with the default fill
+    order. Only the tags are read. Returns whether 0 bits mean white
+    (PhotometricInterpretation WhiteIsZero) or None if the frame has to be
+    transcoded.
+    """
+
+    from PIL import TiffImagePlugin
+
+    if imgdata.info.get("compression") != "group4":
+        return None
+    tags = imgdata.tag_v2
+    if tags.get(TiffImagePlugin.FILLORDER, 1) != 1:
+        return None
+    photometric = tags.get(TiffImagePlugin.PHOTOMETRIC_INTERPRETATION)
+    if photometric not in [0, 1]:
+        return None
+    # bit 1 of T6Options allows uncompressed mode which PDF readers do not
+    # have to support
+    if tags.get(293, 0) & 2:
+        return None
+    ranges = get_tiff_strip_ranges(imgdata, rawdata)
+    if ranges is None or len(ranges) != 1:
+        return None
+    return photometric == 0
+
+
+def get_ccitt_passthrough(imgdata, rawdata):
+    """Return the CCITT Group4 data of a TIFF frame that can be embedded as-is
+
+    The second return value tells whether 0 bits mean white. None is
+    returned if the frame has to be transcoded (see
+    check_ccitt_passthrough()).
+    """
+
+    inverted = check_ccitt_passthrough(imgdata, rawdata)
+    if inverted is None:
+        return None
+    return get_tiff_strips(imgdata, rawdata)[0], inverted
+
+
+def check_tiff_jpeg_passthrough(imgdata, rawdata, color):
+    """Check whether a JPEG compressed TIFF frame can be embedded as JPEG
+
+    Only the tags and the JPEG headers of the strips are read. Returns the
+    JPEG tables without end of image marker and the decode parameters for
+    the PDF DCTDecode filter, or None in the cases listed for
+    get_tiff_jpeg_passthrough().
+    """
+
+    from PIL import TiffImagePlugin
+
+    if imgdata.info.get("compression") != "jpeg":
+        return None
+    tags = imgdata.tag_v2
+    if tags.get(TiffImagePlugin.PLANAR_CONFIGURATION, 1) != 1:
+        return None
+    if any(b != 8 for b in tags.get(TiffImagePlugin.BITSPERSAMPLE, (8,))):
+        return None
+    photometric = tags.get(TiffImagePlugin.PHOTOMETRIC_INTERPRETATION)
+    if photometric == 1 and color == Colorspace.L:
+        decodeparms = None
+    elif photometric == 6 and color == Colorspace.RGB:
+        # the default ColorTransform of DCTDecode for three components
+        # converts from YCbCr to RGB
+        decodeparms = None
+    elif photometric == 2 and color == Colorspace.RGB:
+        # RGB components are stored without color transform and without an
+        # Adobe marker that would tell the PDF reader about it
+        decodeparms = {"ColorTransform": 0}
+    else:
+        return None
+    ranges = get_tiff_strip_ranges(imgdata, rawdata)
+    if ranges is None or \
+            any(length < 2 or rawdata[offset:offset+2] != b"\xff\xd8"
+                for offset, length in ranges):
+        return None
+    tables = tags.get(TiffImagePlugin.JPEGTABLES)
+    if tables:
+        if not isinstance(tables, bytes) or tables[:2] != b"\xff\xd8" or \
+                tables[-2:] != b"\xff\xd9":
+            return None
+        # strip the end of image marker from the tables
+        tables = tables[:-2]
+    else:
+        tables = b"\xff\xd8"
+    if len(ranges) > 1:
+        # slices of a memoryview do not copy the entropy coded data
+        view = get_mmap_view(rawdata)
+        parts = [split_jpeg(view[offset:offset+length])
+                 for offset, length in ranges]
+        rowsperstrip = tags.get(TiffImagePlugin.ROWSPERSTRIP)
+        if check_jpeg_strips(parts, rowsperstrip) is None:
+            return None
+    return tables, decodeparms
+
+
+def get_tiff_jpeg_passthrough(imgdata, rawdata, color):
+    """Return a JPEG stream for a JPEG compressed TIFF frame
+
+    TIFF frames with compression 7 store an abbreviated JPEG stream per strip
+    and the quantization and Huffman tables shared by all strips in the
+    JPEGTables tag. A standalone JPEG stream is put together from both
+    without decoding any pixels. The strips of frames with more than one
+    strip are joined into one scan with restart markers (see
+    join_jpeg_strips()). Besides the JPEG data, the decode parameters for
+    the PDF DCTDecode filter are returned.
+
+    None is returned if the frame has to be decoded and re-encoded: if it is
+    not JPEG compressed, is stored in separate planes, has other than 8 bits
+    per sample, has a photometric interpretation that does not match the
+    colorspace, has strips outside of rawdata or that are not JPEG streams,
+    has invalid JPEGTables, or has strips that cannot be joined. These
+    conditions are checked by check_tiff_jpeg_passthrough().
+    """
+
+    from PIL import TiffImagePlugin
+
+    passthrough = check_tiff_jpeg_passthrough(imgdata, rawdata, color)
+    if passthrough is None:
+        return None
+    tables, decodeparms = passthrough
+    strips = get_tiff_strips(imgdata, rawdata)
+    if len(strips) == 1:
+        # strip the start of image marker from the strip
+        return tables + strips[0][2:], decodeparms
+    rowsperstrip = imgdata.tag_v2.get(TiffImagePlugin.ROWSPERSTRIP)
+    jpegdata = join_jpeg_strips(strips, rowsperstrip, imgdata.size[1])
+    if jpegdata is None:
+        return None
+    return tables + jpegdata[2:], decodeparms
+
+
+def check_tiff_strip_passthrough(imgdata, rawdata, color):
+    """Check whether PDF filters can decode the strips of a TIFF frame as-is
+
+    LZW and Deflate compressed frames stored in a single strip and PackBits
+    compressed frames can be embedded with LZWDecode, FlateDecode and
+    RunLengthDecode, respectively. The TIFF horizontal differencing predictor
+    is the same as predictor 2 of LZWDecode and FlateDecode. Only the tags
+    and the first byte of LZW strips are read. Returns the image format, the
+    bits per component, the decode parameters and whether 0 means white, or
+    None if the frame has to be decoded and re-encoded.
+
+    PackBits strips that end in the middle of a run are only found by
+    packbits_to_runlength(), so get_tiff_strip_passthrough() may still
+    return None for them.
+    """
+
+    from PIL import TiffImagePlugin
+
+    tags = imgdata.tag_v2
+    compression = tags.get(TiffImagePlugin.COMPRESSION)
+    if compression == 5:
+        imgformat = ImageFormat.LZW
+    elif compression == 32773:
+        imgformat = ImageFormat.PackBits
+    elif compression in [8, 32946]:
+        imgformat = ImageFormat.other
+    else:
+        return None
+    if tags.get(TiffImagePlugin.FILLORDER, 1) != 1 or \
+            tags.get(TiffImagePlugin.PLANAR_CONFIGURATION, 1) != 1:
+        return None
+    photometric = tags.get(TiffImagePlugin.PHOTOMETRIC_INTERPRETATION)
+    bits = tags.get(TiffImagePlugin.BITSPERSAMPLE, (1,))
+    depth = bits[0]
+    # bilevel images are better off as CCITT Group4 and palette images have
+    # no PDF colorspace here
+    if photometric in [0, 1] and color == Colorspace.L and \
+            bits in [(2,), (4,), (8,)]:
+        samples = 1
+    elif photometric == 2 and color == Colorspace.RGB and bits == (8, 8, 8):
+        samples = 3
+    elif photometric == 5 and color == Colorspace.CMYK and \
+            bits == (8, 8, 8, 8) and tags.get(332, 1) == 1:
+        samples = 4
+    else:
+        return None
+    if tags.get(TiffImagePlugin.SAMPLESPERPIXEL, 1) != samples:
+        return None
+    predictor = tags.get(TiffImagePlugin.PREDICTOR, 1)
+    if predictor == 1:
+        decodeparms = None
+    elif predictor == 2 and depth == 8 and imgformat != ImageFormat.PackBits:
+        decodeparms = {"Predictor": 2, "Colors": samples,
+                       "BitsPerComponent": depth,
+                       "Columns": imgdata.size[0]}
+    else:
+        return None
+    ranges = get_tiff_strip_ranges(imgdata, rawdata)
+    if ranges is None:
+        return None
+    if imgformat != ImageFormat.PackBits:
+        if len(ranges) != 1:
+            # every strip is a compressed stream of its own
+            return None
+        offset, length = ranges[0]
+        if imgformat == ImageFormat.LZW and \
+                (length < 1 or rawdata[offset:offset+1] != b"\x80"):
+            # old-style LZW codes are stored least significant bit first
+            return None
+    return imgformat, depth, decodeparms, photometric == 0
+
+
+def get_tiff_strip_passthrough(imgdata, rawdata, color):
+    """Return the strips of a TIFF frame that PDF filters can decode as-is
+
+    Returns the image format, the image data, the bits per component, the
+    decode parameters and whether 0 means white, or None if the frame has to
+    be decoded and re-encoded (see check_tiff_strip_passthrough()).
+    """
+
+    passthrough = check_tiff_strip_passthrough(imgdata, rawdata, color)
+    if passthrough is None:
+        return None
+    imgformat, depth, decodeparms, inverted = passthrough
+    strips = get_tiff_strips(imgdata, rawdata)
+    if imgformat == ImageFormat.PackBits:
+        stripdata = packbits_to_runlength(strips)
+        if stripdata is None:
+            return None
+    else:
+        stripdata = strips[0]
+    return imgformat, stripdata, depth, decodeparms, inverted
+
+
+def packbits_to_runlength(strips):
+    """Join PackBits compressed strips into one RunLengthDecode stream
+
+    Both encodings are the same, except that the no-op length byte 128 of
+    PackBits marks the end of the data for RunLengthDecode, so it has to be
+    removed. Returns None if a strip ends in the middle of a run.
+    """
+
+    result = []
+    for strip in strips:
+        strip = bytes(strip)
+        if b"\x80" not in strip:
+            # no length byte can be 128
+            result.append(strip)
+            continue
+        data = bytearray(strip)
+        pos, start = 0, 0
+        while pos < len(data):
+            length = data[pos]
+            if length == 128:
+                result.append(strip[start:pos])
+                pos += 1
+                start = pos
+            elif length < 128:
+                pos += length + 2
+            else:
+                pos += 2
+        if pos != len(data):
+            return None
+        result.append(strip[start:])
+    result.append(b"\x80")
+    return b"".join(result)
+
+
+def split_jpeg(data):
+    """Split a baseline JPEG stream into its header segments and scan data
+
+    Returns the list of (marker, segment) tuples up to and including the
+    start of scan segment and the entropy coded data up to the end of image
+    marker. None is returned for anything but a single scan baseline or
+    extended sequential Huffman coded stream.
+    """
+
+    segments = []
+    pos = 2
+    while True:
+        if data[pos:pos+1] != b"\xff":
+            return None
+        # markers may be preceded by any number of fill bytes
+        while data[pos+1:pos+2] == b"\xff":
+            pos += 1
+        marker = bytearray(data[pos+1:pos+2])
+        if not marker:
+            return None
+        marker = marker[0]
+        length, = struct.unpack(">H", data[pos+2:pos+4])
+        segments.append((marker, bytes(data[pos:pos+2+length])))
+        pos += 2 + length
+        if marker in [0xc2, 0xc3, 0xc5, 0xc6, 0xc7] or 0xc9 <= marker <= 0xcf:
+            # progressive, lossless, hierarchical or arithmetic coding
+            return None
+        if marker == 0xda:
+            break
+    end = len(data)
+    # there might be padding after the end of image marker
+    while end > pos and data[end-2:end] != b"\xff\xd9":
+        end -= 1
+    if end <= pos:
+        return None
+    return segments, data[pos:end-2]
+
+
+def check_jpeg_strips(parts, rowsperstrip):
+    """Check whether the JPEG streams of strips can be joined into one
+
+    The parts are the results of split_jpeg() for each strip. If all strips
+    use the same frame and scan header and the strip height is a multiple of
+    the MCU height, returns the header segments of the first strip and the
+    restart interval for the joined stream, otherwise None.
+    """
+
+    if rowsperstrip is None or any(part is None for part in parts):
+        return None
+    segments = parts[0][0]
+    sofs = [seg for marker, seg in segments if marker in [0xc0, 0xc1]]
+    if len(sofs) != 1:
+        return None
+    sof = sofs[0]
+    numcomponents = bytearray(sof[9:10])[0]
+    if numcomponents == 1:
+        # non-interleaved scans always consist of 8x8 blocks
+        mcuwidth, mcuheight = 8, 8
     else:
-        imgformat = None
-        for f in ImageFormat:
-            if f.name == imgdata.format:
-                imgformat = f
-        if imgformat is None:
-            imgformat = ImageFormat.other
+        sampling = bytearray(sof[11:10+3*numcomponents:3])
+        mcuwidth = 8 * max(s >> 4 for s in sampling)
+        mcuheight = 8 * max(s & 0xf for s in sampling)
+    width, = struct.unpack(">H", sof[7:9])
+    if rowsperstrip % mcuheight != 0:
+        return None
+    interval = ((width + mcuwidth - 1) // mcuwidth) * \
+        (rowsperstrip // mcuheight)
+    if interval > 0xffff:
+        return None
+    for i, (strip_segments, _) in enumerate(parts):
+        if len(strip_segments) != len(segments):
+            return None
+        for (m1, s1), (m2, s2) in zip(strip_segments, segments):
+            if m1 != m2 or m1 == 0xdd:
+                # strips with restart markers of their own cannot be joined
+                return None
+            if m1 in [0xc0, 0xc1]:
+                # only the last strip may be shorter
+                stripheight, = struct.unpack(">H", s1[5:7])
+                if s1[:5] != s2[:5] or s1[7:] != s2[7:] or \
+                        (i < len(parts) - 1 and stripheight != rowsperstrip):
+                    return None
+            elif s1 != s2:
+                return None
+    return segments, interval
+
+
+def join_jpeg_strips(strips, rowsperstrip, height):
+    """Join the JPEG streams of a strip-wise compressed image into one
+
+    Each strip carries a JPEG stream covering rowsperstrip rows. The
+    entropy coded data of each strip is put one after another, separated by
+    restart markers that reset the DC predictors like the start of a new
+    stream would. Returns the joined stream or None if the strips cannot be
+    joined without re-encoding (see check_jpeg_strips()).
+    """
+
+    parts = [split_jpeg(strip) for strip in strips]
+    joinable = check_jpeg_strips(parts, rowsperstrip)
+    if joinable is None:
+        return None
+    segments, interval = joinable
+    result = [b"\xff\xd8"]
+    for marker, seg in segments:
+        if marker in [0xc0, 0xc1]:
+            seg = seg[:5] + struct.pack(">H", height) + seg[7:]
+        elif marker == 0xda:
+            result.append(struct.pack(">BBHH", 0xff, 0xdd, 4, interval))
+        result.append(seg)
+    for i, (_, scan) in enumerate(parts):
+        if i > 0:
+            result.append(struct.pack(">BB", 0xff, 0xd0 + (i - 1) % 8))
+        result.append(bytes(scan))
+    result.append(b"\xff\xd9")
+    return b"".join(result)
+
+
+def check_png_passthrough(rawdata, color):
+    """Check whether the zlib data of a PNG can be embedded as-is
+
+    This is only possible for non-interlaced grayscale or RGB images without
+    alpha channel, because the PDF FlateDecode filter with a PNG predictor
+    can then read the IDAT stream directly. Only the chunk headers are read.
+    Returns the position of the IDAT payload (see parse_png_chunks()), the
+    depth and the decode parameters, or None if the image has to be decoded
+    and re-encoded.
+    """
+
+    try:
+        width, height, depth, colortype, interlace, idatranges = \
+            parse_png_chunks(rawdata)
+    except (ValueError, struct.error) as e:
+        logging.debug("cannot parse png: %s", e)
+        return None
+    if interlace != 0:
+        return None
+    # bilevel images are transcoded to CCITT Group4 instead and 16 bit
+    # images would need PDF 1.5
+    if colortype == 0 and depth in [2, 4, 8] and color == Colorspace.L:
+        colors = 1
+    elif colortype == 2 and depth == 8 and color == Colorspace.RGB:
+        colors = 3
+    else:
+        return None
+    decodeparms = {"Predictor": 15, "Colors": colors,
+                   "BitsPerComponent": depth, "Columns": width}
+    return idatranges, depth, decodeparms
+
+
+def get_png_passthrough(rawdata, color):
+    """Return the zlib data and depth of a PNG that can be embedded as-is
+
+    None is returned if the image has to be decoded and re-encoded (see
+    check_png_passthrough()).
+    """
+
+    passthrough = check_png_passthrough(rawdata, color)
+    if passthrough is None:
+        return None
+    idatranges, depth, decodeparms = passthrough
+    pngidat = b"".join(rawdata[offset:offset+length]
+                       for offset, length in idatranges)
+    return pngidat, depth, decodeparms
+
+
+def get_flate_compressor(compression=None):
+    """Return a zlib compression object for the given compression settings
+
+    The settings are given as a dictionary which may contain the compression
+    level (0 to 9), the strategy (a FlateStrategy value), the memlevel (1 to
+    9) and the base two logarithm of the window size as wbits (9 to 15).
+    Missing settings keep the zlib defaults.
+    """
+
+    if compression is None:
+        compression = {}
+    unknown = set(compression) - set(["level", "strategy", "memlevel",
+                                      "wbits"])
+    if unknown:
+        raise ValueError("unknown compression settings: %s"
+                         % ", ".join(sorted(unknown)))
+    strategy = compression.get("strategy", FlateStrategy.default)
+    if strategy == FlateStrategy.default:
+        zstrategy = zlib.Z_DEFAULT_STRATEGY
+    elif strategy == FlateStrategy.filtered:
+        zstrategy = zlib.Z_FILTERED
+    elif strategy == FlateStrategy.rle:
+        zstrategy = zlib.Z_RLE
+    elif strategy == FlateStrategy.huffman:
+        zstrategy = zlib.Z_HUFFMAN_ONLY
+    else:
+        raise ValueError("unknown compression strategy: %s" % strategy)
+    level = compression.get("level", zlib.Z_DEFAULT_COMPRESSION)
+    memlevel = compression.get("memlevel", 8)
+    wbits = compression.get("wbits", zlib.MAX_WBITS)
+    # negative values or values larger than 15 would select a raw deflate or
+    # gzip stream but PDF needs the zlib format
+    if not 9 <= wbits <= 15:
+        raise ValueError("wbits must be between 9 and 15: %s" % wbits)
+    return zlib.compressobj(level, zlib.DEFLATED, wbits, memlevel, zstrategy)
+
+
+def flate_encode(chunks, compression=None):
+    """Compress an iterable of byte strings into a single zlib stream"""
+
+    compressor = get_flate_compressor(compression)
+    result = [compressor.compress(chunk) for chunk in chunks]
+    result.append(compressor.flush())
+    return b"".join(result)
+
+
+def trace(tracer, stage, start, **attributes):
+    """Report a span of the given stage that began at start and ends now
+
+    Callers only call this if a tracer was given, so that tracing costs
+    nothing otherwise.
+    """
+
+    tracer(stage, start, time.time(), attributes)
+
+
+def iter_image_bands(imgdata, mode=None, band_size=4194304):
+    """Yield the raw pixel data of the PIL.Image imgdata in horizontal bands
+
+    Each band holds as many rows as fit into roughly band_size bytes. If mode
+    is given, every band is converted to that mode before. Compared to
+    imgdata.convert(mode).tobytes(), only one band at a time has to be held
+    in memory in addition to the decoded image.
+    """
+
+    from PIL import Image
+
+    width, height = imgdata.size
+    rowsize = width * Image.getmodebands(mode or imgdata.mode)
+    rows = max(1, band_size // max(1, rowsize))
+    for top in range(0, height, rows):
+        band = imgdata.crop((0, top, width, min(top + rows, height)))
+        if mode is not None and band.mode != mode:
+            band = band.convert(mode)
+        yield band.tobytes()
+
+
+def open_image(rawdata, colorspace, tracer=None):
+    """Find out the format of rawdata and read its header
+
+    Returns the file object PIL reads from, the PIL image, the image format
+    and, for JPEG and JPEG2000 images, their metadata. JPEG and JPEG2000
+    images that are embedded as-is are not opened with PIL, so the first two
+    are None for them.
+    """
+
+    im = None
+    imgdata = None
+    imgformat = None
+    metadata = None
+    if rawdata[:3] == b"\xff\xd8\xff":
+        imgformat = ImageFormat.JPEG
+    elif rawdata[:12] == b"\x00\x00\x00\x0cjP  \r\n\x87\n" or \
+            rawdata[:4] == b"\xff\x4f\xff\x51":
+        # JP2 file or raw codestream
+        imgformat = ImageFormat.JPEG2000
+    if imgformat is not None:
+        # JPEG and JPEG2000 images are embedded as-is, so only their header
+        # is read
+        if tracer is not None:
+            start = time.time()
+        try:
+            metadata = get_imgmetadata(None, imgformat, default_dpi,
+                                       colorspace, rawdata)
+            if tracer is not None:
+                trace(tracer, "metadata", start, frame=0,
+                      format=imgformat.name)
+        except Exception as e:
+            # PIL has to decode the JPEG images that PDF readers cannot, for
+            # example arithmetic coded ones
+            logging.debug("cannot read %s header: %s", imgformat.name, e)
+            imgformat = None
+    if imgformat is None:
+        from PIL import Image
+        if isinstance(rawdata, mmap.mmap):
+            # PIL can read from the memory mapped file directly and JPEG and
+            # JPEG2000 data is passed on as a view into the mapping, so the
+            # file content never has to be copied onto the heap as a whole
+            im = rawdata
+        else:
+            im = BytesIO(rawdata)
+        im.seek(0)
+        if tracer is not None:
+            start = time.time()
+        try:
+            imgdata = Image.open(im)
+        except IOError as e:
+            raise ImageOpenError("cannot read input image. "
+                                 "PIL: error reading image: %s" % e)
+        else:
+            if tracer is not None:
+                trace(tracer, "open", start, format=imgdata.format)
+            for f in ImageFormat:
+                if f.name == imgdata.format:
+                    imgformat = f
+            # JPEG images which PIL opens were rejected by the JPEG header
+            # parser and have to be decoded
+            if imgformat is None or imgformat == ImageFormat.JPEG:
+                imgformat = ImageFormat.other
 
     logging.debug("imgformat = %s", imgformat.name)
+    return im, imgdata, imgformat, metadata
+
+
+def check_jpeg_colorspace(color):
+    if color == Colorspace['1']:
+        raise JpegColorspaceError("jpeg can't be monochrome")
+    if color == Colorspace['P']:
+        raise JpegColorspaceError("jpeg can't have a color palette")
+    if color == Colorspace['RGBA']:
+        raise JpegColorspaceError("jpeg can't have an alpha channel")
+
+
+def get_passthrough(imgdata, imgformat, rawdata, color, frame):
+    """Return the data of a frame that PDF readers can decode as it is
+
+    The result is a tuple of the image format, the image data, the bit
+    depth, the decode parameters and whether the colors are inverted, or
+    None if the frame has to be decoded and compressed again.
+    """
+
+    # PNG image data can be copied verbatim if the PDF reader can undo the
+    # PNG row filters through the Flate predictor
+    if imgformat == ImageFormat.PNG and frame == 0 and \
+            not getattr(imgdata, "is_animated", False):
+        passthrough = get_png_passthrough(rawdata, color)
+        if passthrough is not None:
+            logging.debug("Copying png image data")
+            pngidat, depth, decodeparms = passthrough
+            return (imgformat, pngidat, depth, decodeparms, False)
+
+    # CCITT Group4 compressed TIFF frames can be copied verbatim
+    if imgformat == ImageFormat.TIFF and color == Colorspace['1']:
+        passthrough = get_ccitt_passthrough(imgdata, rawdata)
+        if passthrough is not None:
+            logging.debug("Copying CCITT Group4 image data")
+            ccittdata, inverted = passthrough
+            return (ImageFormat.CCITTGroup4, ccittdata, 1, None, inverted)
+
+    # JPEG compressed TIFF frames are turned into JPEG images
+    if imgformat == ImageFormat.TIFF:
+        passthrough = get_tiff_jpeg_passthrough(imgdata, rawdata, color)
+        if passthrough is not None:
+            logging.debug("Copying JPEG data from TIFF")
+            jpegdata, decodeparms = passthrough
+            return (ImageFormat.JPEG, jpegdata, 8, decodeparms, False)
+
+    # LZW, PackBits and Deflate compressed TIFF strips are decoded by the PDF
+    # reader
+    if imgformat == ImageFormat.TIFF:
+        passthrough = get_tiff_strip_passthrough(imgdata, rawdata, color)
+        if passthrough is not None:
+            logging.debug("Copying TIFF strips")
+            return passthrough
+    return None
+
+
+def check_passthrough(imgdata, imgformat, rawdata, color, frame):
+    """Return the image format get_passthrough() would embed a frame with
+
+    Only the headers and tags of the frame are read, so this is much cheaper
+    than get_passthrough(). None is returned if the frame has to be decoded
+    and compressed again. PackBits compressed TIFF strips are not checked
+    for runs that end early (see check_tiff_strip_passthrough()).
+    """
+
+    if imgformat == ImageFormat.PNG and frame == 0 and \
+            not getattr(imgdata, "is_animated", False):
+        if check_png_passthrough(rawdata, color) is not None:
+            return imgformat
+    if imgformat == ImageFormat.TIFF and color == Colorspace['1']:
+        if check_ccitt_passthrough(imgdata, rawdata) is not None:
+            return ImageFormat.CCITTGroup4
+    if imgformat == ImageFormat.TIFF:
+        if check_tiff_jpeg_passthrough(imgdata, rawdata, color) is not None:
+            return ImageFormat.JPEG
+        passthrough = check_tiff_strip_passthrough(imgdata, rawdata, color)
+        if passthrough is not None:
+            return passthrough[0]
+    return None
+
+
+def get_flate_mode(color):
+    """Return the mode to convert a frame to before compressing it, if any
+
+    Bilevel frames are transcoded to CCITT Group4 instead, so color must
+    not be Colorspace['1'].
+    """
+
+    if color in [Colorspace.RGB, Colorspace.L, Colorspace.CMYK,
+                 Colorspace["CMYK;I"]]:
+        logging.debug("Colorspace is OK: %s", color)
+        return None
+    if color in [Colorspace.RGBA, Colorspace.P, Colorspace.other]:
+        logging.debug("Converting colorspace %s to RGB", color)
+        return 'RGB'
+    raise ValueError("unknown colorspace: %s" % color.name)
+
+
+def get_downsampled_size(imgwidthpx, imgheightpx, ndpi, max_dpi):
+    """Return the size to scale a frame down to so that it has at most
+    max_dpi or None if it does not have to be scaled down
+    """
+
+    if max_dpi is None or (ndpi[0] <= max_dpi and ndpi[1] <= max_dpi):
+        return None
+    width = max(1, int(round(imgwidthpx *
+                             min(1.0, float(max_dpi) / ndpi[0]))))
+    height = max(1, int(round(imgheightpx *
+                              min(1.0, float(max_dpi) / ndpi[1]))))
+    if width == imgwidthpx and height == imgheightpx:
+        return None
+    return width, height
+
+
+def get_downsampled_mode(color):
+    # bilevel and palette images would be scaled down without interpolation,
+    # so they are converted first
+    if color == Colorspace['1']:
+        return 'L'
+    return get_flate_mode(color)
+
+
+def downsample(imgdata, imgformat, color, ndpi, imgwidthpx, imgheightpx,
+               size, colorspace, compression=None):
+    """Return the read_images() result of a frame scaled down to size
+
+    The layout of the page is still computed from the original size and
+    resolution, so that the page does not change. JPEG images are only
+    decoded at the smallest scale that is at least as large as size (see
+    PIL's Image.draft()) and are encoded as JPEG again with their own
+    quantization tables. Everything else is compressed with flate like
+    frames that cannot be passed through.
+    """
+
+    from PIL import Image
+    imgdata.draft(None, size)
+    newmode = get_downsampled_mode(color)
+    if newmode is None:
+        frame = imgdata
+    else:
+        logging.debug("Converting colorspace %s to %s", color, newmode)
+        frame = imgdata.convert(newmode)
+        color = Colorspace[newmode]
+    logging.debug("Scaling %dx%d down to %dx%d", imgwidthpx, imgheightpx,
+                  *size)
+    frame = frame.resize(size, Image.LANCZOS)
+    if imgformat == ImageFormat.JPEG:
+        from PIL import JpegImagePlugin
+        output = BytesIO()
+        frame.save(output, "JPEG", qtables=imgdata.quantization,
+                   subsampling=JpegImagePlugin.get_sampling(imgdata))
+        jpegdata = output.getvalue()
+        # PIL stores CMYK images with inverted colors
+        color = get_imgmetadata(None, imgformat, default_dpi, colorspace,
+                                jpegdata)[0]
+        return (color, ndpi, imgformat, jpegdata, size[0], size[1], 8, None,
+                False, (imgwidthpx, imgheightpx))
+    imggz = flate_encode(iter_image_bands(frame, None), compression)
+    return (color, ndpi, ImageFormat.other, imggz, size[0], size[1], 8, None,
+            False, (imgwidthpx, imgheightpx))
+
+
+def read_images(rawdata, colorspace, first_frame_only=False,
+                compression=None, tracer=None, max_dpi=None):
+    im, imgdata, imgformat, metadata = open_image(rawdata, colorspace, tracer)
 
     # depending on the input format, determine whether to pass the raw
     # image or the zlib compressed color information
     if imgformat == ImageFormat.JPEG or imgformat == ImageFormat.JPEG2000:
-        color, ndpi, imgwidthpx, imgheightpx = get_imgmetadata(
-                imgdata, imgformat, default_dpi, colorspace, rawdata)
-        if color == Colorspace['1']:
-            raise JpegColorspaceError("jpeg can't be monochrome")
-        if color == Colorspace['P']:
-            raise JpegColorspaceError("jpeg can't have a color palette")
-        if color == Colorspace['RGBA']:
-            raise JpegColorspaceError("jpeg can't have an alpha channel")
-        im.close()
-        return [(color, ndpi, imgformat, rawdata, imgwidthpx, imgheightpx)]
+        if metadata is None:
+            metadata = get_imgmetadata(imgdata, imgformat, default_dpi,
+                                       colorspace, rawdata)
+        color, ndpi, imgwidthpx, imgheightpx = metadata
+        check_jpeg_colorspace(color)
+        size = get_downsampled_size(imgwidthpx, imgheightpx, ndpi, max_dpi)
+        if size is not None:
+            from PIL import Image
+            if tracer is not None:
+                start = time.time()
+            if imgdata is None:
+                if isinstance(rawdata, mmap.mmap):
+                    im = rawdata
+                else:
+                    im = BytesIO(rawdata)
+                im.seek(0)
+                imgdata = Image.open(im)
+            result = [downsample(imgdata, imgformat, color, ndpi, imgwidthpx,
+                                 imgheightpx, size, colorspace, compression)]
+            if tracer is not None:
+                trace(tracer, "downsample", start, frame=0,
+                      codec=result[0][2].name, bytes_out=len(result[0][3]))
+            imgdata.close()
+            if im is not rawdata:
+                im.close()
+            return result
+        if isinstance(rawdata, mmap.mmap):
+            rawdata = get_mmap_view(rawdata)
+        elif im is not None:
+            im.close()
+        return [(color, ndpi, imgformat, rawdata, imgwidthpx, imgheightpx, 8,
+                 None, False, (imgwidthpx, imgheightpx))]
     else:
         result = []
         img_page_count = 0
@@ -714,36 +1889,78 @@ def read_images(rawdata, colorspace, first_frame_only=False):
 
             logging.debug("Converting frame: %d" % img_page_count)
 
+            if tracer is not None:
+                start = time.time()
             color, ndpi, imgwidthpx, imgheightpx = get_imgmetadata(
                     imgdata, imgformat, default_dpi, colorspace)
-
-            newimg = None
+            if tracer is not None:
+                trace(tracer, "metadata", start, frame=img_page_count,
+                      format=imgformat.name)
+                # the passthroughs that do not apply are part of the span of
+                # the one that does or of the transcoding and compression
+                start = time.time()
+
+            # frames that are scaled down cannot be passed through
+            size = get_downsampled_size(imgwidthpx, imgheightpx, ndpi,
+                                        max_dpi)
+            if size is not None:
+                result.append(downsample(imgdata, imgformat, color, ndpi,
+                                         imgwidthpx, imgheightpx, size,
+                                         colorspace, compression))
+                if tracer is not None:
+                    trace(tracer, "downsample", start, frame=img_page_count,
+                          codec="flate", bytes_out=len(result[-1][3]))
+                img_page_count += 1
+                continue
+
+            passthrough = get_passthrough(imgdata, imgformat, rawdata, color,
+                                          img_page_count)
+            if passthrough is not None:
+                passformat, passdata, depth, decodeparms, inverted = \
+                    passthrough
+                result.append((color, ndpi, passformat, passdata, imgwidthpx,
+                               imgheightpx, depth, decodeparms, inverted,
+                               (imgwidthpx, imgheightpx)))
+                if tracer is not None:
+                    trace(tracer, "passthrough", start, frame=img_page_count,
+                          codec=passformat.name, bytes_out=len(passdata))
+                img_page_count += 1
+                continue
+
+            # the mode the image has to be converted to, if any
+            newmode = None
             if color == Colorspace['1']:
                 try:
                     ccittdata = transcode_monochrome(imgdata)
-                    imgformat = ImageFormat.CCITTGroup4
-                    result.append((color, ndpi, imgformat, ccittdata,
-                                   imgwidthpx, imgheightpx))
+                    result.append((color, ndpi, ImageFormat.CCITTGroup4,
+                                   ccittdata, imgwidthpx, imgheightpx, 1,
+                                   None, False, (imgwidthpx, imgheightpx)))
+                    if tracer is not None:
+                        trace(tracer, "transcode_monochrome", start,
+                              frame=img_page_count,
+                              codec=ImageFormat.CCITTGroup4.name,
+                              bytes_out=len(ccittdata))
                     img_page_count += 1
                     continue
                 except Exception as e:
                     logging.debug(e)
                     logging.debug("Converting colorspace 1 to L")
-                    newimg = imgdata.convert('L')
+                    newmode = 'L'
                     color = Colorspace.L
-            elif color in [Colorspace.RGB, Colorspace.L, Colorspace.CMYK,
-                           Colorspace["CMYK;I"]]:
-                logging.debug("Colorspace is OK: %s", color)
-                newimg = imgdata
-            elif color in [Colorspace.RGBA, Colorspace.P, Colorspace.other]:
-                logging.debug("Converting colorspace %s to RGB", color)
-                newimg = imgdata.convert('RGB')
-                color = Colorspace.RGB
             else:
-                raise ValueError("unknown colorspace: %s" % color.name)
-            imggz = zlib.compress(newimg.tobytes())
-            result.append((color, ndpi, imgformat, imggz, imgwidthpx,
-                           imgheightpx))
+                newmode = get_flate_mode(color)
+                if newmode is not None:
+                    color = Colorspace[newmode]
+            imggz = flate_encode(iter_image_bands(imgdata, newmode),
+                                 compression)
+            result.append((color, ndpi, ImageFormat.other, imggz,
+                           imgwidthpx, imgheightpx, 8, None, False,
+                           (imgwidthpx, imgheightpx)))
+            if tracer is not None:
+                # the colorspace conversion is done band by band while
+                # compressing, so it is part of this span
+                trace(tracer, "compress", start, frame=img_page_count,
+                      codec="flate", convert=newmode, bytes_out=len(imggz))
             img_page_count += 1
         # the python-pil version 2.3.0-1ubuntu3 in Ubuntu does not have the
         # close() method
@@ -751,10 +1968,97 @@ def read_images(rawdata, colorspace, first_frame_only=False):
             imgdata.close()
         except AttributeError:
             pass
-        im.close()
+        if im is not rawdata:
+            im.close()
         return result
 
 
+def probe_images(rawdata, colorspace, first_frame_only=False, max_dpi=None):
+    """Return the metadata of each frame of an image and how it is embedded
+
+    Like read_images() but nothing is decoded, compressed or copied. Only
+    the headers of the image and the tags of its frames are read (see
+    check_passthrough()).
+    """
+
+    im, imgdata, imgformat, metadata = open_image(rawdata, colorspace)
+    if imgdata is None:
+        fileformat = imgformat.name
+    else:
+        fileformat = imgdata.format
+
+    def frame_info(frame, color, ndpi, imgwidthpx, imgheightpx, codec,
+                   passthrough, newmode=None, size=None):
+        return {"frame": frame, "format": fileformat, "width": imgwidthpx,
+                "height": imgheightpx, "dpi": list(ndpi),
+                "colorspace": color.name, "codec": codec,
+                "passthrough": passthrough, "convert": newmode,
+                "downsample": None if size is None else list(size)}
+
+    result = []
+    if imgformat == ImageFormat.JPEG or imgformat == ImageFormat.JPEG2000:
+        if metadata is None:
+            metadata = get_imgmetadata(imgdata, imgformat, default_dpi,
+                                       colorspace, rawdata)
+        color, ndpi, imgwidthpx, imgheightpx = metadata
+        check_jpeg_colorspace(color)
+        size = get_downsampled_size(imgwidthpx, imgheightpx, ndpi, max_dpi)
+        if size is None:
+            info = frame_info(0, color, ndpi, imgwidthpx, imgheightpx,
+                              imgformat.name, True)
+        elif imgformat == ImageFormat.JPEG:
+            info = frame_info(0, color, ndpi, imgwidthpx, imgheightpx,
+                              imgformat.name, False, None, size)
+        else:
+            info = frame_info(0, color, ndpi, imgwidthpx, imgheightpx,
+                              "flate", False, get_downsampled_mode(color),
+                              size)
+        result.append(info)
+    else:
+        img_page_count = 0
+        while True:
+            try:
+                imgdata.seek(img_page_count)
+            except EOFError:
+                break
+            if first_frame_only and img_page_count > 0:
+                break
+            color, ndpi, imgwidthpx, imgheightpx = get_imgmetadata(
+                    imgdata, imgformat, default_dpi, colorspace)
+            size = get_downsampled_size(imgwidthpx, imgheightpx, ndpi,
+                                        max_dpi)
+            # frames that are scaled down cannot be passed through
+            passformat = None
+            if size is None:
+                passformat = check_passthrough(imgdata, imgformat, rawdata,
+                                               color, img_page_count)
+            if size is not None:
+                info = frame_info(img_page_count, color, ndpi, imgwidthpx,
+                                  imgheightpx, "flate", False,
+                                  get_downsampled_mode(color), size)
+            elif passformat is not None:
+                info = frame_info(img_page_count, color, ndpi, imgwidthpx,
+                                  imgheightpx, passformat.name, True)
+            elif color == Colorspace['1']:
+                # if transcoding fails, the frame is compressed as L instead
+                info = frame_info(img_page_count, color, ndpi, imgwidthpx,
+                                  imgheightpx, ImageFormat.CCITTGroup4.name,
+                                  False)
+            else:
+                info = frame_info(img_page_count, color, ndpi, imgwidthpx,
+                                  imgheightpx, "flate", False,
+                                  get_flate_mode(color))
+            result.append(info)
+            img_page_count += 1
+        try:
+            imgdata.close()
+        except AttributeError:
+            pass
+    if im is not None and im is not rawdata:
+        im.close()
+    return result
+
+
 # converts a length in pixels to a length in PDF units (1/72 of an inch)
 def px_to_pt(length, dpi):
     return 72.0*length/dpi
@@ -984,29 +2288,364 @@ def get_fixed_dpi_layout_fun(fixed_dpi):
     return fixed_dpi_layout_fun
 
 
+def read_rawdata(img):
+    """Return the image content of a path, file-like object or binary string
+
+    Files given by their path are memory mapped instead of being read.
+    """
+
+    # img is allowed to be a path, a binary string representing image data
+    # or a file-like object (really anything that implements read())
+    try:
+        return img.read()
+    except AttributeError:
+        if isinstance(img, bytearray):
+            return bytes(img)
+        if not isinstance(img, (str, bytes)):
+            raise TypeError(
+                    "Neither implements read() nor is str or bytes")
+    # the thing doesn't have a read() function, so try if we can treat
+    # it as a file name
+    try:
+        with open(img, "rb") as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # empty files, pipes and other special files cannot be
+                # mapped
+                return f.read()
+    except:
+        # whatever the exception is (string could contain NUL
+        # characters or the path could just not exist) it's not a file
+        # name so we now try treating it as raw image content
+        return img
+
+
+def read_input_images(img, colorspace, first_frame_only=False,
+                      compression=None, copy=False, tracer=None,
+                      max_dpi=None):
+    """Read and convert all frames of a single input image
+
+    This is the unit of work that convert() hands to its worker processes,
+    so it has to be a picklable module level function. With copy=True, image
+    data that is a view into a memory mapped input file is returned as bytes
+    so that the result can be sent to another process.
+    """
+
+    if tracer is not None:
+        start = time.time()
+    rawdata = read_rawdata(img)
+    if tracer is not None:
+        trace(tracer, "read", start, bytes_in=len(rawdata))
+    result = read_images(rawdata, colorspace, first_frame_only, compression,
+                         tracer, max_dpi)
+    if copy:
+        result = [frame[:3] + (frame[3].tobytes(),) + frame[4:]
+                  if isinstance(frame[3], memoryview) else frame
+                  for frame in result]
+    return result
+
+
+def read_input_images_traced(img, colorspace, first_frame_only=False,
+                             compression=None, copy=False, max_dpi=None):
+    """Like read_input_images() but also return the spans it traced
+
+    The tracer given to convert() cannot be called from another process, so
+    the spans are sent back to be replayed to it.
+    """
+
+    spans = []
+    result = read_input_images(img, colorspace, first_frame_only,
+                               compression, copy,
+                               lambda *span: spans.append(span), max_dpi)
+    return result, spans
+
+
+def input_tracer(tracer, index):
+    """Return a tracer that adds the index of the input to all spans"""
+
+    def trace_input(stage, start, end, attributes):
+        attributes["input"] = index
+        tracer(stage, start, end, attributes)
+    return trace_input
+
+
+def get_cpu_count():
+    try:
+        return os.cpu_count() or 1
+    except AttributeError:
+        # Python 2
+        import multiprocessing
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+
+
+def get_worker_pool(workers=None, executor=None):
+    """Return the executor to use, its number of workers and whether it has
+    to be shut down by the caller
+
+    A given executor is used as it is. Its number of workers is the given
+    one or else that of the executor. Otherwise, a new process pool with the
+    given number of workers is started. A workers value of 0 or None means
+    one worker per CPU. With Python 2, the futures package is needed.
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if executor is not None:
+        if not workers:
+            workers = getattr(executor, "_max_workers", None) or \
+                get_cpu_count()
+        return executor, workers, False
+    if not workers:
+        workers = get_cpu_count()
+    return ProcessPoolExecutor(max_workers=workers), workers, True
+
+
+def iter_input_images(images, colorspace, first_frame_only=False,
+                      compression=None, workers=None, executor=None,
+                      tracer=None, max_dpi=None):
+    """Yield the result of read_images() for each input in input order
+
+    If neither workers nor executor is given, all inputs are processed one
+    after another in the calling process. Otherwise, reading, decoding and
+    compressing of up to two inputs per worker is done concurrently by the
+    executor that get_worker_pool() returns for workers and executor.
+
+    The spans of each input are reported to tracer, if given, before the
+    result of that input is yielded.
+    """
+
+    if workers is None and executor is None:
+        for index, img in enumerate(images):
+            yield read_input_images(
+                img, colorspace, first_frame_only, compression, False,
+                None if tracer is None else input_tracer(tracer, index),
+                max_dpi)
+        return
+
+    from collections import deque
+
+    executor, workers, own_executor = get_worker_pool(workers, executor)
+    pending = deque()
+    if tracer is None:
+        read = read_input_images
+    else:
+        read = read_input_images_traced
+
+    def collect(index, future):
+        if tracer is None:
+            return future.result()
+        result, spans = future.result()
+        trace_input = input_tracer(tracer, index)
+        for stage, start, end, attributes in spans:
+            trace_input(stage, start, end, attributes)
+        return result
+    try:
+        for index, img in enumerate(images):
+            # file-like objects cannot be sent to another process, so they
+            # are read here
+            if hasattr(img, "read"):
+                img = img.read()
+            pending.append((index, executor.submit(
+                read, img, colorspace, first_frame_only, compression, True,
+                max_dpi=max_dpi)))
+            # limit the number of inputs in flight so that memory usage does
+            # not grow with the number of input images
+            if len(pending) >= 2 * workers:
+                yield collect(*pending.popleft())
+        while pending:
+            yield collect(*pending.popleft())
+    finally:
+        for index, future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
 # given one or more input image, depending on outputstream, either return a
 # string containing the whole PDF if outputstream is None or write the PDF
 # data to the given file-like object and return None
 #
 # Input images can be given as file like objects (they must implement read()),
 # as a binary string representing the image content or as filenames to the
-# images.
+# images. Instead of passing each input as an argument, a single iterable of
+# inputs can be passed, for example a list or a generator. The inputs are
+# taken from it one at a time when they are about to be converted, so that
+# a generator does not have to produce all of them up front.
+#
+# By default, the input images are processed one after another. Passing
+# workers=N reads, decodes and compresses them in a pool of N processes (0
+# means one per CPU) and passing a concurrent.futures executor reuses that
+# instead. In both cases, the pages end up in the PDF in input order.
+#
+# Images that cannot be embedded as they are get zip/flate encoded using the
+# settings in the compression dictionary (see get_flate_compressor()).
+#
+# Passing max_dpi scales every frame with a higher resolution down to max_dpi
+# before it is embedded. The pages keep the size they would have without it.
+# JPEG images are decoded at a reduced scale right away and are encoded as
+# JPEG again with their own quantization tables. All other frames that are
+# scaled down are zip/flate encoded, bilevel ones as grayscale.
+#
+# Passing streaming=True together with an outputstream writes the PDF to it
+# while the pages are added, so that the image data of all pages does not
+# have to be kept in memory. This only works without pdfrw. The header is
+# written with the first page, so if a later page needs a higher PDF version
+# (like for JPEG2000), the catalog gets a /Version entry instead. The info,
+# catalog and pages objects are written last and, if the conversion fails,
+# what was written so far is left in outputstream.
+#
+# Passing object_streams=True creates a PDF 1.5 file in which all objects
+# without a stream are stored in compressed object streams and that has a
+# cross-reference stream instead of a cross-reference table. This implies
+# with_pdfrw=False.
+#
+# To find out where the time goes, pass a function as tracer. It is called
+# as tracer(stage, start, end, attributes) for every stage of the conversion
+# after it has finished, with the start and end time in seconds since the
+# epoch and a dictionary of attributes. The stages are "read" (reading the
+# input), "open" (Image.open()), "metadata" (get_imgmetadata()),
+# "passthrough" (copying the image data of a frame as it is),
+# "transcode_monochrome", "compress" (colorspace conversion and zlib
+# compression), "downsample" (decoding, scaling down and encoding a frame
+# because of max_dpi), "layout", "page" (adding the page to the PDF) and
+# "write" (writing the PDF). Depending on the stage, the attributes are the
+# index of the input, the index of the frame in the input, the index of the
+# page, the image format, the codec and the number of bytes in and out. Spans
+# of inputs that are read by workers are reported in input order once their
+# result arrives.
 def convert(*images, **kwargs):
 
-    _default_kwargs = dict(
-        title=None,
-        author=None, creator=None, producer=None, creationdate=None,
-        moddate=None, subject=None, keywords=None, colorspace=None,
-        nodate=False, layout_fun=default_layout_fun, viewer_panes=None,
-        viewer_initial_page=None, viewer_magnification=None,
-        viewer_page_layout=None, viewer_fit_window=False,
-        viewer_center_window=False, viewer_fullscreen=False,
-        with_pdfrw=True, outputstream=None, first_frame_only=False)
-    for kwname, default in _default_kwargs.items():
+    pdf = get_convert_pdfdoc(kwargs)
+    images = get_inputs(images)
+
+    tracer = kwargs['tracer']
+    page = 0
+    for index, frames in enumerate(iter_input_images(
+            images, kwargs['colorspace'], kwargs['first_frame_only'],
+            kwargs['compression'], kwargs['workers'], kwargs['executor'],
+            tracer, kwargs['max_dpi'])):
+        page = add_input_pages(pdf, index, frames, page, kwargs['layout_fun'],
+                               tracer)
+        # the image data of this input is not needed while the next one is
+        # read
+        frames = None
+
+    if tracer is not None:
+        start = time.time()
+    if kwargs['outputstream']:
+        pdf.tostream(kwargs['outputstream'])
+        if tracer is not None:
+            trace(tracer, "write", start, pages=page)
+        return
+
+    result = pdf.tostring()
+    if tracer is not None:
+        trace(tracer, "write", start, pages=page, bytes_out=len(result))
+    return result
+
+
+class ChunkBuffer(object):
+    # collects the output of the PDF writer and hands it out in chunks of
+    # at most chunk_size bytes
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.data = bytearray()
+
+    def write(self, data):
+        # the writer reuses its buffer, so the data has to be copied
+        self.data += data
+
+    def flush(self):
+        pass
+
+    def chunks(self):
+        chunk_size = self.chunk_size
+        while self.data:
+            chunk = bytes(self.data[:chunk_size])
+            del self.data[:chunk_size]
+            yield chunk
+
+
+# Like convert() but instead of returning the PDF or writing it to an
+# outputstream, yield it in chunks of at most chunk_size bytes. This is meant
+# for streaming the PDF as the response of a web application, for example by
+# returning the iterator from a WSGI application.
+#
+# Unlike convert(), with_pdfrw defaults to False and streaming to True because
+# pdfrw can only write the PDF at the end while the internal PDF writer writes
+# each page as soon as it is added. The first chunk is thus ready once the
+# first input image is converted and, as only the image data of the current
+# input is kept in memory, memory usage does not grow with the number of pages.
+def convert_iter(*images, **kwargs):
+
+    if kwargs.get('outputstream') is not None:
+        raise TypeError("convert_iter() does not take an outputstream")
+    chunk_size = kwargs.pop('chunk_size', 65536)
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive: %s" % chunk_size)
+    if 'with_pdfrw' not in kwargs:
+        kwargs['with_pdfrw'] = False
+    if 'streaming' not in kwargs:
+        kwargs['streaming'] = True
+    buf = ChunkBuffer(chunk_size)
+    kwargs['outputstream'] = buf
+    pdf = get_convert_pdfdoc(kwargs)
+    images = get_inputs(images)
+
+    tracer = kwargs['tracer']
+    page = 0
+    for index, frames in enumerate(iter_input_images(
+            images, kwargs['colorspace'], kwargs['first_frame_only'],
+            kwargs['compression'], kwargs['workers'], kwargs['executor'],
+            tracer, kwargs['max_dpi'])):
+        page = add_input_pages(pdf, index, frames, page, kwargs['layout_fun'],
+                               tracer)
+        # the image data of this input must not be kept until the generator
+        # is resumed
+        frames = None
+        for chunk in buf.chunks():
+            yield chunk
+
+    if tracer is not None:
+        start = time.time()
+    pdf.tostream(buf)
+    if tracer is not None:
+        trace(tracer, "write", start, pages=page)
+    for chunk in buf.chunks():
+        yield chunk
+
+
+convert_defaults = dict(
+    title=None,
+    author=None, creator=None, producer=None, creationdate=None,
+    moddate=None, subject=None, keywords=None, colorspace=None,
+    nodate=False, layout_fun=default_layout_fun, viewer_panes=None,
+    viewer_initial_page=None, viewer_magnification=None,
+    viewer_page_layout=None, viewer_fit_window=False,
+    viewer_center_window=False, viewer_fullscreen=False,
+    with_pdfrw=True, outputstream=None, first_frame_only=False,
+    compression=None, workers=None, executor=None, object_streams=False,
+    tracer=None, max_dpi=None, streaming=False)
+
+
+def get_convert_pdfdoc(kwargs):
+    """Return the pdfdoc for the keyword arguments of convert()
+
+    Keyword arguments that are missing from kwargs are set to their
+    defaults.
+    """
+
+    for kwname, default in convert_defaults.items():
         if kwname not in kwargs:
             kwargs[kwname] = default
+    if kwargs['max_dpi'] is not None and kwargs['max_dpi'] <= 0:
+        raise ValueError("max_dpi must be positive: %s" % kwargs['max_dpi'])
 
-    pdf = pdfdoc(
+    return pdfdoc(
         "1.3",
         kwargs['title'], kwargs['author'], kwargs['creator'],
         kwargs['producer'], kwargs['creationdate'], kwargs['moddate'],
@@ -1014,61 +2653,168 @@ def convert(*images, **kwargs):
         kwargs['viewer_panes'], kwargs['viewer_initial_page'],
         kwargs['viewer_magnification'], kwargs['viewer_page_layout'],
         kwargs['viewer_fit_window'], kwargs['viewer_center_window'],
-        kwargs['viewer_fullscreen'], kwargs['with_pdfrw'])
+        kwargs['viewer_fullscreen'], kwargs['with_pdfrw'],
+        kwargs['outputstream'] if kwargs['streaming'] else None,
+        kwargs['object_streams'])
 
-    # backwards compatibility with older img2pdf versions where the first
-    # argument to the function had to be given as a list
-    if len(images) == 1:
-        # if only one argument was given and it is a list, expand it
-        if isinstance(images[0], (list, tuple)):
-            images = images[0]
 
-    if not isinstance(images, (list, tuple)):
-        images = [images]
+def is_single_input(img):
+    # file-like objects and strings can be iterated over but are single
+    # inputs, just like everything that cannot be iterated over
+    if hasattr(img, "read") or \
+            isinstance(img, (bytes, bytearray, memoryview, type(u""))):
+        return True
+    try:
+        iter(img)
+    except TypeError:
+        return True
+    return False
 
-    for img in images:
-        # img is allowed to be a path, a binary string representing image data
-        # or a file-like object (really anything that implements read())
-        try:
-            rawdata = img.read()
-        except AttributeError:
-            if not isinstance(img, (str, bytes)):
-                raise TypeError(
-                        "Neither implements read() nor is str or bytes")
-            # the thing doesn't have a read() function, so try if we can treat
-            # it as a file name
-            try:
-                with open(img, "rb") as f:
-                    rawdata = f.read()
-            except:
-                # whatever the exception is (string could contain NUL
-                # characters or the path could just not exist) it's not a file
-                # name so we now try treating it as raw image content
-                rawdata = img
-
-        for color, ndpi, imgformat, imgdata, imgwidthpx, imgheightpx \
-                in read_images(
-                    rawdata, kwargs['colorspace'], kwargs['first_frame_only']):
-            pagewidth, pageheight, imgwidthpdf, imgheightpdf = \
-                kwargs['layout_fun'](imgwidthpx, imgheightpx, ndpi)
-            if pagewidth < 3.00 or pageheight < 3.00:
-                logging.warning("pdf width or height is below 3.00 - too "
-                                "small for some viewers!")
-            elif pagewidth > 14400.0 or pageheight > 14400.0:
-                raise PdfTooLargeError(
-                        "pdf width or height must not exceed 200 inches.")
-            # the image is always centered on the page
-            imgxpdf = (pagewidth - imgwidthpdf)/2.0
-            imgypdf = (pageheight - imgheightpdf)/2.0
-            pdf.add_imagepage(color, imgwidthpx, imgheightpx, imgformat,
-                              imgdata, imgwidthpdf, imgheightpdf, imgxpdf,
-                              imgypdf, pagewidth, pageheight)
 
-    if kwargs['outputstream']:
-        pdf.tostream(kwargs['outputstream'])
-        return
+def get_inputs(images):
+    """Return the positional arguments of convert() as an iterable of inputs
+
+    If the only argument is an iterable of inputs like a list or a generator,
+    it is returned as it is, so that each input is only taken from it when
+    it is about to be converted.
+    """
+
+    if len(images) == 1 and not is_single_input(images[0]):
+        return images[0]
+    return images
+
+
+def add_input_pages(pdf, index, frames, page, layout_fun, tracer=None):
+    """Add a page for each frame that read_images() returned for an input
+
+    index is the index of the input and page that of the first page to add.
+    The index of the page after the last added one is returned.
+    """
+
+    for frame, (color, ndpi, imgformat, imgdata, imgwidthpx, imgheightpx,
+                depth, decodeparms, inverted, layoutsize) in enumerate(frames):
+        if tracer is not None:
+            start = time.time()
+        # the layout of frames that were scaled down is that of the original
+        pagewidth, pageheight, imgwidthpdf, imgheightpdf = \
+            layout_fun(layoutsize[0], layoutsize[1], ndpi)
+        if tracer is not None:
+            trace(tracer, "layout", start, input=index, frame=frame,
+                  page=page)
+        if pagewidth < 3.00 or pageheight < 3.00:
+            logging.warning("pdf width or height is below 3.00 - too "
+                            "small for some viewers!")
+        elif pagewidth > 14400.0 or pageheight > 14400.0:
+            raise PdfTooLargeError(
+                    "pdf width or height must not exceed 200 inches.")
+        # the image is always centered on the page
+        imgxpdf = (pagewidth - imgwidthpdf)/2.0
+        imgypdf = (pageheight - imgheightpdf)/2.0
+        if tracer is not None:
+            start = time.time()
+        pdf.add_imagepage(color, imgwidthpx, imgheightpx, imgformat,
+                          imgdata, imgwidthpdf, imgheightpdf, imgxpdf,
+                          imgypdf, pagewidth, pageheight, depth,
+                          decodeparms, inverted)
+        if tracer is not None:
+            trace(tracer, "page", start, input=index, frame=frame,
+                  page=page, format=imgformat.name,
+                  bytes_in=len(imgdata))
+        page += 1
+    return page
+
+
+def probe_input(img, colorspace=None, first_frame_only=False,
+                max_dpi=None):
+    """Return what probe() reports about a single input
+
+    Like read_input_images(), this is what the worker processes of probe()
+    run.
+    """
+
+    try:
+        rawdata = read_rawdata(img)
+        return {"bytes": len(rawdata),
+                "frames": probe_images(rawdata, colorspace,
+                                       first_frame_only, max_dpi)}
+    except Exception as e:
+        logging.debug("cannot probe input: %s", e)
+        return {"error": str(e)}
+
+
+# given one or more input images like convert() does, return a list with a
+# dictionary for each input that describes the pages convert() would make of
+# it, without decoding or compressing any image data. This makes it cheap to
+# validate uploads, count pages or estimate the work before converting.
+#
+# The dictionary of an input has the size of the input in bytes as "bytes"
+# and a list of dictionaries, one for each frame, as "frames". If the input
+# cannot be converted, there is an "error" with the reason instead. The
+# dictionary of a frame has the index of the frame as "frame", the file
+# format as "format", the size in pixels as "width" and "height", the
+# resolution as "dpi", the PIL colorspace as "colorspace" and the codec the
+# image data is embedded with as "codec". The codec is an ImageFormat name or
+# "flate". "passthrough" tells whether the image data is copied as it is and
+# "convert" is the mode the frame is converted to before it is compressed,
+# if any. "downsample" is the size in pixels the frame is scaled down to, if
+# any. All values can be serialized as JSON. Only headers and tags are read,
+# so a PackBits compressed TIFF frame with a broken run is reported as
+# passthrough even though convert() compresses it again.
+#
+# The colorspace, first_frame_only and max_dpi keyword arguments are those
+# of convert(). Passing workers=N or an executor probes the inputs in
+# parallel like convert() does.
+def probe(*images, **kwargs):
+
+    colorspace = kwargs.pop('colorspace', None)
+    first_frame_only = kwargs.pop('first_frame_only', False)
+    max_dpi = kwargs.pop('max_dpi', None)
+    workers = kwargs.pop('workers', None)
+    executor = kwargs.pop('executor', None)
+    if kwargs:
+        raise TypeError("unexpected keyword arguments: %s"
+                        % ", ".join(sorted(kwargs)))
+    images = get_inputs(images)
+
+    if workers is None and executor is None:
+        return [probe_input(img, colorspace, first_frame_only, max_dpi)
+                for img in images]
+
+    from itertools import repeat
+
+    executor, workers, own_executor = get_worker_pool(workers, executor)
+    try:
+        # file-like objects cannot be sent to another process, so they are
+        # read here. Probing an input is quick, so the inputs are sent to
+        # the worker processes in batches.
+        return list(executor.map(
+            probe_input,
+            [img.read() if hasattr(img, "read") else img for img in images],
+            repeat(colorspace), repeat(first_frame_only), repeat(max_dpi),
+            chunksize=16))
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+
+def count_pages(images, first_frame_only=False, workers=None,
+                executor=None):
+    """Return the number of pages convert() makes of a list of inputs
+
+    Inputs that probe() cannot read count as one page.
+    """
+
+    if first_frame_only:
+        return len(images)
+    return sum(len(info.get("frames", [None]))
+               for info in probe(images, workers=workers, executor=executor))
 
-    return pdf.tostring()
+
+def argument_type_error(msg):
+    # argparse is only imported if an argument is invalid or the command line
+    # is parsed
+    import argparse
+    return argparse.ArgumentTypeError(msg)
 
 
 def parse_num(num, name):
@@ -1089,7 +2835,7 @@ def parse_num(num, name):
         except ValueError:
             msg = "%s is not a floating point number and doesn't have a " \
                   "valid unit: %s" % (name, num)
-            raise argparse.ArgumentTypeError(msg)
+            raise argument_type_error(msg)
     if unit is None:
         unit = Unit.pt
     else:
@@ -1098,7 +2844,7 @@ def parse_num(num, name):
             num = float(num)
         except ValueError:
             msg = "%s is not a floating point number: %s" % (name, num)
-            raise argparse.ArgumentTypeError(msg)
+            raise argument_type_error(msg)
     if unit == Unit.cm:
         num = cm_to_pt(num)
     elif unit == Unit.mm:
@@ -1130,7 +2876,7 @@ def parse_imgsize_num(num, name):
         except ValueError:
             msg = "%s is not a floating point number and doesn't have a " \
                   "valid unit: %s" % (name, num)
-            raise argparse.ArgumentTypeError(msg)
+            raise argument_type_error(msg)
     if unit is None:
         unit = ImgUnit.pt
     else:
@@ -1145,7 +2891,7 @@ def parse_imgsize_num(num, name):
             num = float(num)
         except ValueError:
             msg = "%s is not a floating point number: %s" % (name, num)
-            raise argparse.ArgumentTypeError(msg)
+            raise argument_type_error(msg)
     if unit == ImgUnit.cm:
         num = (ImgSize.abs, cm_to_pt(num))
     elif unit == ImgUnit.mm:
@@ -1179,8 +2925,8 @@ def parse_pagesize_rectarg(string):
     if transposed:
         w, h = h, w
     if w is None and h is None:
-        raise argparse.ArgumentTypeError("at least one dimension must be "
-                                         "specified")
+        raise argument_type_error("at least one dimension must be "
+                                  "specified")
     return w, h
 
 
@@ -1202,8 +2948,8 @@ def parse_imgsize_rectarg(string):
     if transposed:
         w, h = h, w
     if w is None and h is None:
-        raise argparse.ArgumentTypeError("at least one dimension must be "
-                                         "specified")
+        raise argument_type_error("at least one dimension must be "
+                                  "specified")
     return w, h
 
 
@@ -1212,24 +2958,24 @@ def parse_colorspacearg(string):
         if c.name == string:
             return c
     allowed = ", ".join([c.name for c in Colorspace])
-    raise argparse.ArgumentTypeError("Unsupported colorspace: %s. Must be one "
-                                     "of: %s." % (string, allowed))
+    raise argument_type_error("Unsupported colorspace: %s. Must be one "
+                              "of: %s." % (string, allowed))
 
 
 def parse_borderarg(string):
     if ':' in string:
         h, v = string.split(':', 1)
         if h == '':
-            raise argparse.ArgumentTypeError("missing value before colon")
+            raise argument_type_error("missing value before colon")
         if v == '':
-            raise argparse.ArgumentTypeError("missing value after colon")
+            raise argument_type_error("missing value after colon")
     else:
         if string == '':
-            raise argparse.ArgumentTypeError("border option cannot be empty")
+            raise argument_type_error("border option cannot be empty")
         h, v = string, string
     h, v = parse_num(h, "left/right border"), parse_num(v, "top/bottom border")
     if h is None and v is None:
-        raise argparse.ArgumentTypeError("missing value")
+        raise argument_type_error("missing value")
     return h, v
 
 
@@ -1238,33 +2984,112 @@ def input_images(path):
         # we slurp in all data from stdin because we need to seek in it later
         result = sys.stdin.buffer.read()
         if len(result) == 0:
-            raise argparse.ArgumentTypeError("\"%s\" is empty" % path)
+            raise argument_type_error("\"%s\" is empty" % path)
     else:
         try:
             if os.path.getsize(path) == 0:
-                raise argparse.ArgumentTypeError("\"%s\" is empty" % path)
+                raise argument_type_error("\"%s\" is empty" % path)
             # test-read a byte from it so that we can abort early in case
             # we cannot read data from the file
             with open(path, "rb") as im:
                 im.read(1)
         except IsADirectoryError:
-            raise argparse.ArgumentTypeError(
+            raise argument_type_error(
                 "\"%s\" is a directory" % path)
         except PermissionError:
-            raise argparse.ArgumentTypeError(
+            raise argument_type_error(
                 "\"%s\" permission denied" % path)
         except FileNotFoundError:
-            raise argparse.ArgumentTypeError(
+            raise argument_type_error(
                 "\"%s\" does not exist" % path)
         result = path
     return result
 
 
+def parse_jobsarg(string):
+    try:
+        jobs = int(string)
+    except ValueError:
+        raise argument_type_error("not an integer: %s" % string)
+    if jobs < 0:
+        raise argument_type_error("must not be negative: %s" % string)
+    return jobs
+
+
+def parse_maxdpiarg(string):
+    try:
+        dpi = float(string)
+    except ValueError:
+        raise argument_type_error("not a number: %s" % string)
+    if dpi <= 0:
+        raise argument_type_error("must be positive: %s" % string)
+    return dpi
+
+
+def parse_bodysizearg(string):
+    try:
+        size = int(string)
+    except ValueError:
+        raise argument_type_error("not an integer: %s" % string)
+    if size <= 0:
+        raise argument_type_error("must be positive: %s" % string)
+    return size
+
+
+def parse_servearg(string):
+    # a path to a unix domain socket or a TCP port with an optional host
+    if "/" in string:
+        return string
+    host, _, port = string.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        raise argument_type_error("not a port number: %s" % string)
+    if not 0 <= port <= 65535:
+        raise argument_type_error("not a port number: %s" % string)
+    return (host or "127.0.0.1", port)
+
+
+def parse_compressionarg(string):
+    compression = {}
+    for setting in string.split(","):
+        if "=" not in setting:
+            key, value = "level", setting
+        else:
+            key, value = setting.split("=", 1)
+        key = key.strip().lower()
+        value = value.strip()
+        if key == "strategy":
+            for s in FlateStrategy:
+                if s.name == value.lower():
+                    compression[key] = s
+                    break
+            else:
+                allowed = ", ".join([s.name for s in FlateStrategy])
+                raise argument_type_error(
+                    "Unsupported compression strategy: %s. Must be one of: "
+                    "%s." % (value, allowed))
+            continue
+        if key not in ["level", "memlevel", "wbits"]:
+            raise argument_type_error(
+                "unknown compression setting: %s" % key)
+        try:
+            compression[key] = int(value)
+        except ValueError:
+            raise argument_type_error(
+                "compression %s is not an integer: %s" % (key, value))
+    try:
+        get_flate_compressor(compression)
+    except ValueError as e:
+        raise argument_type_error(str(e))
+    return compression
+
+
 def parse_fitarg(string):
     for m in FitMode:
         if m.name == string.lower():
             return m
-    raise argparse.ArgumentTypeError("unknown fit mode: %s" % string)
+    raise argument_type_error("unknown fit mode: %s" % string)
 
 
 def parse_panes(string):
@@ -1272,8 +3097,8 @@ def parse_panes(string):
         if m.name == string.lower():
             return m
     allowed = ", ".join([m.name for m in PageMode])
-    raise argparse.ArgumentTypeError("Unsupported page mode: %s. Must be one "
-                                     "of: %s." % (string, allowed))
+    raise argument_type_error("Unsupported page mode: %s. Must be one "
+                              "of: %s." % (string, allowed))
 
 
 def parse_magnification(string):
@@ -1285,9 +3110,9 @@ def parse_magnification(string):
     except ValueError:
         pass
     allowed = ", ".join([m.name for m in Magnification])
-    raise argparse.ArgumentTypeError("Unsupported magnification: %s. Must be "
-                                     "a floating point number or one of: %s." %
-                                     (string, allowed))
+    raise argument_type_error("Unsupported magnification: %s. Must be "
+                              "a floating point number or one of: %s." %
+                              (string, allowed))
 
 
 def parse_layout(string):
@@ -1295,8 +3120,8 @@ def parse_layout(string):
         if l.name == string.lower():
             return l
     allowed = ", ".join([l.name for l in PageLayout])
-    raise argparse.ArgumentTypeError("Unsupported page layout: %s. Must be "
-                                     "one of: %s." % (string, allowed))
+    raise argument_type_error("Unsupported page layout: %s. Must be "
+                              "one of: %s." % (string, allowed))
 
 
 def valid_date(string):
@@ -1335,10 +3160,12 @@ def valid_date(string):
             pass
         else:
             return datetime.utcfromtimestamp(int(utime))
-    raise argparse.ArgumentTypeError("cannot parse date: %s" % string)
+    raise argument_type_error("cannot parse date: %s" % string)
 
 
-def main():
+def get_main_parser():
+    import argparse
+
     rendered_papersizes = ""
     for k, v in sorted(papersizes.items()):
         rendered_papersizes += "    %-8s %s\n" % (papernames[k], v)
@@ -1351,10 +3178,14 @@ images. This leads to a lossless conversion of JPEG and JPEG2000 images with
 the only added file size coming from the PDF container itself.
 
 Other raster graphics formats are losslessly stored in a zip/flate encoding of
-their RGB representation. This might increase file size and does not store
-transparency. There is nothing that can be done about that until the PDF format
-allows embedding other image formats like PNG. Thus, img2pdf is primarily
-useful to convert JPEG and JPEG2000 images to PDF.
+their RGB representation. Grayscale and RGB PNG images that are neither
+interlaced nor have an alpha channel are copied without re-encoding because
+their image data already is zip/flate encoded. The same goes for most TIFF
+images compressed with JPEG, CCITT Group4, LZW, PackBits or Deflate because PDF
+readers can decode these. The zip/flate encoding of other images might increase
+file size and does not store transparency. There is nothing that can be done
+about that until the PDF format allows embedding other image formats like PNG.
+Thus, img2pdf is primarily useful to convert JPEG and JPEG2000 images to PDF.
 
 The output is sent to standard output so that it can be redirected into a file
 or to another program as part of a shell pipe. To directly write the output
@@ -1434,6 +3265,25 @@ Argument parsing:
   The order of non-positional arguments (all arguments other than the input
   images) does not matter.
 
+Conversion server:
+  With --serve, img2pdf keeps running and converts the images it receives
+  over HTTP, which saves starting the interpreter and loading the libraries
+  for every document. POST the image to / or, for several images, send them
+  as the parts of a multipart/form-data body. Options are given in the query
+  string as their unabbreviated long names without the leading dashes.
+  Options without a value are given without an equal sign. The --output,
+  --streaming, --jobs, --serve, --max-body-size, --probe, --verbose, --version
+  and --help options cannot be used. Request bodies larger than
+  --max-body-size are rejected.
+  The PDF is sent back using chunked transfer encoding while it is written.
+  A GET request to /metrics returns the number of requests, failed requests,
+  requests in progress, pages and bytes as well as the latencies of the
+  recent requests as JSON.
+
+    $ img2pdf --serve 8080 --jobs 4 &
+    $ curl --data-binary @page1.jpg -o out.pdf \\
+        'http://127.0.0.1:8080/?pagesize=A4&nodate'
+
 Examples:
   Lines starting with a dollar sign denote commands you can enter into your
   terminal. The dollar sign signifies your command prompt. It is not part of
@@ -1483,6 +3333,36 @@ Report bugs at https://gitlab.mister-muffin.de/josch/img2pdf/issues
         '-v', '--verbose', action="store_true",
         help='Makes the program operate in verbose mode, printing messages on '
              'standard error.')
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=parse_jobsarg,
+        help='Read, decode and compress up to N input images in parallel. '
+             'A value of 0 uses one process per CPU. The pages are still '
+             'written in the order of the input images. By default, all '
+             'input images are converted one after another.')
+    parser.add_argument(
+        '--serve', metavar='ADDRESS', type=parse_servearg,
+        help='Instead of converting the input images, run a local HTTP server '
+             'that converts the images it receives. ADDRESS is a port, '
+             'optionally prefixed by a host and a colon, or the path of a '
+             'unix domain socket. The host defaults to 127.0.0.1. The images '
+             'are converted by a pool of --jobs worker processes (by default '
+             'one per CPU) which is started up front. See the epilogue for '
+             'details.')
+    parser.add_argument(
+        '--max-body-size', metavar='BYTES', type=parse_bodysizearg,
+        default=default_max_body_size,
+        help='With --serve, rejects requests whose body is larger than BYTES '
+             'bytes. The default is %d bytes.' % default_max_body_size)
+    parser.add_argument(
+        '--probe', action='store_true',
+        help='Instead of converting the input images, print what would be '
+             'done with them as JSON. For each frame, its size, resolution '
+             'and colorspace are printed together with the codec its image '
+             'data is embedded with and whether that data is copied as it '
+             'is. Only the image headers are read, so this is much faster '
+             'than converting. With --jobs, the input images are probed in '
+             'parallel. The exit status is 1 if an input image cannot be '
+             'converted.')
     parser.add_argument(
         '-V', '--version', action='version', version='%(prog)s '+__version__,
         help="Prints version information and exits.")
@@ -1529,6 +3409,43 @@ RGB.''')
              "input image be converted into a page in the resulting PDF."
             )
 
+    outargs.add_argument(
+        "--compression", metavar="SPEC", type=parse_compressionarg,
+        help="Sets up the zip/flate encoder used for images that cannot be "
+             "embedded without re-encoding. SPEC is a comma separated list "
+             "of settings of the form key=value. Valid keys are level (0 to "
+             "9, lower is faster), strategy (%s), memlevel (1 to 9) and "
+             "wbits (9 to 15). A plain number sets the level. Example: "
+             "level=1,strategy=rle" % ", ".join(
+                 [s.name for s in FlateStrategy]))
+
+    outargs.add_argument(
+        "--max-dpi", metavar="DPI", type=parse_maxdpiarg,
+        help="Scales every image with a resolution higher than DPI down to "
+             "DPI. The page size stays the same. This is lossy and means "
+             "that the image data cannot be copied as it is, but it makes "
+             "the output smaller and the conversion of large images faster. "
+             "JPEG images are only decoded at a fraction of their size and "
+             "are stored as JPEG again with the same quality settings. "
+             "Bilevel images become grayscale.")
+
+    outargs.add_argument(
+        "--streaming", action="store_true",
+        help="Writes each page to the output as soon as it is converted "
+             "instead of keeping all pages in memory until the end. This "
+             "only works together with --without-pdfrw or --object-streams. "
+             "The PDF version in the header is that of the first page and "
+             "if the conversion fails, an incomplete PDF is left in the "
+             "output.")
+
+    outargs.add_argument(
+        "--object-streams", action="store_true",
+        help="Creates a PDF 1.5 file that stores page objects and other "
+             "small objects in compressed object streams and that has a "
+             "compressed cross-reference stream instead of a cross-reference "
+             "table. This makes the output of documents with many pages "
+             "smaller. Implies --without-pdfrw.")
+
     sizeargs = parser.add_argument_group(
         title='Image and page size and layout arguments',
         description='''\
@@ -1697,13 +3614,413 @@ values set via the --border option.
         '--viewer-fullscreen', action="store_true",
         help='Instruct the PDF viewer to open the PDF in fullscreen mode')
 
-    args = parser.parse_args()
+    return parser
 
-    if args.verbose:
-        logging.basicConfig(level=logging.DEBUG)
+
+def get_convert_kwargs(args):
+    """Return the keyword arguments to convert() for the parsed arguments"""
 
     layout_fun = get_layout_fun(args.pagesize, args.imgsize, args.border,
                                 args.fit, args.auto_orient)
+    return dict(
+        title=args.title, author=args.author, creator=args.creator,
+        producer=args.producer, creationdate=args.creationdate,
+        moddate=args.moddate, subject=args.subject, keywords=args.keywords,
+        colorspace=args.colorspace, nodate=args.nodate, layout_fun=layout_fun,
+        viewer_panes=args.viewer_panes,
+        viewer_initial_page=args.viewer_initial_page,
+        viewer_magnification=args.viewer_magnification,
+        viewer_page_layout=args.viewer_page_layout,
+        viewer_fit_window=args.viewer_fit_window,
+        viewer_center_window=args.viewer_center_window,
+        viewer_fullscreen=args.viewer_fullscreen,
+        with_pdfrw=not args.without_pdfrw,
+        first_frame_only=args.first_frame_only,
+        compression=args.compression, object_streams=args.object_streams,
+        max_dpi=args.max_dpi)
+
+
+def warm_worker():
+    # load all PIL image plugins so that the first image a worker opens does
+    # not have to wait for it
+    from PIL import Image
+    Image.init()
+    return os.getpid()
+
+
+# the long options of the command line that can be given per request of the
+# server
+server_options = [
+    "colorspace", "nodate", "without-pdfrw", "first-frame-only",
+    "compression", "max-dpi", "object-streams", "pagesize", "imgsize",
+    "border", "fit", "auto-orient", "title", "author", "creator", "producer",
+    "creationdate", "moddate", "subject", "keywords", "viewer-panes",
+    "viewer-initial-page", "viewer-magnification", "viewer-page-layout",
+    "viewer-fit-window", "viewer-center-window", "viewer-fullscreen"]
+
+# the largest request body in bytes the server accepts by default
+default_max_body_size = 100 * 1024 * 1024
+
+
+def parse_multipart(body, contenttype):
+    """Return the payloads of the parts of a multipart/form-data body
+
+    Unlike the email module, this only copies the payload of each part. A
+    ValueError is raised if the body is not a valid multipart body.
+    """
+
+    import binascii
+    from email.message import Message
+
+    header = Message()
+    header["Content-Type"] = contenttype
+    boundary = header.get_param("boundary")
+    if not boundary:
+        raise ValueError("multipart body without boundary")
+    delimiter = b"--" + boundary.encode("ascii")
+    pos = body.find(delimiter)
+    if pos < 0:
+        raise ValueError("invalid multipart body")
+    pos += len(delimiter)
+    parts = []
+    # the closing delimiter has two dashes appended
+    while body[pos:pos+2] != b"--":
+        # skip the rest of the delimiter line
+        eol = body.find(b"\r\n", pos)
+        end = body.find(b"\r\n" + delimiter, eol)
+        if eol < 0 or end < 0:
+            raise ValueError("invalid multipart body")
+        headerend = body.find(b"\r\n\r\n", eol)
+        if headerend < 0 or headerend > end:
+            raise ValueError("invalid multipart body")
+        encoding = None
+        for line in body[eol+2:headerend].split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-transfer-encoding":
+                encoding = value.strip().lower()
+        payload = body[headerend+4:end]
+        if encoding == b"base64":
+            try:
+                payload = binascii.a2b_base64(payload)
+            except binascii.Error as e:
+                raise ValueError("invalid base64 part: %s" % e)
+        elif encoding not in [None, b"7bit", b"8bit", b"binary"]:
+            raise ValueError("unsupported Content-Transfer-Encoding: %s"
+                             % encoding.decode("ascii", "replace"))
+        parts.append(payload)
+        pos = end + 2 + len(delimiter)
+    return parts
+
+
+def get_server(address, executor=None, workers=None,
+               max_body_size=default_max_body_size):
+    """Return an HTTP server which converts the images posted to it
+
+    address is a (host, port) tuple or the path of a unix domain socket.
+    The conversion of each request runs in a thread of its own. If an
+    executor is given, the images are read, decoded and compressed by it
+    with up to two images per worker in flight for each request.
+
+    The request body is a single image or a multipart/form-data body with
+    one image per part. The query string holds the long options of the
+    command line without the leading dashes, like pagesize=A4&nodate, where
+    options without a value are given without "=". The PDF is sent back as
+    it is written, using chunked transfer encoding. If the conversion fails
+    after the first chunk has been sent, the connection is closed without
+    the final chunk. Requests with a body larger than max_body_size bytes
+    are rejected. GET /metrics returns counters and latencies as JSON.
+    """
+
+    import json
+    import threading
+    import socket
+    from collections import deque
+    try:
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from socketserver import ThreadingMixIn, UnixStreamServer
+        from urllib.parse import urlsplit, parse_qsl
+    except ImportError:
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        from SocketServer import ThreadingMixIn, UnixStreamServer
+        from urlparse import urlsplit, parse_qsl
+
+    parser = get_main_parser()
+
+    class LengthRequiredError(Exception):
+        pass
+
+    class BodyTooLargeError(Exception):
+        pass
+
+    def error(message):
+        raise ValueError(message)
+    # report invalid options to the client instead of exiting
+    parser.error = error
+    # only unabbreviated long options are accepted, so that options which
+    # are not allowed cannot be given by a prefix
+    options = set(server_options)
+
+    lock = threading.Lock()
+    metrics = {"requests": 0, "failed": 0, "in_flight": 0, "pages": 0,
+               "bytes_in": 0, "bytes_out": 0}
+    # the latencies of the most recent requests in seconds
+    latencies = deque(maxlen=1000)
+    started = time.time()
+
+    def get_metrics():
+        with lock:
+            result = dict(metrics)
+            recent = sorted(latencies)
+        result["uptime"] = time.time() - started
+        result["workers"] = workers
+        if recent:
+            result["latency"] = {
+                "count": len(recent),
+                "mean": sum(recent) / len(recent),
+                "p50": recent[len(recent) // 2],
+                "p95": recent[min(len(recent) - 1, len(recent) * 95 // 100)],
+                "max": recent[-1],
+            }
+        else:
+            result["latency"] = None
+        return result
+
+    class ChunkedWriter(object):
+        # sends the response headers with the first chunk of the PDF
+        def __init__(self, handler):
+            self.handler = handler
+            self.started = False
+            self.written = 0
+
+        def write(self, data):
+            if not data:
+                return
+            if not self.started:
+                self.handler.send_response(200)
+                self.handler.send_header("Content-Type", "application/pdf")
+                self.handler.send_header("Transfer-Encoding", "chunked")
+                self.handler.end_headers()
+                self.started = True
+            # wfile is not buffered, so each chunk is sent with a single
+            # write
+            self.handler.wfile.write(
+                ("%x\r\n" % len(data)).encode("ascii") + data + b"\r\n")
+            self.written += len(data)
+
+        def flush(self):
+            pass
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # otherwise the small writes of a response wait for the delayed
+        # acknowledgement of the previous one on keep-alive connections.
+        # Unix domain sockets have no such option.
+        disable_nagle_algorithm = isinstance(address, tuple)
+
+        def address_string(self):
+            # clients of a unix domain socket have no address
+            if isinstance(self.client_address, tuple):
+                return self.client_address[0]
+            return "unix"
+
+        def log_message(self, format, *args):
+            logging.info("%s %s", self.address_string(), format % args)
+
+        def send_text(self, code, text):
+            body = (text + "\n").encode("utf8")
+            self.send_response(code)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            if self.close_connection:
+                self.send_header("Connection", "close")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlsplit(self.path).path != "/metrics":
+                self.send_text(404, "not found")
+                return
+            body = json.dumps(get_metrics(), sort_keys=True).encode("ascii")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            length = self.headers.get("Content-Length")
+            if length is None:
+                raise LengthRequiredError("Content-Length is required")
+            try:
+                size = int(length)
+            except ValueError:
+                size = -1
+            if size < 0:
+                raise ValueError("invalid Content-Length: %s" % length)
+            if size > max_body_size:
+                raise BodyTooLargeError("request body larger than %d bytes"
+                                        % max_body_size)
+            return self.rfile.read(size)
+
+        def parse_images(self, body):
+            contenttype = self.headers.get("Content-Type", "")
+            if not contenttype.startswith("multipart/form-data"):
+                return [body]
+            return parse_multipart(body, contenttype)
+
+        def parse_options(self):
+            argv = []
+            query = urlsplit(self.path).query
+            for key, value in parse_qsl(query, keep_blank_values=True):
+                if key not in options:
+                    raise ValueError("unknown or forbidden option: %s" % key)
+                if value:
+                    argv.append("--%s=%s" % (key, value))
+                else:
+                    argv.append("--%s" % key)
+            return parser.parse_args(argv)
+
+        def do_POST(self):
+            start = time.time()
+            with lock:
+                metrics["requests"] += 1
+                metrics["in_flight"] += 1
+            output = ChunkedWriter(self)
+            pages = []
+            images = []
+            body = None
+            try:
+                try:
+                    # the body is read before anything else can fail, so
+                    # that it is not taken for the next request on the
+                    # connection
+                    body = self.read_body()
+                    if urlsplit(self.path).path != "/":
+                        raise LookupError("not found")
+                    args = self.parse_options()
+                    images = self.parse_images(body)
+                    if not images or not all(images):
+                        raise ValueError("no input image")
+                    kwargs = get_convert_kwargs(args)
+                    initial_page = kwargs["viewer_initial_page"]
+                    # only if there are fewer inputs than that, their
+                    # frames are counted
+                    if initial_page is not None and (
+                            initial_page < 1 or
+                            initial_page > len(images) and
+                            initial_page > count_pages(
+                                images, kwargs["first_frame_only"])):
+                        raise ValueError("viewer-initial-page must be between "
+                                         "1 and the number of pages")
+                    convert(images, outputstream=output, executor=executor,
+                            workers=workers, streaming=True,
+                            tracer=lambda stage, *span:
+                            pages.append(1) if stage == "page" else None,
+                            **kwargs)
+                except Exception as e:
+                    with lock:
+                        metrics["failed"] += 1
+                    logging.error("error: %s", e)
+                    if body is None:
+                        # where the next request starts is unknown
+                        self.close_connection = True
+                    if output.started:
+                        # the client notices the missing final chunk
+                        self.close_connection = True
+                    elif isinstance(e, LengthRequiredError):
+                        self.send_text(411, "error: %s" % e)
+                    elif isinstance(e, BodyTooLargeError):
+                        self.send_text(413, "error: %s" % e)
+                    elif isinstance(e, LookupError):
+                        self.send_text(404, "not found")
+                    elif isinstance(e, (ValueError, NegativeDimensionError,
+                                        UnsupportedColorspaceError,
+                                        ImageOpenError, JpegColorspaceError,
+                                        PdfTooLargeError)):
+                        self.send_text(400, "error: %s" % e)
+                    else:
+                        self.send_text(500, "error: %s" % e)
+                else:
+                    self.wfile.write(b"0\r\n\r\n")
+            finally:
+                with lock:
+                    metrics["in_flight"] -= 1
+                    metrics["pages"] += len(pages)
+                    metrics["bytes_in"] += sum(len(i) for i in images)
+                    metrics["bytes_out"] += output.written
+                    latencies.append(time.time() - start)
+
+    if isinstance(address, tuple):
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+    else:
+        class Server(ThreadingMixIn, UnixStreamServer):
+            daemon_threads = True
+
+            def server_bind(self):
+                UnixStreamServer.server_bind(self)
+                # BaseHTTPRequestHandler expects these
+                self.server_name = socket.gethostname()
+                self.server_port = 0
+
+    server = Server(address, Handler)
+    server.get_metrics = get_metrics
+    return server
+
+
+def serve(address, workers=None, max_body_size=default_max_body_size):
+    """Run the conversion server of get_server() until interrupted
+
+    The worker processes are started before the first request arrives.
+    """
+
+    import signal
+
+    pid = os.getpid()
+
+    def terminate(signum, frame):
+        if os.getpid() != pid:
+            # a worker process inherited the handler
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+        raise KeyboardInterrupt()
+    # clean up when being terminated by a service manager as well
+    signal.signal(signal.SIGTERM, terminate)
+
+    warm_worker()
+    executor, workers = get_worker_pool(workers)[:2]
+    try:
+        for future in [executor.submit(warm_worker) for _ in range(workers)]:
+            future.result()
+        server = get_server(address, executor, workers, max_body_size)
+        try:
+            sys.stderr.write("listening on %s\n" % (
+                address if not isinstance(address, tuple)
+                else "%s:%d" % server.server_address[:2]))
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if not isinstance(address, tuple):
+                os.unlink(address)
+    finally:
+        executor.shutdown(wait=True)
+
+
+def main(argv=sys.argv):
+    parser = get_main_parser()
+    args = parser.parse_args(argv[1:])
+
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+
+    if args.serve is not None:
+        if args.images:
+            parser.error("argument --serve: no input images allowed")
+        serve(args.serve, args.jobs, args.max_body_size)
+        return
 
     # if no positional arguments were supplied, read a single image from
     # standard input
@@ -1714,15 +4031,35 @@ values set via the --border option.
         except KeyboardInterrupt:
             exit(0)
 
-    # with the number of pages being equal to the number of images, the
-    # value passed to --viewer-initial-page must be between 1 and that number
+    if args.probe:
+        import json
+        inputs = probe(args.images, colorspace=args.colorspace,
+                       first_frame_only=args.first_frame_only,
+                       max_dpi=args.max_dpi, workers=args.jobs)
+        for img, info in zip(args.images, inputs):
+            # the content of standard input is passed instead of a path
+            info["input"] = img if isinstance(img, str) else "-"
+        report = {"inputs": inputs,
+                  "pages": sum(len(info.get("frames", []))
+                               for info in inputs)}
+        args.output.write(json.dumps(report, indent=2, sort_keys=True)
+                          .encode("utf8") + b"\n")
+        if any("error" in info for info in inputs):
+            exit(1)
+        return
+
+    # the value passed to --viewer-initial-page must be between 1 and the
+    # number of pages. Each image has at least one page, so only if there are
+    # fewer images than that, their frames are counted.
     if args.viewer_initial_page is not None:
         if args.viewer_initial_page < 1:
             parser.print_usage(file=sys.stderr)
             logging.error("%s: error: argument --viewer-initial-page: must be "
                           "greater than zero" % parser.prog)
             exit(2)
-        if args.viewer_initial_page > len(args.images):
+        if args.viewer_initial_page > len(args.images) and \
+                args.viewer_initial_page > count_pages(
+                    args.images, args.first_frame_only, args.jobs):
             parser.print_usage(file=sys.stderr)
             logging.error("%s: error: argument --viewer-initial-page: must be "
                           "less than or equal to the total number of pages" %
@@ -1730,21 +4067,8 @@ values set via the --border option.
             exit(2)
 
     try:
-        convert(
-            *args.images, title=args.title, author=args.author,
-            creator=args.creator, producer=args.producer,
-            creationdate=args.creationdate, moddate=args.moddate,
-            subject=args.subject, keywords=args.keywords,
-            colorspace=args.colorspace, nodate=args.nodate,
-            layout_fun=layout_fun, viewer_panes=args.viewer_panes,
-            viewer_initial_page=args.viewer_initial_page,
-            viewer_magnification=args.viewer_magnification,
-            viewer_page_layout=args.viewer_page_layout,
-            viewer_fit_window=args.viewer_fit_window,
-            viewer_center_window=args.viewer_center_window,
-            viewer_fullscreen=args.viewer_fullscreen, with_pdfrw=not
-            args.without_pdfrw, outputstream=args.output,
-            first_frame_only=args.first_frame_only)
+        convert(*args.images, outputstream=args.output, workers=args.jobs,
+                streaming=args.streaming, **get_convert_kwargs(args))
     except Exception as e:
         logging.error("error: " + str(e))
         if logging.getLogger().isEnabledFor(logging.DEBUG):
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2012-2014 Johannes 'josch' Schauer <j.schauer at email.de>
+#
+# This program is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# This module needs Python 3.5 or later. It is kept apart from img2pdf so
+# that img2pdf can still be used with Python 2.
+
+import asyncio
+import functools
+import inspect
+import time
+
+import img2pdf
+
+
+class OutputBuffer(object):
+    # collects what the PDF writer writes in an executor thread until it is
+    # passed on to the asynchronous sink from the event loop
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def is_async_source(img):
+    # unlike inspect.iscoroutinefunction(), this also recognizes generator
+    # based coroutines like StreamReader.read() before Python 3.7
+    return hasattr(img, "__aiter__") or \
+        asyncio.iscoroutinefunction(getattr(img, "read", None))
+
+
+async def read_async_source(img):
+    """Return the content of an asynchronous byte source
+
+    This is either an object with a coroutine read() method like
+    asyncio.StreamReader, which is called once without arguments and has to
+    return everything until the end, or an asynchronous iterable of byte
+    strings.
+    """
+
+    if not hasattr(img, "__aiter__"):
+        return await img.read()
+    chunks = []
+    async for chunk in img:
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def write_async(sink, data):
+    """Write data to sink and wait until the sink can take more
+
+    sink is an asyncio.StreamWriter or any object whose write() method is a
+    coroutine or takes the data right away. A drain() coroutine method, if
+    present, is awaited after every write, which gives backpressure.
+    """
+
+    if not data:
+        return
+    result = sink.write(data)
+    if inspect.isawaitable(result):
+        await result
+    drain = getattr(sink, "drain", None)
+    if drain is not None:
+        await drain()
+
+
+async def convert_async(*images, **kwargs):
+    """Like img2pdf.convert() but without blocking the event loop
+
+    Besides the inputs that convert() takes, images can be asynchronous byte
+    sources (see read_async_source()). Reading, decoding and compressing the
+    input images is done by the given executor or, if workers is given, by a
+    new process pool with that many processes, or else by the default
+    executor of the event loop. Up to two inputs per worker are in flight.
+    Adding the pages and writing the PDF is done in the default executor of
+    the event loop.
+
+    If outputstream is given, the PDF is written to it as it is produced
+    (see write_async()), otherwise the PDF is returned. Unlike for convert(),
+    streaming defaults to True. Cancelling the task cancels all input images
+    that are not being worked on yet. Those that are being worked on keep
+    running in the executor until they are done.
+
+    The tracer is only ever called from the thread of the event loop.
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # get_event_loop() is deprecated in coroutines
+    loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)()
+    sink = kwargs.pop('outputstream', None)
+    if 'streaming' not in kwargs:
+        kwargs['streaming'] = True
+    buf = OutputBuffer()
+    kwargs['outputstream'] = buf
+    pdf = img2pdf.get_convert_pdfdoc(kwargs)
+    images = img2pdf.get_inputs(images)
+
+    executor = kwargs['executor']
+    workers = kwargs['workers']
+    own_executor = False
+    if executor is not None or workers is not None:
+        executor, workers, own_executor = img2pdf.get_worker_pool(
+            workers, executor)
+    else:
+        # the default executor of the event loop
+        workers = img2pdf.get_cpu_count()
+    # image data that is a view into a memory mapped file cannot be sent
+    # from another process
+    copy = isinstance(executor, ProcessPoolExecutor)
+    tracer = kwargs['tracer']
+
+    if tracer is None:
+        read = img2pdf.read_input_images
+    else:
+        read = img2pdf.read_input_images_traced
+
+    async def submit(img):
+        if is_async_source(img):
+            img = await read_async_source(img)
+        elif hasattr(img, "read") and copy:
+            # file-like objects cannot be sent to another process
+            img = await loop.run_in_executor(None, img.read)
+        return await loop.run_in_executor(executor, functools.partial(
+            read, img, kwargs['colorspace'], kwargs['first_frame_only'],
+            kwargs['compression'], copy, max_dpi=kwargs['max_dpi']))
+
+    pending = []
+    output = []
+
+    async def write(data):
+        if sink is None:
+            output.append(data)
+        else:
+            await write_async(sink, data)
+    try:
+        page = 0
+        for index, img in enumerate(images):
+            pending.append((index, asyncio.ensure_future(submit(img))))
+            if len(pending) < 2 * workers:
+                continue
+            index, future = pending.pop(0)
+            page = await add_pages(loop, pdf, index, await future, page,
+                                   kwargs['layout_fun'], tracer)
+            await write(buf.take())
+        while pending:
+            index, future = pending.pop(0)
+            page = await add_pages(loop, pdf, index, await future, page,
+                                   kwargs['layout_fun'], tracer)
+            await write(buf.take())
+        if tracer is not None:
+            start = time.time()
+        await loop.run_in_executor(None, pdf.tostream, buf)
+        if tracer is not None:
+            img2pdf.trace(tracer, "write", start, pages=page)
+        await write(buf.take())
+    finally:
+        for index, future in pending:
+            future.cancel()
+        if own_executor:
+            try:
+                # work that has not started yet is dropped with Python 3.9
+                # or later
+                executor.shutdown(wait=False, cancel_futures=True)
+            except TypeError:
+                executor.shutdown(wait=False)
+
+    if sink is None:
+        return b"".join(output)
+
+
+async def add_pages(loop, pdf, index, result, page, layout_fun, tracer):
+    # all spans are reported from the event loop thread: those of the input
+    # come with its result and those of adding the pages are collected in
+    # the executor thread
+    if tracer is None:
+        return await loop.run_in_executor(None, functools.partial(
+            img2pdf.add_input_pages, pdf, index, result, page, layout_fun))
+    result, spans = result
+    trace_input = img2pdf.input_tracer(tracer, index)
+    for stage, start, end, attributes in spans:
+        trace_input(stage, start, end, attributes)
+    spans = []
+    try:
+        return await loop.run_in_executor(None, functools.partial(
+            img2pdf.add_input_pages, pdf, index, result, page, layout_fun,
+            lambda *span: spans.append(span)))
+    finally:
+        for span in spans:
+            tracer(*span)
@@ -23,30 +23,48 @@ import struct
 
 
 def getBox(data, byteStart, noBytes):
-    boxLengthValue = struct.unpack(">I", data[byteStart:byteStart+4])[0]
-    boxType = data[byteStart+4:byteStart+8]
+    boxLengthValue = struct.unpack_from(">I", data, byteStart)[0]
+    boxType = data[byteStart+4:byteStart+8].tobytes()
     contentsStartOffset = 8
     if boxLengthValue == 1:
-        boxLengthValue = struct.unpack(">Q", data[byteStart+8:byteStart+16])[0]
+        boxLengthValue = struct.unpack_from(">Q", data, byteStart+8)[0]
         contentsStartOffset = 16
     if boxLengthValue == 0:
         boxLengthValue = noBytes-byteStart
     byteEnd = byteStart + boxLengthValue
+    # data is a memoryview, so this does not copy the box contents
     boxContents = data[byteStart+contentsStartOffset:byteEnd]
     return (boxLengthValue, boxType, byteEnd, boxContents)
 
 
+def readBoxHeader(f, byteStart, noBytes):
+    # like getBox but for a file object, from which only the box header is
+    # read
+    f.seek(byteStart)
+    header = f.read(16)
+    boxLengthValue = struct.unpack_from(">I", header, 0)[0]
+    boxType = header[4:8]
+    contentsStartOffset = 8
+    if boxLengthValue == 1:
+        boxLengthValue = struct.unpack_from(">Q", header, 8)[0]
+        contentsStartOffset = 16
+    if boxLengthValue == 0:
+        boxLengthValue = noBytes-byteStart
+    byteEnd = byteStart + boxLengthValue
+    return (boxLengthValue, boxType, byteEnd,
+            byteStart + contentsStartOffset)
+
+
 def parse_ihdr(data):
-    height = struct.unpack(">I", data[0:4])[0]
-    width = struct.unpack(">I", data[4:8])[0]
+    height, width = struct.unpack_from(">II", data, 0)
     return width, height
 
 
 def parse_colr(data):
-    meth = struct.unpack(">B", data[0:1])[0]
+    meth = struct.unpack_from(">B", data, 0)[0]
     if meth != 1:
         raise Exception("only enumerated color method supported")
-    enumCS = struct.unpack(">I", data[3:])[0]
+    enumCS = struct.unpack_from(">I", data, 3)[0]
     if enumCS == 16:
         return "RGB"
     elif enumCS == 17:
@@ -57,9 +75,10 @@ def parse_colr(data):
 
 
 def parse_resc(data):
-    hnum, hden, vnum, vden, hexp, vexp = struct.unpack(">HHHHBB", data)
-    hdpi = ((hnum/hden) * (10**hexp) * 100)/2.54
-    vdpi = ((vnum/vden) * (10**vexp) * 100)/2.54
+    hnum, hden, vnum, vden, hexp, vexp = struct.unpack_from(">HHHHBB", data, 0)
+    # the resolution is given in grid points per metre
+    hdpi = (float(hnum)/hden) * (10**hexp) * 2.54 / 100
+    vdpi = (float(vnum)/vden) * (10**vexp) * 2.54 / 100
     return hdpi, vdpi
 
 
@@ -74,6 +93,7 @@ def parse_res(data):
         if boxType == b'resc':
             hdpi, vdpi = parse_resc(boxContents)
             break
+        byteStart = byteEnd
     return hdpi, vdpi
 
 
@@ -95,14 +115,67 @@ def parse_jp2h(data):
     return (width, height, colorspace, hdpi, vdpi)
 
 
+def parse_siz(data):
+    # the image and component size marker segment of a raw codestream
+    xsiz, ysiz, xosiz, yosiz = struct.unpack_from(">IIII", data, 4)
+    csiz = struct.unpack_from(">H", data, 36)[0]
+    if csiz == 1:
+        colorspace = "L"
+    elif csiz == 3:
+        colorspace = "RGB"
+    else:
+        raise Exception("only codestreams with one or three components are "
+                        "supported, got %d" % csiz)
+    return xsiz - xosiz, ysiz - yosiz, colorspace
+
+
+def parsej2k(data):
+    if data[0:4].tobytes() != b'\xff\x4f\xff\x51':
+        raise Exception("no SIZ marker after the start of codestream")
+    width, height, colorspace = parse_siz(data[4:])
+    # codestreams carry no resolution
+    return (width, height, colorspace, None, None)
+
+
 def parsejp2(data):
-    noBytes = len(data)
+    """Return the size, colorspace and dpi of a JPEG 2000 image
+
+    data is either a buffer like bytes, a memory map or a memoryview or a
+    seekable file object. Only the header boxes are read; the codestream
+    is skipped. Besides the JP2 file format, raw codestreams are
+    understood as well.
+    """
+    if hasattr(data, "read"):
+        f = data
+        f.seek(0, 2)
+        noBytes = f.tell()
+        f.seek(0)
+        if f.read(4) == b'\xff\x4f\xff\x51':
+            f.seek(0)
+            return parsej2k(memoryview(f.read(42)))
+    else:
+        f = None
+        try:
+            data = memoryview(data)
+        except TypeError:
+            # Python 2 cannot make a memoryview of a memory map
+            data = memoryview(data[:])
+        noBytes = len(data)
+        if data[0:4].tobytes() == b'\xff\x4f\xff\x51':
+            return parsej2k(data)
     byteStart = 0
     boxLengthValue = 1  # dummy value for while loop condition
     width, height, colorspace, hdpi, vdpi = None, None, None, None, None
     while byteStart < noBytes and boxLengthValue != 0:
-        boxLengthValue, boxType, byteEnd, boxContents = \
-            getBox(data, byteStart, noBytes)
+        if f is None:
+            boxLengthValue, boxType, byteEnd, boxContents = \
+                getBox(data, byteStart, noBytes)
+        else:
+            boxLengthValue, boxType, byteEnd, contentsStart = \
+                readBoxHeader(f, byteStart, noBytes)
+            if boxType == b'jp2h':
+                f.seek(contentsStart)
+                boxContents = memoryview(f.read(byteEnd - contentsStart))
         if boxType == b'jp2h':
             width, height, colorspace, hdpi, vdpi = parse_jp2h(boxContents)
             break
@@ -119,7 +192,8 @@ def parsejp2(data):
 
 if __name__ == "__main__":
     import sys
-    width, height, colorspace = parsejp2(open(sys.argv[1]).read())
+    with open(sys.argv[1], "rb") as f:
+        width, height, colorspace = parsejp2(f)[:3]
     sys.stdout.write("width = %d" % width)
     sys.stdout.write("height = %d" % height)
     sys.stdout.write("colorspace = %s" % colorspace)
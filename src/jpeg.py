@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2013 Johannes 'josch' Schauer <j.schauer at email.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+# start of frame markers of the baseline, extended sequential and progressive
+# Huffman coding processes which PDF readers are able to decode
+SOF_SUPPORTED = [0xc0, 0xc1, 0xc2]
+# start of frame markers of the lossless, hierarchical and arithmetic coding
+# processes
+SOF_UNSUPPORTED = [0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf]
+
+
+def getSegment(data, byteStart):
+    # skip fill bytes in front of the marker
+    while data[byteStart:byteStart+2] == b'\xff\xff':
+        byteStart += 1
+    if data[byteStart:byteStart+1] != b'\xff':
+        raise Exception("no jpeg marker at offset %d" % byteStart)
+    marker = struct.unpack_from(">B", data, byteStart+1)[0]
+    # markers without a segment
+    if marker == 0x01 or 0xd0 <= marker <= 0xd9:
+        return (marker, byteStart+2, None)
+    segmentLength = struct.unpack_from(">H", data, byteStart+2)[0]
+    byteEnd = byteStart + 2 + segmentLength
+    if byteEnd > len(data):
+        raise Exception("truncated jpeg segment")
+    segmentContents = data[byteStart+4:byteEnd]
+    return (marker, byteEnd, segmentContents)
+
+
+def parse_sof(data):
+    precision, height, width, components = struct.unpack(">BHHB", data[0:6])
+    if precision != 8:
+        raise Exception("only 8 bit jpeg images are supported, got %d"
+                        % precision)
+    if height == 0:
+        raise Exception("jpeg images with a DNL marker are not supported")
+    if components == 1:
+        colorspace = "L"
+    elif components == 3:
+        colorspace = "RGB"
+    elif components == 4:
+        colorspace = "CMYK"
+    else:
+        raise Exception("cannot handle jpeg images with %d components"
+                        % components)
+    return width, height, colorspace
+
+
+def parse_jfif(data):
+    unit, hdensity, vdensity = struct.unpack(">BHH", data[7:12])
+    if unit == 1:
+        return hdensity, vdensity
+    elif unit == 2:
+        # dots per cm
+        return hdensity*2.54, vdensity*2.54
+    return None, None
+
+
+def parse_exif(data):
+    # like PIL, default to 72 dpi if there is exif data without a resolution
+    dpi = 72
+    try:
+        if data[0:2] == b'II':
+            byteOrder = "<"
+        elif data[0:2] == b'MM':
+            byteOrder = ">"
+        else:
+            return dpi, dpi
+        ifdOffset = struct.unpack_from(byteOrder+"I", data, 4)[0]
+        noEntries = struct.unpack_from(byteOrder+"H", data, ifdOffset)[0]
+        unit, resolution = None, None
+        for i in range(noEntries):
+            tag, fieldType, count = struct.unpack_from(
+                byteOrder+"HHI", data, ifdOffset+2+i*12)
+            valueOffset = ifdOffset+2+i*12+8
+            if tag == 0x0128:
+                unit = struct.unpack_from(byteOrder+"H", data, valueOffset)[0]
+            elif tag == 0x011a and fieldType == 5:
+                offset = struct.unpack_from(byteOrder+"I", data,
+                                            valueOffset)[0]
+                num, den = struct.unpack_from(byteOrder+"II", data, offset)
+                resolution = float(num) / den
+        if unit is not None and resolution is not None:
+            dpi = resolution
+            if unit == 3:
+                # dots per cm
+                dpi *= 2.54
+    except (struct.error, ZeroDivisionError):
+        pass
+    return dpi, dpi
+
+
+def parsejpeg(data):
+    """Return the size, colorspace, dpi and Adobe marker of a JPEG image
+
+    Only the markers in front of the first scan are read. An exception is
+    raised for coding processes that PDF readers need not support.
+    """
+    if data[0:2] != b'\xff\xd8':
+        raise Exception("no jpeg start of image marker")
+    noBytes = len(data)
+    byteStart = 2
+    width, height, colorspace = None, None, None
+    jfifdpi, exifdpi = (None, None), None
+    adobe = False
+    while byteStart < noBytes:
+        marker, byteEnd, segmentContents = getSegment(data, byteStart)
+        if marker in SOF_SUPPORTED:
+            width, height, colorspace = parse_sof(segmentContents)
+        elif marker in SOF_UNSUPPORTED:
+            raise Exception("unsupported jpeg coding process (SOF%d)"
+                            % (marker - 0xc0))
+        elif marker == 0xe0 and segmentContents[0:5] == b'JFIF\x00':
+            jfifdpi = parse_jfif(segmentContents)
+        elif marker == 0xe1 and segmentContents[0:6] == b'Exif\x00\x00' \
+                and exifdpi is None:
+            exifdpi = parse_exif(segmentContents[6:])
+        elif marker == 0xee and segmentContents[0:5] == b'Adobe':
+            adobe = True
+        elif marker in [0xda, 0xd9]:
+            # start of scan or end of image
+            break
+        byteStart = byteEnd
+    if not width:
+        raise Exception("no start of frame in jpeg header")
+    hdpi, vdpi = jfifdpi
+    if hdpi is None and exifdpi is not None:
+        hdpi, vdpi = exifdpi
+    # retrieving the dpi is optional so we do not error out if not present
+    return (width, height, colorspace, hdpi, vdpi, adobe)
+
+
+if __name__ == "__main__":
+    import sys
+    with open(sys.argv[1], "rb") as f:
+        width, height, colorspace = parsejpeg(f.read())[:3]
+    sys.stdout.write("width = %d\n" % width)
+    sys.stdout.write("height = %d\n" % height)
+    sys.stdout.write("colorspace = %s\n" % colorspace)
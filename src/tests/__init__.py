@@ -1,6 +1,8 @@
 import unittest
 
 import img2pdf
+import jp2
+import jpeg
 import os
 import struct
 import sys
@@ -407,7 +409,8 @@ layout_test_cases = [
 ]
 
 
-def tiff_header_for_ccitt(width, height, img_size, ccitt_group=4):
+def tiff_header_for_ccitt(width, height, img_size, ccitt_group=4,
+                          photometric=1):
     # Quick and dirty TIFF header builder from
     # https://stackoverflow.com/questions/2641770
     tiff_header_struct = '<' + '2s' + 'h' + 'l' + 'h' + 'hhll' * 8 + 'h'
@@ -421,7 +424,7 @@ def tiff_header_for_ccitt(width, height, img_size, ccitt_group=4):
         257, 4, 1, height,  # ImageLength, LONG, 1, lenght
         258, 3, 1, 1,  # BitsPerSample, SHORT, 1, 1
         259, 3, 1, ccitt_group,  # Compression, SHORT, 1, 4 = CCITT Group 4
-        262, 3, 1, 1,  # Threshholding, SHORT, 1, 0 = WhiteIsZero
+        262, 3, 1, photometric,  # Photometric, SHORT, 1, 0 = WhiteIsZero
         273, 4, 1, struct.calcsize(
             tiff_header_struct),  # StripOffsets, LONG, 1, len of header
         278, 4, 1, height,  # RowsPerStrip, LONG, 1, lenght
@@ -430,9 +433,1093 @@ def tiff_header_for_ccitt(width, height, img_size, ccitt_group=4):
         )
 
 
+def tiff_for_strip(width, height, bits, compression, photometric, predictor,
+                   data):
+    # wrap image data passed through from a TIFF strip into a minimal TIFF
+    # with a single strip so that PIL can decode it
+    numtags = 10
+    # a single BitsPerSample value is stored in the tag itself
+    bitsoffset = 8 + 2 + numtags * 12 + 4
+    if len(bits) == 1:
+        bitsvalue, bits = bits[0], ()
+    else:
+        bitsvalue = bitsoffset
+    dataoffset = bitsoffset + 2 * len(bits)
+    return struct.pack(
+        '<2shlh' + 'hhll' * numtags + 'l' + 'h' * len(bits),
+        b'II', 42, 8, numtags,
+        256, 4, 1, width,  # ImageWidth
+        257, 4, 1, height,  # ImageLength
+        258, 3, max(len(bits), 1), bitsvalue,  # BitsPerSample
+        259, 3, 1, compression,  # Compression
+        262, 3, 1, photometric,  # PhotometricInterpretation
+        273, 4, 1, dataoffset,  # StripOffsets
+        277, 3, 1, max(len(bits), 1),  # SamplesPerPixel
+        278, 4, 1, height,  # RowsPerStrip
+        279, 4, 1, len(data),  # StripByteCounts
+        317, 3, 1, predictor,  # Predictor
+        *((0,) + bits)) + data
+
+
+def png_for_idat(width, height, depth, colortype, idat):
+    # wrap the image data of a PNG passed through to the PDF into a minimal
+    # PNG so that PIL can decode it
+    def chunk(chunktype, data):
+        return struct.pack(">I", len(data)) + chunktype + data + \
+            struct.pack(">I", zlib.crc32(chunktype + data) & 0xffffffff)
+    ihdr = struct.pack(">IIBBBBB", width, height, depth, colortype, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + \
+        chunk(b"IDAT", idat) + chunk(b"IEND", b"")
+
+
+class Unbuffered(object):
+    # slicing works but making a memoryview does not, like with a memory map
+    # in Python 2
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+
 def test_suite():
     class TestImg2Pdf(unittest.TestCase):
-        pass
+        def test_streaming_writer(self):
+            inputs = sorted(os.path.join(HERE, "input", f)
+                            for f in os.listdir(os.path.join(HERE, "input")))
+            expected = img2pdf.convert(inputs, nodate=True, with_pdfrw=False)
+            for first in [img2pdf.ImageFormat.JPEG2000,
+                          img2pdf.ImageFormat.JPEG]:
+                outputstream = BytesIO()
+                pdf = img2pdf.pdfdoc(nodate=True, with_pdfrw=False,
+                                     outputstream=outputstream)
+                # the header is written with the first page
+                self.assertEqual(outputstream.getvalue(), b"")
+                for page, imgformat in enumerate(
+                        [first, img2pdf.ImageFormat.JPEG2000]):
+                    pdf.add_imagepage(img2pdf.Colorspace.RGB, 1, 1, imgformat,
+                                      b"imgdata%d" % page, 72, 72, 0, 0, 72,
+                                      72)
+                    # the image data is written as soon as the page is added
+                    self.assertEqual(
+                        outputstream.getvalue().count(b"imgdata"), page + 1)
+                pdf.tostream(outputstream)
+                output = outputstream.getvalue()
+                if first == img2pdf.ImageFormat.JPEG2000:
+                    self.assertEqual(output[:9], b"%PDF-1.5\n")
+                    self.assertNotIn(b"/Version", output)
+                else:
+                    # the version of the header is overridden by the catalog
+                    self.assertEqual(output[:9], b"%PDF-1.3\n")
+                    self.assertIn(b"/Version /1.5", output)
+
+            from pdfrw import PdfReader, PdfWriter
+            from pdfrw.py23_diffs import convert_load
+            # only streaming changes the output
+            outputstream = BytesIO()
+            self.assertIsNone(img2pdf.convert(
+                inputs, nodate=True, with_pdfrw=False,
+                outputstream=outputstream))
+            self.assertEqual(outputstream.getvalue(), expected)
+            outputstream = BytesIO()
+            self.assertIsNone(img2pdf.convert(
+                inputs, nodate=True, with_pdfrw=False,
+                outputstream=outputstream, streaming=True))
+            self.assertNotEqual(outputstream.getvalue(), expected)
+            # both PDFs contain the same objects albeit in different order
+            outx = BytesIO()
+            outy = BytesIO()
+            xwriter = PdfWriter()
+            ywriter = PdfWriter()
+            xwriter.trailer = PdfReader(PdfReaderIO(convert_load(
+                outputstream.getvalue())))
+            ywriter.trailer = PdfReader(PdfReaderIO(convert_load(expected)))
+            xwriter.write(outx)
+            ywriter.write(outy)
+            self.assertEqual(outx.getvalue(), outy.getvalue())
+            # without streaming, nothing is written if the conversion fails
+            outputstream = BytesIO()
+            self.assertRaises(img2pdf.ImageOpenError, img2pdf.convert,
+                              inputs[0], b"garbage", with_pdfrw=False,
+                              outputstream=outputstream)
+            self.assertEqual(outputstream.getvalue(), b"")
+
+        def test_jpeg2000_version(self):
+            imgio = BytesIO()
+            Image.new("RGB", (16, 16)).save(imgio, format="JPEG2000")
+            jp2data = imgio.getvalue()
+            expected = img2pdf.convert(jp2data, nodate=True,
+                                       with_pdfrw=False)
+            self.assertEqual(expected[:9], b"%PDF-1.5\n")
+            self.assertNotIn(b"/Version", expected)
+            for streaming in [False, True]:
+                outputstream = BytesIO()
+                img2pdf.convert(jp2data, nodate=True, with_pdfrw=False,
+                                outputstream=outputstream,
+                                streaming=streaming)
+                output = outputstream.getvalue()
+                self.assertEqual(output[:9], b"%PDF-1.5\n")
+                self.assertNotIn(b"/Version", output)
+                if not streaming:
+                    self.assertEqual(output, expected)
+
+        def test_mmap_input(self):
+            jpeg = os.path.join(HERE, "input", "normal.jpg")
+            with open(jpeg, "rb") as f:
+                jpegdata = f.read()
+            frames = img2pdf.read_images(img2pdf.read_rawdata(jpeg), None)
+            # with Python 2, the content of the file is passed on instead of
+            # a memoryview
+            self.assertIsInstance(frames[0][3], (memoryview, bytes))
+            self.assertEqual(frames[0][3], jpegdata)
+            self.assertEqual(img2pdf.get_mmap_view(Unbuffered(jpegdata)),
+                             jpegdata)
+            inputs = sorted(os.path.join(HERE, "input", f)
+                            for f in os.listdir(os.path.join(HERE, "input")))
+            rawdata = [img2pdf.read_rawdata(f).read() for f in inputs]
+            for with_pdfrw in [True, False]:
+                expected = BytesIO()
+                img2pdf.convert(rawdata, nodate=True, with_pdfrw=with_pdfrw,
+                                outputstream=expected)
+                outputstream = BytesIO()
+                img2pdf.convert(inputs, nodate=True, with_pdfrw=with_pdfrw,
+                                outputstream=outputstream)
+                self.assertEqual(outputstream.getvalue(), expected.getvalue())
+
+        def test_image_dedup(self):
+            from pdfrw import PdfReader
+            from pdfrw.py23_diffs import convert_load
+            jpeg = os.path.join(HERE, "input", "normal.jpg")
+            png = os.path.join(HERE, "input", "rgb.png")
+            for with_pdfrw in [True, False]:
+                output = img2pdf.convert([jpeg, png, jpeg, jpeg, png],
+                                         nodate=True, with_pdfrw=with_pdfrw)
+                x = PdfReader(PdfReaderIO(convert_load(output)))
+                images = [page.Resources.XObject.Im0
+                          for page in x.Root.Pages.Kids]
+                self.assertEqual(len(images), 5)
+                self.assertIs(images[0], images[2])
+                self.assertIs(images[0], images[3])
+                self.assertIs(images[1], images[4])
+                self.assertIsNot(images[0], images[1])
+                # info, catalog, pages, five pages with their content streams
+                # and two images
+                self.assertEqual(x.Size, '16')
+
+        def test_compression(self):
+            tiff = os.path.join(HERE, "input", "CMYK.tif")
+            with open(tiff, "rb") as f:
+                rawdata = f.read()
+            pixels = Image.open(BytesIO(rawdata)).tobytes()
+            sizes = []
+            for spec in ["0", "level=9", "strategy=rle,level=1",
+                         "strategy=huffman", "strategy=filtered,memlevel=9",
+                         "wbits=9"]:
+                compression = img2pdf.parse_compressionarg(spec)
+                imgdata = img2pdf.read_images(
+                    rawdata, None, compression=compression)[0][3]
+                self.assertEqual(zlib.decompress(imgdata), pixels)
+                sizes.append(len(imgdata))
+            # level 0 only stores the data
+            self.assertGreater(sizes[0], len(pixels))
+            self.assertLess(sizes[1], sizes[0])
+            self.assertEqual(img2pdf.parse_compressionarg("strategy=RLE"),
+                             {"strategy": img2pdf.FlateStrategy.rle})
+            import argparse
+            for spec in ["level=10", "wbits=16", "strategy=best", "foo=1",
+                         "level=x"]:
+                self.assertRaises(argparse.ArgumentTypeError,
+                                  img2pdf.parse_compressionarg, spec)
+            self.assertRaises(ValueError, img2pdf.convert, tiff,
+                              compression={"wbits": -15})
+
+        def test_image_bands(self):
+            for f in sorted(os.listdir(os.path.join(HERE, "input"))):
+                orig_img = Image.open(os.path.join(HERE, "input", f))
+                for mode in [None, "L", "RGB"]:
+                    if mode is None:
+                        expected = orig_img.tobytes()
+                    else:
+                        expected = orig_img.convert(mode).tobytes()
+                    # small bands of a few rows and a band for every row
+                    for band_size in [1000, 1]:
+                        bands = list(img2pdf.iter_image_bands(
+                            orig_img, mode, band_size))
+                        self.assertGreater(len(bands), 1)
+                        self.assertEqual(b"".join(bands), expected)
+
+        def test_ccitt_passthrough(self):
+            for f in ["mono.tif", "mono-inverted.tif"]:
+                with open(os.path.join(HERE, "input", f), "rb") as inf:
+                    rawdata = inf.read()
+                frames = img2pdf.read_images(rawdata, None)
+                self.assertEqual(len(frames), 1)
+                imgformat, imgdata = frames[0][2:4]
+                self.assertEqual(imgformat, img2pdf.ImageFormat.CCITTGroup4)
+                # the strip is copied verbatim
+                self.assertIn(imgdata, rawdata)
+                self.assertEqual(frames[0][8], f == "mono-inverted.tif")
+
+        def test_ccitt_multiple_strips(self):
+            from PIL import TiffImagePlugin
+            orig_img = Image.open(os.path.join(HERE, "input", "mono.png"))
+            orig_img = orig_img.resize((orig_img.size[0] * 16,
+                                        orig_img.size[1] * 16))
+            for compression in ["group4", "group3"]:
+                imgio = BytesIO()
+                orig_img.save(imgio, format="TIFF", compression=compression,
+                              tiffinfo={TiffImagePlugin.ROWSPERSTRIP: 16})
+                frames = img2pdf.read_images(imgio.getvalue(), None)
+                imgformat, imgdata, width, height, depth = frames[0][2:7]
+                self.assertEqual(imgformat,
+                                 img2pdf.ImageFormat.CCITTGroup4)
+                self.assertEqual(depth, 1)
+                # the data decodes to the original image
+                imgio = BytesIO()
+                imgio.write(tiff_header_for_ccitt(width, height,
+                                                  len(imgdata), 4))
+                imgio.write(imgdata)
+                imgio.seek(0)
+                self.assertEqual(Image.open(imgio).tobytes(),
+                                 orig_img.tobytes())
+
+        def test_tiff_jpeg_passthrough(self):
+            from PIL import TiffImagePlugin
+            orig_img = Image.open(os.path.join(HERE, "input", "normal.png"))
+            orig_img = orig_img.convert("RGB")
+            for mode, rowsperstrip in [("RGB", None), ("RGB", 8),
+                                       ("L", 24)]:
+                img = orig_img.convert(mode)
+                tiffinfo = {}
+                if rowsperstrip is not None:
+                    tiffinfo[TiffImagePlugin.ROWSPERSTRIP] = rowsperstrip
+                imgio = BytesIO()
+                img.save(imgio, format="TIFF", compression="jpeg",
+                         tiffinfo=tiffinfo)
+                imgio.seek(0)
+                expected = Image.open(imgio).tobytes()
+                frames = img2pdf.read_images(imgio.getvalue(), None)
+                self.assertEqual(len(frames), 1)
+                imgformat, imgdata = frames[0][2:4]
+                self.assertEqual(imgformat, img2pdf.ImageFormat.JPEG)
+                im = Image.open(BytesIO(imgdata))
+                self.assertEqual(im.size, img.size)
+                self.assertEqual(im.convert(mode).tobytes(), expected)
+                if mode == "RGB":
+                    self.assertEqual(frames[0][7], {"ColorTransform": 0})
+                # a different colorspace needs decoding
+                colorspace = img2pdf.Colorspace["L" if mode == "RGB"
+                                                else "RGB"]
+                frames = img2pdf.read_images(imgio.getvalue(), colorspace)
+                self.assertEqual(frames[0][2], img2pdf.ImageFormat.other)
+
+        def test_tiff_strip_passthrough(self):
+            from PIL import TiffImagePlugin
+            orig_img = Image.open(os.path.join(HERE, "input", "normal.png"))
+            tiffcompression = {img2pdf.ImageFormat.LZW: 5,
+                               img2pdf.ImageFormat.PackBits: 32773,
+                               img2pdf.ImageFormat.other: 8}
+            for compression, imgformat, predictor, rowsperstrip in [
+                    ("tiff_lzw", img2pdf.ImageFormat.LZW, 1, None),
+                    ("tiff_lzw", img2pdf.ImageFormat.LZW, 2, None),
+                    ("tiff_adobe_deflate", img2pdf.ImageFormat.other, 1,
+                     None),
+                    ("tiff_adobe_deflate", img2pdf.ImageFormat.other, 2,
+                     None),
+                    ("packbits", img2pdf.ImageFormat.PackBits, 1, None),
+                    ("packbits", img2pdf.ImageFormat.PackBits, 1, 10)]:
+                for mode, photometric in [("L", 1), ("RGB", 2),
+                                          ("CMYK", 5)]:
+                    img = orig_img.convert(mode)
+                    tiffinfo = {TiffImagePlugin.PREDICTOR: predictor}
+                    if rowsperstrip is not None:
+                        tiffinfo[TiffImagePlugin.ROWSPERSTRIP] = rowsperstrip
+                    imgio = BytesIO()
+                    img.save(imgio, format="TIFF", compression=compression,
+                             tiffinfo=tiffinfo)
+                    frames = img2pdf.read_images(imgio.getvalue(), None)
+                    self.assertEqual(len(frames), 1)
+                    self.assertEqual(frames[0][2], imgformat)
+                    imgdata, width, height, depth, decodeparms = \
+                        frames[0][3:8]
+                    self.assertEqual(depth, 8)
+                    if predictor == 2:
+                        self.assertEqual(decodeparms,
+                                         {"Predictor": 2,
+                                          "Colors": len(mode),
+                                          "BitsPerComponent": 8,
+                                          "Columns": width})
+                    else:
+                        self.assertIsNone(decodeparms)
+                    if imgformat == img2pdf.ImageFormat.PackBits:
+                        # the end of data marker of RunLengthDecode
+                        self.assertEqual(imgdata[-1:], b"\x80")
+                        imgdata = imgdata[:-1]
+                    # the data decodes to the original image
+                    im = Image.open(BytesIO(tiff_for_strip(
+                        width, height, (8,) * len(mode),
+                        tiffcompression[imgformat], photometric, predictor,
+                        bytes(imgdata))))
+                    self.assertEqual(im.tobytes(), img.tobytes())
+            # no-op length bytes of PackBits end RunLengthDecode data
+            self.assertEqual(img2pdf.packbits_to_runlength(
+                [b"\x80\x00a\x80", b"\x01b\x80\xfe\x80"]),
+                b"\x00a\x01b\x80\xfe\x80\x80")
+            self.assertIsNone(img2pdf.packbits_to_runlength([b"\x02a\x80"]))
+
+        def test_jpeg_header(self):
+            from PIL import TiffImagePlugin
+            orig_img = Image.open(os.path.join(HERE, "input", "normal.png"))
+            # a resolution of 100 dots per cm
+            exif = Image.Exif()
+            exif[0x0128] = 3
+            exif[0x011a] = TiffImagePlugin.IFDRational(100, 1)
+            for mode in ["L", "RGB", "CMYK"]:
+                for options in [{}, {"dpi": (300, 150)},
+                                {"progressive": True},
+                                {"exif": exif.tobytes()}]:
+                    imgio = BytesIO()
+                    orig_img.convert(mode).save(imgio, format="JPEG",
+                                                **options)
+                    imgio.seek(0)
+                    im = Image.open(imgio)
+                    self.assertEqual(jpeg.parsejpeg(imgio.getvalue()),
+                                     im.size + (im.mode,) +
+                                     im.info.get("dpi", (None, None)) +
+                                     ("adobe" in im.info,))
+            # PDF readers need not support arithmetic coding
+            with open(os.path.join(HERE, "input", "normal.jpg"), "rb") as f:
+                rawdata = f.read()
+            self.assertIn(b"\xff\xc2\x00\x11", rawdata)
+            self.assertRaises(Exception, jpeg.parsejpeg, rawdata.replace(
+                b"\xff\xc2\x00\x11", b"\xff\xca\x00\x11"))
+            # the image is embedded without PIL opening it
+            image_open = Image.open
+
+            def fail(*args, **kwargs):
+                raise AssertionError("PIL opened a JPEG image")
+            Image.open = fail
+            try:
+                frames = img2pdf.read_images(rawdata, None)
+            finally:
+                Image.open = image_open
+            self.assertEqual(frames[0][:6],
+                             (img2pdf.Colorspace.RGB, (72, 72),
+                              img2pdf.ImageFormat.JPEG, rawdata, 115, 48))
+
+        def test_jpeg2000_header(self):
+            def box(boxtype, contents):
+                return struct.pack(">I", 8 + len(contents)) + boxtype + \
+                    contents
+            # 300 dpi are 11811 dots per metre
+            jp2h = box(b"jp2h", box(b"ihdr", struct.pack(
+                ">IIHBBBB", 48, 115, 3, 7, 7, 0, 0)) +
+                box(b"colr", struct.pack(">BBBI", 1, 0, 0, 16)) +
+                box(b"res ", box(b"resc", struct.pack(
+                    ">HHHHBB", 11811, 1, 11811, 1, 0, 0))))
+            jp2data = box(b"jP  ", b"\r\n\x87\n") + \
+                box(b"ftyp", b"jp2 \x00\x00\x00\x00jp2 ") + jp2h + \
+                box(b"jp2c", b"codestream")
+            # SIZ segment of a gray image with an image offset
+            j2kdata = b"\xff\x4f\xff\x51" + struct.pack(
+                ">HHIIIIIIIIH", 41, 0, 125, 50, 10, 2, 125, 50, 0, 0, 1) + \
+                b"\x07\x01\x01" + b"codestream"
+            for data, expected in [(jp2data, (115, 48, "RGB")),
+                                   (j2kdata, (115, 48, "L"))]:
+                self.assertEqual(jp2.parsejp2(data)[:3], expected)
+                self.assertEqual(jp2.parsejp2(BytesIO(data))[:3], expected)
+                self.assertEqual(jp2.parsejp2(Unbuffered(data))[:3],
+                                 expected)
+            hdpi, vdpi = jp2.parsejp2(jp2data)[3:]
+            self.assertEqual((round(hdpi), round(vdpi)), (300, 300))
+            # only the header is read, the codestream does not matter
+            for data, color, ndpi in [
+                    (jp2data, img2pdf.Colorspace.RGB, (300, 300)),
+                    (j2kdata, img2pdf.Colorspace.L,
+                     (img2pdf.default_dpi, img2pdf.default_dpi))]:
+                frames = img2pdf.read_images(data, None)
+                self.assertEqual(frames[0][:6],
+                                 (color, ndpi, img2pdf.ImageFormat.JPEG2000,
+                                  data, 115, 48))
+
+        def test_object_streams(self):
+            import re
+            from pdfrw import PdfReader
+            inputs = sorted(os.path.join(HERE, "input", f)
+                            for f in os.listdir(os.path.join(HERE, "input")))
+            # enough pages for more than one object stream
+            inputs = inputs * 20
+            expected = PdfReader(fdata=img2pdf.convert(
+                inputs, nodate=True, with_pdfrw=False))
+            outputstream = BytesIO()
+            img2pdf.convert(inputs, nodate=True, object_streams=True,
+                            outputstream=outputstream)
+            streamobj = re.compile(b"(\\d+) 0 obj\n<<(.*?)>>\nstream\n",
+                                   re.S)
+
+            def read_stream(output, offset):
+                # the dictionary and the decompressed data of a stream object
+                match = streamobj.match(output, offset)
+                data = output[match.end():].split(b"\nendstream\n", 1)[0]
+                return match.group(2), zlib.decompress(data)
+
+            for output in [outputstream.getvalue(),
+                           img2pdf.convert(inputs, nodate=True,
+                                           object_streams=True)]:
+                self.assertEqual(output[:9], b"%PDF-1.5\n")
+                self.assertNotIn(b"\nxref\n", output)
+                self.assertNotIn(b"/Type /Page\n", output)
+                # read all entries of the cross-reference stream
+                xrefdict, xrefdata = read_stream(
+                    output, int(output.rsplit(b"startxref\n", 1)[1][:-6]))
+                self.assertIn(b"/Type /XRef", xrefdict)
+                width = int(re.search(b"/W \\[ 1 (\\d) 2 \\]",
+                                      xrefdict).group(1))
+                entries = []
+                for i in range(0, len(xrefdata), 3 + width):
+                    entries.append((
+                        struct.unpack(">B", xrefdata[i:i + 1])[0],
+                        struct.unpack(">Q", b"\0" * (8 - width) +
+                                      xrefdata[i + 1:i + 1 + width])[0],
+                        struct.unpack(">H", xrefdata[i + 1 + width:
+                                                     i + 3 + width])[0]))
+                self.assertEqual(len(entries), int(
+                    re.search(b"/Size (\\d+)", xrefdict).group(1)))
+                self.assertEqual(entries[0], (0, 0, 65535))
+                objstms = set()
+                numcompressed = 0
+                for i, (kind, field2, field3) in enumerate(entries[1:], 1):
+                    if kind == 1:
+                        self.assertTrue(output[field2:].startswith(
+                            ("%d 0 obj\n" % i).encode()))
+                        continue
+                    self.assertEqual(kind, 2)
+                    numcompressed += 1
+                    objstms.add(field2)
+                    # the header of the object stream lists the object
+                    objstmdict, objstmdata = read_stream(
+                        output, entries[field2][1])
+                    self.assertIn(b"/Type /ObjStm", objstmdict)
+                    first = int(re.search(b"/First (\\d+)",
+                                          objstmdict).group(1))
+                    header = objstmdata[:first].split()
+                    self.assertEqual(int(header[2 * field3]), i)
+                self.assertGreater(len(objstms), 1)
+                # the pages, the catalog, the page tree and the info dict
+                self.assertEqual(numcompressed, len(expected.pages) + 3)
+                # the same document as without object streams
+                x = PdfReader(fdata=output)
+                self.assertEqual(len(x.pages), len(expected.pages))
+                for page, expectedpage in zip(x.pages, expected.pages):
+                    self.assertEqual(page.MediaBox, expectedpage.MediaBox)
+                    self.assertEqual(page.Contents.stream,
+                                     expectedpage.Contents.stream)
+                    self.assertEqual(page.Resources.XObject.Im0.stream,
+                                     expectedpage.Resources.XObject.Im0.stream)
+
+        def test_serialize(self):
+            page = img2pdf.MyPdfDict(Type=img2pdf.MyPdfName.Page)
+            page.identifier = 4
+            content = {b"/A": [1, 2.5, 3.0, [], {}], b"/B": page,
+                       b"/C": img2pdf.MyPdfDict(D={b"/E": b"/F"}),
+                       b"/G": img2pdf.MyPdfObject("true")}
+            expected = (b"<<\n"
+                        b"    /A [ 1 2.5 3 [  ] <<\n\n    >> ]\n"
+                        b"    /B 4 0 R\n"
+                        b"    /C <<\n"
+                        b"        /D <<\n"
+                        b"            /E /F\n"
+                        b"        >>\n"
+                        b"    >>\n"
+                        b"    /G true\n"
+                        b">>")
+            out = bytearray(b"prefix")
+            img2pdf.serialize(content, out)
+            self.assertEqual(bytes(out), b"prefix" + expected)
+            self.assertEqual(img2pdf.parse(content), expected)
+            self.assertRaises(TypeError, img2pdf.parse, {b"/A": [None]})
+            # nesting is not limited by the recursion limit
+            nested = []
+            for i in range(sys.getrecursionlimit() * 2):
+                nested = [nested]
+            self.assertEqual(img2pdf.parse(nested),
+                             b"[ " * (sys.getrecursionlimit() * 2) + b"[  ]" +
+                             b" ]" * (sys.getrecursionlimit() * 2))
+
+        def test_object_model(self):
+            # names are cached
+            self.assertIs(img2pdf.MyPdfName.FooBar, img2pdf.MyPdfName.FooBar)
+            self.assertEqual(img2pdf.MyPdfName.FooBar, b"/FooBar")
+            # no per instance dictionary
+            obj = img2pdf.MyPdfDict(Type=img2pdf.MyPdfName.XObject)
+            self.assertFalse(hasattr(obj, "__dict__"))
+            self.assertFalse(hasattr(obj, "identifier"))
+            page = img2pdf.MyPdfPage(indirect=True)
+            self.assertFalse(hasattr(page, "__dict__"))
+            # a page serializes like the equivalent dictionary
+            content = img2pdf.MyPdfDict(stream=b"q Q")
+            content.identifier = 5
+            page[img2pdf.MyPdfName.Type] = img2pdf.MyPdfName.Page
+            page[img2pdf.MyPdfName.MediaBox] = [0, 0, 10.5, 20]
+            page[img2pdf.MyPdfName.Contents] = content
+            page[img2pdf.MyPdfName.Rotate] = 90
+            page.identifier = 4
+            expected = img2pdf.MyPdfDict(
+                Type=img2pdf.MyPdfName.Page, MediaBox=[0, 0, 10.5, 20],
+                Contents=content, Rotate=90)
+            expected.identifier = 4
+            self.assertEqual(page.tostring(), expected.tostring())
+            self.assertEqual(page[img2pdf.MyPdfName.MediaBox][2], 10.5)
+            self.assertEqual(img2pdf.parse([page]), b"[ 4 0 R ]")
+
+        def test_workers(self):
+            from concurrent.futures import ThreadPoolExecutor
+            inputs = sorted(os.path.join(HERE, "input", f)
+                            for f in os.listdir(os.path.join(HERE, "input")))
+            # mix file names, file objects and binary strings
+            with open(inputs[0], "rb") as f:
+                inputs[0] = f.read()
+            expected = img2pdf.convert(inputs, nodate=True, with_pdfrw=False)
+            with open(inputs[1], "rb") as f:
+                inputs[1] = f
+                output = img2pdf.convert(inputs, nodate=True,
+                                         with_pdfrw=False, workers=2)
+            self.assertEqual(output, expected)
+            inputs[1] = inputs[2]
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                output = img2pdf.convert(inputs, nodate=True,
+                                         with_pdfrw=False, workers=1,
+                                         executor=executor)
+            self.assertNotEqual(output, expected)
+            self.assertEqual(output, img2pdf.convert(
+                inputs, nodate=True, with_pdfrw=False))
+            # errors in the workers reach the caller
+            self.assertRaises(img2pdf.ImageOpenError, img2pdf.convert,
+                              inputs + [b"garbage"], with_pdfrw=False,
+                              workers=2)
+            # the number of inputs in flight follows the given executor
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                self.assertEqual(img2pdf.get_worker_pool(None, executor),
+                                 (executor, 3, False))
+                self.assertEqual(img2pdf.get_worker_pool(1, executor),
+                                 (executor, 1, False))
+            executor, workers, own = img2pdf.get_worker_pool(0)
+            executor.shutdown()
+            self.assertEqual((workers, own), (img2pdf.get_cpu_count(), True))
+
+        def test_tracer(self):
+            from concurrent.futures import ThreadPoolExecutor
+            inputs = [os.path.join(HERE, "input", f) for f in
+                      ["normal.jpg", "animation.gif", "mono.tif", "rgb.png",
+                       "CMYK.tif"]]
+            spans = []
+
+            def tracer(stage, start, end, attributes):
+                self.assertLessEqual(start, end)
+                spans.append((stage, attributes))
+            expected = img2pdf.convert(inputs, nodate=True, with_pdfrw=False)
+            output = img2pdf.convert(inputs, nodate=True, with_pdfrw=False,
+                                     tracer=tracer)
+            self.assertEqual(output, expected)
+            stages = set(stage for stage, attributes in spans)
+            self.assertEqual(stages, set(["read", "open", "metadata",
+                                          "passthrough", "compress", "layout",
+                                          "page", "write"]))
+            pages = [attributes for stage, attributes in spans
+                     if stage == "page"]
+            self.assertEqual([a["page"] for a in pages],
+                             list(range(len(pages))))
+            self.assertEqual([a["input"] for a in pages][:3], [0, 1, 1])
+            self.assertEqual(pages[0]["format"], "JPEG")
+            self.assertEqual(spans[-1][0], "write")
+            self.assertEqual(spans[-1][1]["bytes_out"], len(output))
+            self.assertEqual([(s, a["input"]) for s, a in spans[:3]],
+                             [("read", 0), ("metadata", 0), ("layout", 0)])
+            # spans of workers are replayed in input order
+            workerspans = []
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                img2pdf.convert(inputs, nodate=True, with_pdfrw=False,
+                                executor=executor,
+                                tracer=lambda *span:
+                                workerspans.append((span[0], span[3])))
+            self.assertEqual(workerspans, spans)
+
+        def test_lazy_inputs(self):
+            inputs = [os.path.join(HERE, "input", f) for f in
+                      ["normal.jpg", "animation.gif", "mono.tif", "rgb.png"]]
+            expected = img2pdf.convert(inputs, nodate=True)
+            self.assertEqual(img2pdf.convert(tuple(inputs), nodate=True),
+                             expected)
+            self.assertEqual(img2pdf.convert(*inputs, nodate=True), expected)
+            pulled = []
+
+            def generate():
+                for i, path in enumerate(inputs):
+                    pulled.append(i)
+                    # binary strings and file objects are single inputs
+                    with open(path, "rb") as f:
+                        yield f.read() if i % 2 else f
+            checked = []
+
+            def tracer(stage, start, end, attributes):
+                # an input is only taken once the previous one is done
+                if stage == "page":
+                    self.assertEqual(len(pulled), attributes["input"] + 1)
+                    checked.append(attributes["input"])
+            self.assertEqual(img2pdf.convert(generate(), nodate=True,
+                                             tracer=tracer), expected)
+            self.assertEqual(sorted(set(checked)), [0, 1, 2, 3])
+            with open(inputs[0], "rb") as f:
+                self.assertEqual(img2pdf.convert(f, nodate=True),
+                                 img2pdf.convert(inputs[0], nodate=True))
+            with open(inputs[0], "rb") as f:
+                self.assertEqual(img2pdf.convert(bytearray(f.read()),
+                                                 nodate=True),
+                                 img2pdf.convert(inputs[0], nodate=True))
+            self.assertEqual(img2pdf.convert(iter(inputs), nodate=True,
+                                             with_pdfrw=False, workers=1),
+                             img2pdf.convert(inputs, nodate=True,
+                                             with_pdfrw=False))
+
+        def test_convert_iter(self):
+            inputs = [os.path.join(HERE, "input", f) for f in
+                      ["normal.jpg", "animation.gif", "mono.tif", "rgb.png"]]
+            expected = BytesIO()
+            img2pdf.convert(inputs, nodate=True, with_pdfrw=False,
+                            outputstream=expected, streaming=True)
+            spans = []
+            chunks = img2pdf.convert_iter(
+                inputs, nodate=True, chunk_size=1000,
+                tracer=lambda stage, start, end, a: spans.append(a))
+            # the first chunk is there before the second input is read
+            first = next(chunks)
+            self.assertTrue(first.startswith(b"%PDF-1.3"))
+            self.assertEqual(set(a.get("input") for a in spans), set([0]))
+            chunks = [first] + list(chunks)
+            self.assertEqual(b"".join(chunks), expected.getvalue())
+            self.assertTrue(all(0 < len(c) <= 1000 for c in chunks))
+            self.assertEqual(b"".join(img2pdf.convert_iter(
+                inputs, nodate=True, with_pdfrw=True)),
+                img2pdf.convert(inputs, nodate=True))
+            self.assertRaises(TypeError, list, img2pdf.convert_iter(
+                inputs, outputstream=BytesIO()))
+
+        def test_probe(self):
+            import json
+            import subprocess
+            inputs = [os.path.join(HERE, "input", f) for f in
+                      sorted(os.listdir(os.path.join(HERE, "input")))]
+            infos = img2pdf.probe(inputs)
+            self.assertEqual(img2pdf.probe(*inputs, workers=2), infos)
+            # probe() plans what read_images() does
+            for path, info in zip(inputs, infos):
+                frames = img2pdf.read_input_images(path, None)
+                self.assertEqual(info["bytes"], os.path.getsize(path))
+                self.assertEqual(len(info["frames"]), len(frames))
+                for probed, (color, ndpi, imgformat, imgdata, imgwidthpx,
+                             imgheightpx, depth, decodeparms, inverted,
+                             layoutsize) in zip(info["frames"], frames):
+                    self.assertEqual(probed["width"], imgwidthpx)
+                    self.assertEqual(probed["height"], imgheightpx)
+                    self.assertEqual(tuple(probed["dpi"]), tuple(ndpi))
+                    if imgformat == img2pdf.ImageFormat.other:
+                        self.assertEqual(probed["codec"], "flate")
+                        self.assertFalse(probed["passthrough"])
+                    else:
+                        self.assertEqual(probed["codec"], imgformat.name)
+                    if probed["convert"] is not None:
+                        self.assertEqual(probed["convert"], color.name)
+            gif = [i for p, i in zip(inputs, infos)
+                   if p.endswith("animation.gif")][0]
+            self.assertTrue(len(gif["frames"]) > 1)
+            self.assertEqual(len(img2pdf.probe(
+                inputs, first_frame_only=True)[0]["frames"]), 1)
+            info, = img2pdf.probe(b"not an image")
+            self.assertEqual(list(info), ["error"])
+            self.assertRaises(TypeError, img2pdf.probe, inputs, foo=1)
+
+            script = os.path.abspath(img2pdf.__file__)
+            proc = subprocess.Popen(
+                [sys.executable, script, "--probe"] + inputs,
+                stdout=subprocess.PIPE)
+            report = json.loads(proc.communicate()[0].decode("utf8"))
+            self.assertEqual(proc.returncode, 0)
+            self.assertEqual([i.pop("input") for i in report["inputs"]],
+                             inputs)
+            self.assertEqual(report["inputs"], infos)
+            self.assertEqual(report["pages"],
+                             sum(len(i["frames"]) for i in infos))
+            # the initial page is checked against the number of pages and
+            # not the number of input images
+            gifpath = os.path.join(HERE, "input", "animation.gif")
+            pages = len(gif["frames"])
+            for page, status in [(pages, 0), (pages + 1, 2)]:
+                proc = subprocess.Popen(
+                    [sys.executable, script, "--viewer-initial-page",
+                     str(page), gifpath], stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE)
+                proc.communicate()
+                self.assertEqual(proc.returncode, status)
+
+        def test_probe_passthrough(self):
+            from PIL import TiffImagePlugin
+            orig_img = Image.open(os.path.join(HERE, "input", "normal.png"))
+            inputs = []
+            for mode, fmt, params in [
+                    ("RGB", "PNG", {}),
+                    ("1", "TIFF", {"compression": "group4"}),
+                    ("RGB", "TIFF", {"compression": "jpeg", "tiffinfo": {
+                        TiffImagePlugin.ROWSPERSTRIP: 8}}),
+                    ("L", "TIFF", {"compression": "tiff_lzw"}),
+                    ("CMYK", "TIFF", {"compression": "packbits",
+                                      "tiffinfo": {
+                                          TiffImagePlugin.ROWSPERSTRIP: 10}})]:
+                imgio = BytesIO()
+                orig_img.convert(mode).save(imgio, format=fmt, **params)
+                inputs.append(imgio.getvalue())
+            # probing only reads headers and tags and never puts together
+            # the image data
+            builders = ["get_png_passthrough", "get_ccitt_passthrough",
+                        "get_tiff_jpeg_passthrough",
+                        "get_tiff_strip_passthrough", "get_tiff_strips",
+                        "join_jpeg_strips", "packbits_to_runlength"]
+            saved = dict((name, getattr(img2pdf, name)) for name in builders)
+
+            def fail(*args):
+                raise AssertionError("image data was read")
+            try:
+                for name in builders:
+                    setattr(img2pdf, name, fail)
+                infos = img2pdf.probe(inputs)
+            finally:
+                for name, func in saved.items():
+                    setattr(img2pdf, name, func)
+            for rawdata, info in zip(inputs, infos):
+                frames = img2pdf.read_images(rawdata, None)
+                self.assertTrue(info["frames"][0]["passthrough"])
+                self.assertEqual(info["frames"][0]["codec"],
+                                 frames[0][2].name)
+
+        def test_max_dpi(self):
+            import re
+            im = Image.linear_gradient("L").resize((400, 300))
+            inputs = []
+            formats = [("RGB", "JPEG", {}), ("CMYK", "JPEG", {}),
+                       ("RGB", "PNG", {}),
+                       ("1", "TIFF", {"compression": "group4"})]
+            for mode, fmt, kwargs in formats:
+                imgio = BytesIO()
+                im.convert(mode).save(imgio, fmt, dpi=(600, 400), **kwargs)
+                inputs.append(imgio.getvalue())
+            for data, codec in zip(inputs, ["JPEG", "JPEG", "flate",
+                                            "flate"]):
+                expected = img2pdf.convert(data, nodate=True,
+                                           with_pdfrw=False)
+                spans = []
+                output = img2pdf.convert(
+                    data, nodate=True, with_pdfrw=False, max_dpi=200,
+                    tracer=lambda stage, start, end, a: spans.append(stage))
+                self.assertIn("downsample", spans)
+                self.assertLess(len(output), len(expected))
+                # the page keeps its size
+                self.assertEqual(re.findall(b"/MediaBox[^]]*]", output),
+                                 re.findall(b"/MediaBox[^]]*]", expected))
+                frame, = img2pdf.read_images(data, None, max_dpi=200)
+                self.assertEqual(frame[4:6], (133, 150))
+                self.assertEqual(frame[9], (400, 300))
+                self.assertEqual(frame[1], (600, 400))
+                info, = img2pdf.probe(data, max_dpi=200)
+                self.assertEqual(info["frames"][0]["downsample"], [133, 150])
+                self.assertEqual(info["frames"][0]["codec"], codec)
+                # frames with at most max_dpi are not touched
+                self.assertEqual(img2pdf.convert(data, nodate=True,
+                                                 with_pdfrw=False,
+                                                 max_dpi=600), expected)
+            # JPEG images stay JPEG images and bilevel ones become grayscale
+            frame, = img2pdf.read_images(inputs[0], None, max_dpi=200)
+            self.assertEqual(frame[2], img2pdf.ImageFormat.JPEG)
+            self.assertEqual(Image.open(BytesIO(frame[3])).size, (133, 150))
+            frame, = img2pdf.read_images(inputs[1], None, max_dpi=200)
+            self.assertEqual(frame[0], img2pdf.Colorspace["CMYK;I"])
+            frame, = img2pdf.read_images(inputs[3], None, max_dpi=200)
+            self.assertEqual(frame[0], img2pdf.Colorspace.L)
+            self.assertEqual(frame[2], img2pdf.ImageFormat.other)
+            self.assertRaises(ValueError, img2pdf.convert, inputs[0],
+                              max_dpi=0)
+
+        def test_convert_async(self):
+            if sys.version_info < (3, 5):
+                return
+            import asyncio
+            import threading
+            import img2pdf_async
+            loop = asyncio.new_event_loop()
+            self.addCleanup(loop.close)
+
+            def resolved(result=None, exception=None):
+                future = asyncio.Future(loop=loop)
+                if exception is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exception)
+                return future
+
+            class Chunks(object):
+                # an asynchronous byte source
+                def __init__(self, data, hang=False):
+                    self.chunks = [data[:100], data[100:]]
+                    self.hang = hang
+
+                def __aiter__(self):
+                    return self
+
+                def __anext__(self):
+                    if self.hang:
+                        return asyncio.Future(loop=loop)
+                    if self.chunks:
+                        return resolved(self.chunks.pop(0))
+                    return resolved(exception=StopAsyncIteration())
+
+            class Sink(object):
+                # like asyncio.StreamWriter
+                def __init__(self):
+                    self.data = BytesIO()
+                    self.drained = 0
+
+                def write(self, data):
+                    self.data.write(data)
+
+                def drain(self):
+                    self.drained += 1
+                    return resolved()
+
+            inputs = [os.path.join(HERE, "input", f) for f in
+                      ["normal.jpg", "animation.gif", "mono.tif", "rgb.png"]]
+            with open(inputs[3], "rb") as f:
+                inputs[3] = Chunks(f.read())
+            expected = BytesIO()
+            img2pdf.convert(inputs[:3] + [os.path.join(HERE, "input",
+                                                       "rgb.png")],
+                            nodate=True, with_pdfrw=False,
+                            outputstream=expected, streaming=True)
+            sink = Sink()
+            self.assertIsNone(loop.run_until_complete(
+                img2pdf_async.convert_async(inputs, nodate=True,
+                                            with_pdfrw=False,
+                                            outputstream=sink)))
+            self.assertEqual(sink.data.getvalue(), expected.getvalue())
+            self.assertGreater(sink.drained, 2)
+
+            class Reader(object):
+                # like asyncio.StreamReader before Python 3.7, whose read()
+                # is a generator based coroutine
+                def __init__(self, data):
+                    self.data = data
+
+                def read(self):
+                    return resolved(self.data)
+            if hasattr(asyncio, "coroutine"):
+                Reader.read = asyncio.coroutine(Reader.read)
+            else:
+                Reader.read._is_coroutine = getattr(
+                    asyncio.coroutines, "_is_coroutine", None)
+            if asyncio.iscoroutinefunction(Reader.read):
+                with open(os.path.join(HERE, "input", "rgb.png"), "rb") as f:
+                    reader = Reader(f.read())
+                self.assertEqual(loop.run_until_complete(
+                    img2pdf_async.convert_async(
+                        inputs[:3] + [reader], nodate=True,
+                        with_pdfrw=False)), expected.getvalue())
+            # with pdfrw and a process pool
+            inputs[3] = os.path.join(HERE, "input", "rgb.png")
+            self.assertEqual(loop.run_until_complete(
+                img2pdf_async.convert_async(inputs, nodate=True, workers=2)),
+                img2pdf.convert(inputs, nodate=True))
+            # the tracer is called from the thread of the event loop only
+            threads = set()
+            spans = []
+
+            def tracer(stage, start, end, attributes):
+                threads.add(threading.current_thread())
+                spans.append(stage)
+            loop.run_until_complete(img2pdf_async.convert_async(
+                inputs, nodate=True, with_pdfrw=False, tracer=tracer))
+            self.assertIn("layout", spans)
+            self.assertIn("write", spans)
+            self.assertEqual(threads, set([threading.current_thread()]))
+            # cancelling stops the remaining work
+            spans = []
+            inputs[1] = Chunks(b"", hang=True)
+            self.assertRaises(
+                asyncio.TimeoutError, loop.run_until_complete,
+                asyncio.wait_for(img2pdf_async.convert_async(
+                    inputs, nodate=True, tracer=tracer), 0.5))
+            self.assertIn("page", spans)
+            self.assertNotIn("write", spans)
+
+        def test_import(self):
+            import subprocess
+            srcdir = os.path.dirname(os.path.abspath(img2pdf.__file__))
+            # the heavy modules are only imported once they are needed
+            code = ("import sys; sys.path.insert(0, %r); import img2pdf; "
+                    "print(' '.join(m for m in ['PIL', 'pdfrw', 'argparse'] "
+                    "if m in sys.modules))" % srcdir)
+            output = subprocess.check_output([sys.executable, "-c", code])
+            self.assertEqual(output.strip(), b"")
+            if sys.version_info < (3, 7):
+                return
+            # a generous budget for the time that importing img2pdf takes
+            # including all the modules it imports, as measured by python
+            output = subprocess.check_output(
+                [sys.executable, "-X", "importtime", "-c",
+                 "import sys; sys.path.insert(0, %r); import img2pdf"
+                 % srcdir], stderr=subprocess.STDOUT)
+            for line in output.decode("ascii").splitlines():
+                fields = line.split("|")
+                if len(fields) == 3 and fields[2].strip() == "img2pdf":
+                    cumulative = int(fields[1])
+                    break
+            else:
+                self.fail("no import time of img2pdf")
+            self.assertLess(cumulative, 200000)
+
+        def test_server(self):
+            import base64
+            import json
+            import re
+            import threading
+            import time
+            try:
+                from http.client import HTTPConnection
+            except ImportError:
+                from httplib import HTTPConnection
+            server = img2pdf.get_server(("127.0.0.1", 0),
+                                        max_body_size=1000000)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+
+            def request(method, path, body=None, headers={}):
+                conn = HTTPConnection(*server.server_address[:2])
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                result = (response.status, response.getheader("Content-Type"),
+                          response.read())
+                conn.close()
+                return result
+            try:
+                jpg = os.path.join(HERE, "input", "normal.jpg")
+                png = os.path.join(HERE, "input", "normal.png")
+                with open(jpg, "rb") as f:
+                    jpgdata = f.read()
+                with open(png, "rb") as f:
+                    pngdata = f.read()
+                status, ctype, body = request(
+                    "POST", "/?nodate&pagesize=A4&title=T%C3%A4st", jpgdata)
+                self.assertEqual((status, ctype), (200, "application/pdf"))
+                self.assertEqual(body, img2pdf.convert(
+                    jpg, nodate=True, title=u"T\u00e4st",
+                    producer="img2pdf " + img2pdf.__version__,
+                    layout_fun=img2pdf.get_layout_fun(
+                        img2pdf.parse_pagesize_rectarg("A4"))))
+                # several images as multipart/form-data
+                multipart = b"".join(
+                    b"--XyZ\r\nContent-Disposition: form-data; name=\"f\"; "
+                    b"filename=\"f\"\r\n"
+                    b"Content-Type: application/octet-stream\r\n\r\n" +
+                    data + b"\r\n" for data in [pngdata, jpgdata])
+                multipart += b"--XyZ--\r\n"
+                status, ctype, body = request(
+                    "POST", "/?nodate&without-pdfrw", multipart,
+                    {"Content-Type": "multipart/form-data; boundary=XyZ"})
+                self.assertEqual(status, 200)
+                # the server writes the PDF while adding the pages
+                expected = BytesIO()
+                img2pdf.convert(png, jpg, nodate=True, with_pdfrw=False,
+                                producer="img2pdf " + img2pdf.__version__,
+                                outputstream=expected, streaming=True)
+                self.assertEqual(body, expected.getvalue())
+                # parts may be base64 encoded
+                status, ctype, body = request(
+                    "POST", "/?nodate&without-pdfrw",
+                    b"--XyZ\r\nContent-Transfer-Encoding: base64\r\n\r\n" +
+                    base64.b64encode(pngdata) + b"\r\n--XyZ\r\n\r\n" +
+                    jpgdata + b"\r\n--XyZ--\r\n",
+                    {"Content-Type": "multipart/form-data; boundary=XyZ"})
+                self.assertEqual((status, body), (200, expected.getvalue()))
+                for data in [b"--XyZ\r\n\r\n" + jpgdata, b"no delimiter"]:
+                    status, ctype, body = request(
+                        "POST", "/", data,
+                        {"Content-Type": "multipart/form-data; boundary=XyZ"})
+                    self.assertEqual(status, 400)
+                # errors
+                for path, data in [("/?out=x", jpgdata),
+                                   ("/?output=x", jpgdata),
+                                   ("/?max-body-size=1", jpgdata),
+                                   ("/?pagesize=foo", jpgdata),
+                                   ("/?viewer-initial-page=2", jpgdata),
+                                   ("/", b"garbage"), ("/", b"")]:
+                    status, ctype, body = request("POST", path, data)
+                    self.assertEqual(status, 400, path)
+                    self.assertTrue(body.startswith(b"error: "))
+                self.assertEqual(request("POST", "/foo", jpgdata)[0], 404)
+                self.assertEqual(request("GET", "/")[0], 404)
+                # a failed request does not break the connection
+                conn = HTTPConnection(*server.server_address[:2])
+                for path, status in [("/?pagesize=foo", 400), ("/foo", 404),
+                                     ("/?nodate", 200)]:
+                    conn.request("POST", path, jpgdata)
+                    response = conn.getresponse()
+                    response.read()
+                    self.assertEqual(response.status, status)
+                conn.close()
+                # requests on a kept-alive connection do not wait for
+                # delayed acknowledgements, which take about 40 ms
+                for path in ["/?nodate", "/?nodate&without-pdfrw"]:
+                    conn = HTTPConnection(*server.server_address[:2])
+                    latencies = []
+                    for _ in range(5):
+                        start = time.time()
+                        conn.request("POST", path, jpgdata)
+                        response = conn.getresponse()
+                        response.read()
+                        latencies.append(time.time() - start)
+                        self.assertEqual(response.status, 200)
+                    conn.close()
+                    self.assertLess(min(latencies[1:]), 0.03, path)
+                # invalid, too large or missing Content-Length
+                for length, status in [("-1", 400), ("x", 400),
+                                       ("1000001", 413), (None, 411)]:
+                    conn = HTTPConnection(*server.server_address[:2])
+                    conn.putrequest("POST", "/")
+                    if length is not None:
+                        conn.putheader("Content-Length", length)
+                    conn.endheaders()
+                    response = conn.getresponse()
+                    response.read()
+                    self.assertEqual(response.status, status)
+                    self.assertEqual(response.getheader("Connection"),
+                                     "close")
+                    conn.close()
+                status, ctype, body = request("GET", "/metrics")
+                self.assertEqual((status, ctype), (200, "application/json"))
+                metrics = json.loads(body.decode("ascii"))
+                self.assertEqual(metrics["requests"], 30)
+                self.assertEqual(metrics["failed"], 16)
+                self.assertEqual(metrics["in_flight"], 0)
+                self.assertEqual(metrics["pages"], 16)
+                self.assertEqual(metrics["latency"]["count"], 30)
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+            # the options of a request are options of the command line
+            usage = img2pdf.get_main_parser().format_help()
+            for option in img2pdf.server_options:
+                self.assertTrue(re.search(r"\s--%s[\s,]" % option, usage),
+                                option)
 
     for i, (psopt, isopt, border, fit, ao, pspdf1, ispdf1,
             pspdf2, ispdf2) in enumerate(layout_test_cases):
@@ -561,15 +1648,26 @@ def test_suite():
                 self.assertEqual(imgprops.Height, str(orig_img.size[1]))
                 # if the input file is a jpeg then it should've been copied
                 # verbatim into the PDF
-                if imgprops.Filter in [[PdfName.DCTDecode],
-                                       [PdfName.JPXDecode]]:
+                if imgprops.Filter == [PdfName.DCTDecode] and \
+                        orig_img.format == "TIFF":
+                    # JPEG data taken from a TIFF decodes to the same pixels
+                    im = Image.open(BytesIO(convert_store(
+                        cur_page.Resources.XObject.Im0.stream)))
+                    self.assertEqual(im.convert(orig_img.mode).tobytes(),
+                                     orig_img.tobytes())
+                elif imgprops.Filter in [[PdfName.DCTDecode],
+                                         [PdfName.JPXDecode]]:
                     self.assertEqual(
                         cur_page.Resources.XObject.Im0.stream,
                         convert_load(orig_imgdata))
                 elif imgprops.Filter == [PdfName.CCITTFaxDecode]:
+                    if imgprops.DecodeParms[0].BlackIs1 == 'true':
+                        photometric = 1
+                    else:
+                        photometric = 0
                     tiff_header = tiff_header_for_ccitt(
                         int(imgprops.Width), int(imgprops.Height),
-                        int(imgprops.Length), 4)
+                        int(imgprops.Length), 4, photometric)
                     imgio = BytesIO()
                     imgio.write(tiff_header)
                     imgio.write(convert_store(
@@ -582,6 +1680,28 @@ def test_suite():
                     except AttributeError:
                         pass
 
+                elif imgprops.Filter == [PdfName.FlateDecode] and \
+                        imgprops.DecodeParms is not None:
+                    # PNG image data copied verbatim with a PNG predictor
+                    decodeparms = imgprops.DecodeParms[0]
+                    self.assertEqual(decodeparms.Predictor, '15')
+                    self.assertEqual(decodeparms.Columns, imgprops.Width)
+                    self.assertEqual(decodeparms.BitsPerComponent,
+                                     imgprops.BitsPerComponent)
+                    if decodeparms.Colors == '1':
+                        colortype = 0
+                    else:
+                        colortype = 2
+                    imgio = BytesIO(png_for_idat(
+                        int(imgprops.Width), int(imgprops.Height),
+                        int(imgprops.BitsPerComponent), colortype,
+                        convert_store(cur_page.Resources.XObject.Im0.stream)))
+                    im = Image.open(imgio)
+                    self.assertEqual(im.tobytes(), orig_img.tobytes())
+                    try:
+                        im.close()
+                    except AttributeError:
+                        pass
                 elif imgprops.Filter == [PdfName.FlateDecode]:
                     # otherwise, the data is flate encoded and has to be equal
                     # to the pixel data of the input image